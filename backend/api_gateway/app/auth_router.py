@@ -1,12 +1,13 @@
 # backend/api_gateway/app/auth_router.py
 
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 # 依存関係とサービス、スキーマをインポート
 # (これらのファイルは別途作成・更新が必要です)
-from .dependencies import get_db_session, get_user_service, get_auth_service
+from .dependencies import get_async_db_session, get_user_service, get_auth_service
 from shared.services.user_service import UserService
 from shared.services.auth_service import AuthService
 from shared.schemas import UserCreate, UserPublic, Token
@@ -18,9 +19,9 @@ router = APIRouter(
 )
 
 @router.post("/register", response_model=UserPublic, status_code=status.HTTP_201_CREATED)
-def register_user(
+async def register_user(
     user_create: UserCreate,
-    db: Session = Depends(get_db_session),
+    db: AsyncSession = Depends(get_async_db_session),
     user_service: UserService = Depends(get_user_service),
 ):
     """
@@ -28,22 +29,25 @@ def register_user(
     成功すると、作成されたユーザー情報（パスワードなし）を返す。
     """
     # ユーザー名が既に存在するかチェック
-    db_user = user_service.get_by_username(db, username=user_create.username)
+    db_user = await db.run_sync(user_service.get_by_username, username=user_create.username)
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="このユーザー名は既に使用されています。",
         )
     
+    # bcryptの計算はCPUを占有するため、イベントループを止めないようスレッドプールで行う
+    hashed_password = await run_in_threadpool(user_service.auth_service.get_password_hash, user_create.password)
+
     # ユーザーを作成
-    created_user = user_service.create(db, user_create=user_create)
+    created_user = await db.run_sync(user_service.create, user_create=user_create, hashed_password=hashed_password)
     return created_user
 
 
 @router.post("/login", response_model=Token)
-def login_for_access_token(
+async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db_session),
+    db: AsyncSession = Depends(get_async_db_session),
     user_service: UserService = Depends(get_user_service),
     auth_service: AuthService = Depends(get_auth_service),
 ):
@@ -51,10 +55,10 @@ def login_for_access_token(
     ユーザーを認証し、JWTアクセストークンを発行するためのエンドポイント。
     """
     # ユーザー名でユーザーを検索
-    user = user_service.get_by_username(db, username=form_data.username)
+    user = await db.run_sync(user_service.get_by_username, username=form_data.username)
     
-    # ユーザーが存在しない、またはパスワードが間違っている場合
-    if not user or not auth_service.verify_password(form_data.password, user.hashed_password):
+    # ユーザーが存在しない、またはパスワードが間違っている場合（bcryptの検証はスレッドプールで行う）
+    if not user or not await run_in_threadpool(auth_service.verify_password, form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="ユーザー名またはパスワードが正しくありません。",
@@ -62,9 +66,10 @@ def login_for_access_token(
         )
     
     # アクセストークンを生成
-    # トークンのペイロード（中身）には、ユーザーを識別するための情報（ここではユーザー名）を入れる
+    # トークンのペイロード（中身）には、ユーザーを識別するための情報（ユーザー名・ID・トークンの世代）を入れる。
+    # IDと世代があれば、リクエストごとにDBを引かずにキャッシュからユーザーを特定できる
     access_token = auth_service.create_access_token(
-        data={"sub": user.username}
+        data={"sub": user.username, "uid": user.id, "ver": user.token_version or 0}
     )
     
     return {"access_token": access_token, "token_type": "bearer"}
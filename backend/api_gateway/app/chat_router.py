@@ -1,15 +1,42 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+import os
+import json
+import time
+import hashlib
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID, uuid4
-from celery.result import AsyncResult # Celeryの結果オブジェクトをインポート
 from kombu.exceptions import OperationalError
-from typing import List
+from typing import List, Optional
 
-from shared.schemas import ChatInput, ChatResponse, TaskResultResponse, HistoryTurn, LatestSessionResponse
-from shared.db.models import User
-from .dependencies import get_db_session, get_current_user
+from shared.schemas import ChatInput, ChatResponse, TaskResultResponse, TaskResultBatchResponse, HistoryTurn, LatestSessionResponse
+from shared.services.principal_cache import Principal
+from .dependencies import get_async_db_session, get_current_user
 from shared.celery_app import celery_app
 from shared.db import crud # crudをインポート
+from shared import worker_status
+from shared.redis_client import get_async_redis
+from shared.task_results import TaskState, wait_for_task_states
+from shared.streaming import stream_channel, stream_log_key, TERMINAL_EVENT_TYPES
+
+# ウォームアップ済みのワーカーがいない間はタスクを受け付けない（"false"で無効化）
+REQUIRE_WARM_WORKER = os.getenv("REQUIRE_WARM_WORKER", "true").lower() == "true"
+
+# SSEストリームの最大保持時間と、プロキシに切断されないためのkeep-alive間隔（秒）
+STREAM_TIMEOUT_SECONDS = int(os.getenv("STREAM_TIMEOUT_SECONDS", "300"))
+STREAM_KEEPALIVE_SECONDS = 15
+
+# 会話履歴の1ページあたりのターン数（既定値と上限）
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+HISTORY_PAGE_MAX_SIZE = int(os.getenv("HISTORY_PAGE_MAX_SIZE", "200"))
+
+# 結果の取得で、タスクの完了を待って応答を保留できる最大の時間（秒）。プロキシのタイムアウトより短くする
+RESULT_WAIT_MAX_SECONDS = float(os.getenv("RESULT_WAIT_MAX_SECONDS", "30"))
+# 一括取得で指定できるタスクIDの上限
+RESULT_BATCH_MAX_TASKS = int(os.getenv("RESULT_BATCH_MAX_TASKS", "50"))
 
 router = APIRouter(
     prefix="/chat",
@@ -19,20 +46,28 @@ router = APIRouter(
 
 
 @router.post("", response_model=ChatResponse, status_code=status.HTTP_202_ACCEPTED)
-def post_chat_message(
+async def post_chat_message(
     chat_input: ChatInput,
-    db: Session = Depends(get_db_session),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
 ) -> ChatResponse:
     """
     ユーザーからのチャットメッセージを受け取り、非同期タスクとして処理を開始する。
     """
     session_id = str(chat_input.session_id) if chat_input.session_id else str(uuid4())
 
+    if REQUIRE_WARM_WORKER and not await worker_status.get_ready_workers_async():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="応答可能なワーカーを準備中です。しばらくしてから再度お試しください。",
+            headers={"Retry-After": "5"},
+        )
+
     try:
-        task = celery_app.send_task(
+        # kombuのメッセージ送信は同期処理のため、イベントループを止めないようスレッドプールで実行する
+        task = await run_in_threadpool(
+            celery_app.send_task,
             'worker.app.tasks.run_chat_graph',
-            args=[current_user.id, session_id, chat_input.message]
+            args=[current_user.id, session_id, chat_input.message],
         )
         return ChatResponse(task_id=task.id, session_id=session_id)
     except OperationalError as e:
@@ -47,64 +82,215 @@ def post_chat_message(
         )
 
 
+def _to_result_response(task_state: TaskState) -> TaskResultResponse:
+    return TaskResultResponse(
+        task_id=task_state.task_id,
+        status=task_state.status,
+        ai_message=task_state.result,
+        detail=task_state.detail,
+    )
+
+
+@router.get("/results", response_model=TaskResultBatchResponse)
+async def get_task_results(
+    task_id: List[str] = Query(..., description="状態を取得するタスクID（複数指定可）"),
+    wait: float = Query(0, ge=0, le=RESULT_WAIT_MAX_SECONDS, description="いずれかのタスクが完了するまで待つ最大の秒数"),
+    current_user: Principal = Depends(get_current_user),
+):
+    """
+    複数のタスクの状態を一度に取得する。
+    wait を指定すると、指定したタスクがすべて未完了の間、いずれかが完了するまで応答を保留する。
+    """
+    task_ids = list(dict.fromkeys(task_id))
+    if len(task_ids) > RESULT_BATCH_MAX_TASKS:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"一度に指定できるタスクIDは {RESULT_BATCH_MAX_TASKS} 件までです。",
+        )
+    task_states = await wait_for_task_states(task_ids, wait)
+    return TaskResultBatchResponse(results=[_to_result_response(task_states[i]) for i in task_ids])
+
+
 @router.get("/results/{task_id}", response_model=TaskResultResponse)
-def get_task_result(task_id: str, current_user: User = Depends(get_current_user)):
+async def get_task_result(
+    task_id: str,
+    wait: float = Query(0, ge=0, le=RESULT_WAIT_MAX_SECONDS, description="タスクが完了するまで待つ最大の秒数"),
+    current_user: Principal = Depends(get_current_user),
+):
     """
     タスクIDを指定して、非同期処理の結果を取得する。
-    フロントエンドは、このエンドポイントをポーリングする。
+    wait を指定すると、タスクが完了するまで最大 wait 秒応答を保留する（ロングポーリング）。
+    ワーカーの完了通知で即座に応答するため、短い間隔で繰り返しポーリングする必要はない。
     """
-    task_result = AsyncResult(task_id, app=celery_app)
+    task_states = await wait_for_task_states([task_id], wait)
+    return _to_result_response(task_states[task_id])
+
+def _format_sse(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+async def _stream_task_events(task_id: str, request: Request):
+    """
+    ワーカーが発行したイベントをSSE形式で中継するジェネレーター。
+    先にチャンネルを購読してから発行済みのログを読み出し、連番(seq)で重複を除くことで、
+    購読開始前後のイベントを取りこぼさない。
+    """
+    client = get_async_redis()
+    pubsub = client.pubsub()
+    await pubsub.subscribe(stream_channel(task_id))
+    try:
+        last_seq = 0
+        for raw in await client.lrange(stream_log_key(task_id), 0, -1):
+            event = json.loads(raw)
+            last_seq = event["seq"]
+            yield _format_sse(event)
+            if event["type"] in TERMINAL_EVENT_TYPES:
+                return
+
+        deadline = time.monotonic() + STREAM_TIMEOUT_SECONDS
+        while time.monotonic() < deadline:
+            if await request.is_disconnected():
+                return
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=STREAM_KEEPALIVE_SECONDS)
+            if message is None:
+                yield ": keep-alive\n\n"
+                continue
+            event = json.loads(message["data"])
+            if event["seq"] <= last_seq:
+                continue
+            last_seq = event["seq"]
+            yield _format_sse(event)
+            if event["type"] in TERMINAL_EVENT_TYPES:
+                return
+
+        yield _format_sse({"seq": last_seq + 1, "type": "error", "detail": "応答の待機がタイムアウトしました。"})
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.aclose()
+
+
+@router.get("/stream/{task_id}")
+async def stream_task_result(task_id: str, request: Request, current_user: Principal = Depends(get_current_user)):
+    """
+    タスクの途中経過（progress）、LLMのトークン（token）、最終応答（done/error）を
+    Server-Sent Eventsとして配信する。ポーリングの代わりにこのエンドポイントを利用する。
+    """
+    return StreamingResponse(
+        _stream_task_events(task_id, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _history_etag(user_id: int, session_id: str, turns: List[int], has_more: bool) -> str:
+    """
+    会話履歴のページのETag。保存済みのターンは書き換えられず、(user_id, session_id, turn) で一意に決まるため、
+    ページに含まれるターン数の並びが同じであれば内容も同じになる。
+    """
+    digest = hashlib.sha1(f"{user_id}:{session_id}:{turns}:{has_more}".encode("utf-8")).hexdigest()
+    return f'W/"{digest[:20]}"'
+
+
+def _settled_last_modified(last_modified, newest_turn: Optional[int], session_last_turn: int, db_now):
+    """
+    ページの Last-Modified を、If-Modified-Since による再検証に使ってよい場合だけ返す（UTC）。
+    DATETIME は秒単位のため、最新の行と同じ秒に次のターンが保存されると更新日時が変わらない。
+    そこで、次のいずれかに当てはまる場合は Last-Modified を返さず、ETag だけで再検証させる。
+    - 最新のページで、セッションで採番済みのターン（chat_sessions.last_turn）がまだ保存されていない
+    - 更新日時が、DBの現在時刻と同じ秒である（この後の保存で同じ更新日時になりうる）
+    """
+    if last_modified is None:
+        return None
+    if newest_turn is not None and session_last_turn > newest_turn:
+        return None
+    if last_modified.replace(microsecond=0) >= db_now.replace(microsecond=0):
+        return None
+    return last_modified.replace(tzinfo=timezone.utc)
+
+
+def _is_not_modified(request: Request, etag: str, last_modified) -> bool:
+    """If-None-Match（優先）または If-Modified-Since から、クライアントのページが最新かどうかを判定する。"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        return last_modified.replace(microsecond=0) <= parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
 
-    if not task_result.ready():
-        # タスクがまだ完了していない場合
-        return TaskResultResponse(task_id=task_id, status="PENDING")
-    
-    if task_result.successful():
-        # タスクが成功した場合
-        result = task_result.get()
-        return TaskResultResponse(
-            task_id=task_id,
-            status="SUCCESS",
-            ai_message=result
-        )
-    else:
-        # タスクが失敗した場合
-        error_info = str(task_result.info)
-        return TaskResultResponse(
-            task_id=task_id,
-            status="FAILURE",
-            detail=error_info
-        )
 
 @router.get("/history/{session_id}", response_model=List[HistoryTurn])
-def get_chat_history(
+async def get_chat_history(
     session_id: str,
-    db: Session = Depends(get_db_session),
-    current_user: User = Depends(get_current_user)
+    request: Request,
+    response: Response,
+    before_turn: Optional[int] = Query(None, ge=1, description="このターンより前の履歴を取得する（省略時は最新から）"),
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_PAGE_MAX_SIZE),
+    db: AsyncSession = Depends(get_async_db_session),
+    current_user: Principal = Depends(get_current_user)
 ):
     """
-    指定されたセッションIDのチャット履歴を全て取得する。
+    指定されたセッションIDのチャット履歴を、before_turn より前の最新 limit ターン分、古い順に取得する。
+    さらに古い履歴がある場合は、次のページの before_turn を X-Next-Before-Turn ヘッダーで返す。
+    ETag / Last-Modified による条件付きリクエストで、変更が無ければ本文を読まずに 304 を返す。
     """
-    history = crud.get_history_by_session_id_all(db, session_id=session_id, user_id=current_user.id)
+    page_turns = await db.run_sync(
+        crud.get_history_page_turns, session_id=session_id, user_id=current_user.id, before_turn=before_turn, limit=limit
+    )
     
-    if not history:
+    if not page_turns and before_turn is None:
         # 履歴が見つからない場合は404エラーを返す
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="指定されたセッションのチャット履歴が見つかりません。",
         )
-    
-    return history
+
+    has_more = len(page_turns) > limit
+    page_turns = page_turns[:limit]
+    turns = [row.turn for row in page_turns]
+    last_modified = max((row.created_at for row in page_turns), default=None)
+    if last_modified is not None:
+        session_last_turn, db_now = await db.run_sync(
+            crud.get_session_turn_and_now, session_id=session_id, user_id=current_user.id
+        )
+        # 古いページは保存済みのターンだけで決まるため、採番済みのターンとの比較は最新のページでだけ行う
+        last_modified = _settled_last_modified(
+            last_modified, turns[0] if before_turn is None else None, session_last_turn, db_now
+        )
+
+    headers = {
+        "ETag": _history_etag(current_user.id, session_id, turns, has_more),
+        # ブラウザにキャッシュさせつつ、利用のたびに再検証させる
+        "Cache-Control": "private, no-cache",
+    }
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+    if has_more:
+        headers["X-Next-Before-Turn"] = str(turns[-1])
+
+    if _is_not_modified(request, headers["ETag"], last_modified):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    response.headers.update(headers)
+    if not turns:
+        return []
+    rows = await db.run_sync(
+        crud.get_history_page, session_id=session_id, user_id=current_user.id, from_turn=turns[-1], to_turn=turns[0]
+    )
+    return [row._asdict() for row in rows]
 
 @router.get("/sessions/latest", response_model=LatestSessionResponse)
-def get_latest_session(
-    db: Session = Depends(get_db_session),
-    current_user: User = Depends(get_current_user)
+async def get_latest_session(
+    db: AsyncSession = Depends(get_async_db_session),
+    current_user: Principal = Depends(get_current_user)
 ):
     """
     ログイン中のユーザーの最新の会話セッションIDを取得する。
     """
-    latest_session_id = crud.get_latest_session_id(db, user_id=current_user.id)
+    latest_session_id = await db.run_sync(crud.get_latest_session_id, user_id=current_user.id)
     
     # 履歴が全くないユーザーの場合は、session_idはnullになる
     return {"session_id": latest_session_id}
\ No newline at end of file
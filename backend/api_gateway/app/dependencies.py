@@ -1,15 +1,17 @@
 # backend/api_gateway/app/dependencies.py
 
+from typing import Optional
+
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError
-from sqlalchemy.orm import Session
+from pydantic import ValidationError
 
 # 関連するモジュールやサービスをインポート
-from shared.db.session import SessionLocal
+from shared.db.session import SessionLocal, get_async_sessionmaker
 from shared.services.auth_service import AuthService
 from shared.services.user_service import UserService
-from shared.db.models import User
+from shared.services.principal_cache import Principal, get_principal_cache
 from shared.schemas import TokenData
 
 # --- 依存関係を提供する関数の定義 ---
@@ -25,11 +27,20 @@ def get_db_session():
     finally:
         db.close()
 
-def get_auth_service() -> AuthService:
+async def get_async_db_session():
+    """
+    APIリクエストごとに非同期のデータベースセッションを提供する依存関係。
+    crud の関数は AsyncSession.run_sync で呼び出すことで、スレッドプールを使わずに実行できる。
+    """
+    async with get_async_sessionmaker()() as db:
+        yield db
+
+# 以下の依存関係は I/O を伴わないため async def とし、リクエストごとにスレッドプールを経由しないようにする
+async def get_auth_service() -> AuthService:
     """AuthServiceのインスタンスを提供する依存関係。"""
     return AuthService()
 
-def get_user_service(auth_service: AuthService = Depends(get_auth_service)) -> UserService:
+async def get_user_service(auth_service: AuthService = Depends(get_auth_service)) -> UserService:
     """UserServiceのインスタンスを提供する依存関係。AuthServiceに依存する。"""
     return UserService(auth_service=auth_service)
 
@@ -39,15 +50,44 @@ def get_user_service(auth_service: AuthService = Depends(get_auth_service)) -> U
 # OAuth2のパスワードフローを定義。tokenUrlはログインエンドポイントを指定。
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
-def get_current_user(
+def resolve_principal(token_data: TokenData, user_service: UserService, refresh: bool = False) -> Optional[Principal]:
+    """
+    トークンのユーザーを Principal として返す。キャッシュにあればDBには問い合わせない。
+    ユーザーIDを含まない古いトークンの場合は、ユーザー名でDBを引く。
+    refresh=True の場合はキャッシュを参照せずにDBから引き直し、キャッシュを更新する。
+    """
+    cache = get_principal_cache()
+    principal = None
+    if cache is not None and token_data.user_id is not None and not refresh:
+        principal = cache.get(token_data.user_id)
+
+    if principal is None:
+        # キャッシュに無い場合だけ、DBのセッションを開く
+        db = SessionLocal()
+        try:
+            if token_data.user_id is not None:
+                user = user_service.get_by_id(db, user_id=token_data.user_id)
+            else:
+                user = user_service.get_by_username(db, username=token_data.username)
+            if user is None:
+                return None
+            principal = Principal.from_user(user)
+        finally:
+            db.close()
+        if cache is not None:
+            cache.put(principal)
+    return principal
+
+async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db_session),
     auth_service: AuthService = Depends(get_auth_service),
     user_service: UserService = Depends(get_user_service),
-) -> User:
+) -> Principal:
     """
-    リクエストヘッダーのJWTトークンを検証し、
-    対応するユーザー情報をDBから取得する依存関係。
+    リクエストヘッダーのJWTトークンを検証し、対応するユーザー情報を取得する依存関係。
+    ユーザー情報はキャッシュから引くため、ポーリングなどの頻繁なリクエストでもDBへの問い合わせは発生しない。
+    プロセス内のキャッシュにある場合はイベントループ上で完結し、無い場合だけRedis・DBをスレッドプールで参照する。
+    ルーター全体の依存関係とエンドポイントの引数の両方で指定されても、FastAPIが1リクエストにつき1回だけ実行する。
     """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -55,22 +95,38 @@ def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    # トークンをデコードしてユーザー名を取得
-    username = auth_service.decode_token(token)
-    if username is None:
+    # トークンをデコードしてユーザー名・ユーザーID・トークンの世代を取得
+    claims = auth_service.decode_token_claims(token)
+    if claims is None:
         raise credentials_exception
     
     # TokenDataスキーマで型を検証（必須ではないが堅牢性が増す）
-    token_data = TokenData(username=username)
+    try:
+        token_data = TokenData(username=claims["sub"], user_id=claims.get("uid"), token_version=claims.get("ver", 0))
+    except ValidationError:
+        raise credentials_exception
 
-    # ユーザー名でDBからユーザー情報を取得
-    user = user_service.get_by_username(db, username=token_data.username)
-    if user is None:
+    cache = get_principal_cache()
+    principal = None
+    if cache is not None and token_data.user_id is not None:
+        principal = cache.get_local(token_data.user_id)
+    if principal is None:
+        principal = await run_in_threadpool(resolve_principal, token_data, user_service)
+    if principal is not None and token_data.token_version > principal.token_version:
+        # トークンの方が新しい場合は、キャッシュが古い（パスワードの変更を別のプロセスで行った直後など）。
+        # DBから引き直し、キャッシュを新しい世代で上書きする
+        principal = await run_in_threadpool(resolve_principal, token_data, user_service, True)
+    # パスワードの変更などで世代が進んだ後のトークンや、ユーザー名が一致しないトークンは受け付けない
+    if (
+        principal is None
+        or principal.username != token_data.username
+        or principal.token_version != token_data.token_version
+    ):
         raise credentials_exception
         
-    return user
+    return principal
 
-def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
+async def get_current_active_user(current_user: Principal = Depends(get_current_user)) -> Principal:
     """
     （オプション）ユーザーがアクティブかどうかをチェックするための依存関係。
     Userモデルに is_active カラムを追加した場合などに利用。
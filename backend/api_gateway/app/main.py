@@ -1,8 +1,11 @@
 # backend/api_gateway/app/main.py
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Response, status
 from fastapi.middleware.cors import CORSMiddleware
 
+from shared import worker_status
+from shared.db.pool import get_pool_metrics
+
 # 作成したルーターをインポート
 from . import auth_router
 from . import chat_router
@@ -29,6 +32,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # 会話履歴の条件付き取得とページングに使うヘッダーを、ブラウザのスクリプトから読めるようにする
+    expose_headers=["ETag", "Last-Modified", "X-Next-Before-Turn"],
 )
 
 # アプリケーションにルーターを登録
@@ -36,8 +41,27 @@ app.include_router(auth_router.router)
 app.include_router(chat_router.router)
 
 @app.get("/", tags=["Root"])
-def read_root():
+async def read_root():
     """
     APIサーバーが正常に動作しているかを確認するためのルートエンドポイント。
     """
-    return {"message": "Welcome to the Open Campus Guidance LLM API!"}
\ No newline at end of file
+    return {"message": "Welcome to the Open Campus Guidance LLM API!"}
+
+@app.get("/health/ready", tags=["Root"])
+async def read_worker_readiness(response: Response):
+    """
+    ウォームアップ済みのワーカーが存在するかを返すエンドポイント。
+    ロードバランサーやフロントエンドが、応答可能な状態かを判断するために利用する。
+    """
+    workers = await worker_status.get_ready_workers_async()
+    if not workers:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return {"ready": bool(workers), "workers": workers}
+
+@app.get("/health/db-pool", tags=["Root"])
+async def read_db_pool_metrics():
+    """
+    DBの接続プールの状態（貸し出し中・オーバーフローの接続数、貸し出し待ち・接続確立の時間など）を返すエンドポイント。
+    負荷が高いときに、接続プールがボトルネックになっているかを判断するために利用する。
+    """
+    return get_pool_metrics()
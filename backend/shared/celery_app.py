@@ -7,6 +7,12 @@ from celery import Celery
 broker_url = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
 result_backend_url = os.getenv("CELERY_RESULT_BACKEND", "redis://redis:6379/1")
 
+# 会話の要約など、ユーザーが応答を待っていないタスクを流すキュー。
+# 応答を生成するワーカー（worker）は既定のキュー（celery）だけを処理し、このキューは
+# 要約用のワーカー（summary_worker, `-Q background`）が処理する。
+# 同じキューに流すと、concurrency=1 のワーカーでは要約のLLM呼び出しが次の質問の応答を待たせてしまう。
+BACKGROUND_QUEUE = os.getenv("CELERY_BACKGROUND_QUEUE", "background")
+
 # Celeryアプリケーションのインスタンスを作成
 celery_app = Celery(
     "worker",
@@ -25,4 +31,9 @@ celery_app.conf.update(
     # タスクが成功または失敗した後にブローカーに通知（ack）を送る
     # これにより、ワーカーが処理中にクラッシュしてもタスクが失われない
     task_acks_late=True,
+
+    # タスクごとの送り先のキュー。ここに無いタスクは既定のキュー（celery）に送られる
+    task_routes={
+        "worker.app.tasks.update_conversation_summary": {"queue": BACKGROUND_QUEUE},
+    },
 )
@@ -1,8 +1,11 @@
 from sqlalchemy.orm import Session
 from . import models
 from typing import List
-from sqlalchemy import func
-from typing import List, Optional
+from sqlalchemy import func, insert
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from typing import Dict, List, Optional
 
 def get_history_by_session_id(db: Session, session_id: str, user_id: int):
     """
@@ -42,6 +45,44 @@ def create_history_record(
     db.refresh(db_history)
     return db_history
 
+def bulk_create_history_records(db: Session, rows: List[Dict]) -> int:
+    """
+    複数の会話のターンを1回の INSERT でまとめて保存する。
+    (user_id, session_id, turn) が既に存在するターンは無視するため、同じ行を何度渡しても結果は変わらない。
+    無視するのは一意制約の重複だけで、外部キー違反などの他のエラーは例外になる
+    （MySQLの INSERT IGNORE はそれらも警告に格下げしてしまうため使わない）。
+    登録された行数を返す（MySQLでは、重複して無視した行も数えられる）。
+    """
+    if not rows:
+        return 0
+    table = models.ConversationHistory.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        statement = mysql_insert(table)
+        # 重複した場合は何も変えない更新（id = id）にする
+        statement = statement.on_duplicate_key_update(id=table.c.id)
+    elif dialect == "sqlite":
+        statement = sqlite_insert(table).on_conflict_do_nothing(index_elements=["user_id", "session_id", "turn"])
+    else:
+        statement = insert(table)
+    result = db.execute(statement, rows)
+    db.commit()
+    return result.rowcount if result.rowcount is not None and result.rowcount >= 0 else len(rows)
+
+def get_latest_turn(db: Session, session_id: str, user_id: int) -> int:
+    """
+    セッションで保存済みの最後のターン数を返す。まだ会話が無ければ0。
+    """
+    latest = (
+        db.query(func.max(models.ConversationHistory.turn))
+        .filter(
+            models.ConversationHistory.user_id == user_id,
+            models.ConversationHistory.session_id == session_id,
+        )
+        .scalar()
+    )
+    return latest or 0
+
 def get_history_by_session_id_all(db: Session, session_id: str, user_id: int) -> List[models.ConversationHistory]:
     """
     指定されたセッションの全ての会話履歴を、投稿順（昇順）に取得する。
@@ -56,17 +97,171 @@ def get_history_by_session_id_all(db: Session, session_id: str, user_id: int) ->
         .all()
     )
 
+def get_history_page_turns(db: Session, session_id: str, user_id: int, before_turn: Optional[int], limit: int):
+    """
+    履歴のページに含まれるターン数と作成日時を、新しい順に最大 limit + 1 件取得する（limit + 1 件目は次のページの有無の判定用）。
+    (user_id, session_id, turn) のインデックスを範囲検索して対象の行を絞る。created_at（Last-Modified に使う）は
+    インデックスに含まれないため行自体も参照するが、読むのはページ分の limit + 1 行だけで、セッションの長さには比例しない。
+    """
+    query = db.query(models.ConversationHistory.turn, models.ConversationHistory.created_at).filter(
+        models.ConversationHistory.user_id == user_id,
+        models.ConversationHistory.session_id == session_id,
+    )
+    if before_turn is not None:
+        query = query.filter(models.ConversationHistory.turn < before_turn)
+    return query.order_by(models.ConversationHistory.turn.desc()).limit(limit + 1).all()
+
+def get_session_turn_and_now(db: Session, session_id: str, user_id: int):
+    """
+    セッションで最後に採番したターン数（セッションが無ければ0）と、DBの現在時刻を1回の問い合わせで返す。
+    現在時刻は created_at と同じDBの時計で、会話履歴の Last-Modified が確定しているかの判定に使う。
+    """
+    last_turn = (
+        db.query(models.ChatSession.last_turn)
+        .filter(models.ChatSession.user_id == user_id, models.ChatSession.session_id == session_id)
+        .scalar_subquery()
+    )
+    row = db.query(func.coalesce(last_turn, 0), func.now()).one()
+    return row[0], row[1]
+
+def get_history_page(db: Session, session_id: str, user_id: int, from_turn: int, to_turn: int):
+    """
+    from_turn 以上 to_turn 以下の会話履歴を、古い順に取得する。
+    ORMのインスタンスではなく、(turn, human_message, ai_message) の列だけを返す。
+    """
+    return (
+        db.query(
+            models.ConversationHistory.turn,
+            models.ConversationHistory.human_message,
+            models.ConversationHistory.ai_message,
+        )
+        .filter(
+            models.ConversationHistory.user_id == user_id,
+            models.ConversationHistory.session_id == session_id,
+            models.ConversationHistory.turn >= from_turn,
+            models.ConversationHistory.turn <= to_turn,
+        )
+        .order_by(models.ConversationHistory.turn.asc())
+        .all()
+    )
+
 def get_latest_session_id(db: Session, user_id: int) -> Optional[str]:
     """
     指定されたユーザーIDの、最も新しい会話セッションのIDを取得する。
+    chat_sessions の (user_id, last_activity) インデックスを使うため、履歴の量によらず一定の時間で済む。
     """
     latest_session = (
-        db.query(models.ConversationHistory.session_id)
-        .filter(models.ConversationHistory.user_id == user_id)
-        .group_by(models.ConversationHistory.session_id)
-        .order_by(func.max(models.ConversationHistory.created_at).desc()) # 最終更新日時で降順ソート
+        db.query(models.ChatSession.session_id)
+        .filter(models.ChatSession.user_id == user_id)
+        .order_by(models.ChatSession.last_activity.desc(), models.ChatSession.id.desc()) # 最終更新日時で降順ソート
         .first() # 最初の1件のみ取得
     )
     
     # 結果が存在すればsession_idを、存在しなければNoneを返す
-    return latest_session.session_id if latest_session else None
\ No newline at end of file
+    return latest_session.session_id if latest_session else None
+
+def allocate_turn(db: Session, session_id: str, user_id: int) -> int:
+    """
+    セッションの次のターン数を採番して返す。
+    chat_sessions の行を UPDATE で加算してから読み出すため、同じセッションへの同時のリクエストにも
+    別々のターン数が割り当てられる（行ロックはコミットまで保持される）。
+    """
+    session_filter = (
+        models.ChatSession.user_id == user_id,
+        models.ChatSession.session_id == session_id,
+    )
+    for _ in range(2):
+        updated = (
+            db.query(models.ChatSession)
+            .filter(*session_filter)
+            .update(
+                {
+                    models.ChatSession.last_turn: models.ChatSession.last_turn + 1,
+                    models.ChatSession.last_activity: func.now(),
+                },
+                synchronize_session=False,
+            )
+        )
+        if updated:
+            turn = db.query(models.ChatSession.last_turn).filter(*session_filter).scalar()
+            db.commit()
+            return turn
+
+        # セッションの最初のターン。chat_sessions が無かった頃の履歴があれば、その続きから採番する
+        turn = get_latest_turn(db, session_id, user_id) + 1
+        db.add(models.ChatSession(user_id=user_id, session_id=session_id, last_turn=turn))
+        try:
+            db.commit()
+            return turn
+        except IntegrityError:
+            # 同時に別のリクエストが行を作成した場合は、UPDATE からやり直す
+            db.rollback()
+    raise RuntimeError(f"セッション {session_id} のターン数を採番できませんでした。")
+
+def get_history_after_turn(db: Session, session_id: str, user_id: int, after_turn: int, limit: int = 5) -> List[models.ConversationHistory]:
+    """
+    指定したターンより後の会話履歴を、新しい順に最大 limit 件取得する。
+    """
+    return (
+        db.query(models.ConversationHistory)
+        .filter(
+            models.ConversationHistory.user_id == user_id,
+            models.ConversationHistory.session_id == session_id,
+            models.ConversationHistory.turn > after_turn,
+        )
+        .order_by(models.ConversationHistory.turn.desc())
+        .limit(limit)
+        .all()
+    )
+
+def get_history_turn_range(db: Session, session_id: str, user_id: int, after_turn: int, up_to_turn: int) -> List[models.ConversationHistory]:
+    """
+    after_turn より後、up_to_turn 以前の会話履歴を、古い順に取得する。
+    """
+    return (
+        db.query(models.ConversationHistory)
+        .filter(
+            models.ConversationHistory.user_id == user_id,
+            models.ConversationHistory.session_id == session_id,
+            models.ConversationHistory.turn > after_turn,
+            models.ConversationHistory.turn <= up_to_turn,
+        )
+        .order_by(models.ConversationHistory.turn.asc())
+        .all()
+    )
+
+def get_conversation_summary(db: Session, session_id: str, user_id: int) -> Optional[models.ConversationSummary]:
+    """
+    セッションの会話の要約を取得する。まだ要約が無ければNoneを返す。
+    """
+    return (
+        db.query(models.ConversationSummary)
+        .filter(
+            models.ConversationSummary.user_id == user_id,
+            models.ConversationSummary.session_id == session_id,
+        )
+        .first()
+    )
+
+def save_conversation_summary(db: Session, session_id: str, user_id: int, summary: str, summarized_turn: int) -> models.ConversationSummary:
+    """
+    セッションの会話の要約を作成・更新する。
+    既により新しいターンまで要約済みの場合（後から古い更新が届いた場合）は上書きしない。
+    """
+    record = get_conversation_summary(db, session_id, user_id)
+    if record is None:
+        record = models.ConversationSummary(
+            user_id=user_id,
+            session_id=session_id,
+            summary=summary,
+            summarized_turn=summarized_turn,
+        )
+        db.add(record)
+    elif summarized_turn > record.summarized_turn:
+        record.summary = summary
+        record.summarized_turn = summarized_turn
+    else:
+        return record
+    db.commit()
+    db.refresh(record)
+    return record
@@ -1,6 +1,6 @@
 # backend/worker/app/db/models.py
 
-from sqlalchemy import Column, Integer, String, DateTime, func, Index, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, DateTime, func, Index, ForeignKey, Text, UniqueConstraint
 from sqlalchemy.orm import declarative_base, relationship
 
 # SQLAlchemyのモデルを定義するための基本クラス
@@ -21,11 +21,17 @@ class User(Base):
     
     # 3. ハッシュ化されたパスワード
     hashed_password = Column(String(255), nullable=False, comment="ハッシュ化されたパスワード")
+
+    # 4. トークンの世代。パスワードの変更時に加算し、それ以前に発行したトークンを無効にする
+    token_version = Column(Integer, nullable=False, default=0, server_default="0", comment="発行済みトークンの世代")
     
     created_at = Column(DateTime, nullable=False, server_default=func.now(), comment="ユーザー作成日時")
 
     # UserとConversationHistoryの1対多の関係を定義
     histories = relationship("ConversationHistory", back_populates="user", cascade="all, delete-orphan")
+    # ユーザーの削除時に、セッションの状態と会話の要約も削除する
+    chat_sessions = relationship("ChatSession", back_populates="user", cascade="all, delete-orphan")
+    conversation_summaries = relationship("ConversationSummary", back_populates="user", cascade="all, delete-orphan")
 
     def __repr__(self):
         return f"<User(id={self.id}, username='{self.username}')>"
@@ -51,11 +57,61 @@ class ConversationHistory(Base):
     # ConversationHistoryモデルからUserモデルにアクセスするためのリレーションシップ
     user = relationship("User", back_populates="histories")
     
-    # 検索パフォーマンス向上のためのインデックス
     __table_args__ = (
-        Index('ix_user_id_session_id', 'user_id', 'session_id'),
+        # 書き込みの再試行などで同じターンが二重に登録されないようにする。
+        # (user_id, session_id) での検索や、ターン順の並び替え・範囲指定もこのインデックスで済む
+        UniqueConstraint('user_id', 'session_id', 'turn', name='uq_history_user_id_session_id_turn'),
     )
 
     def __repr__(self):
         return f"<ConversationHistory(user_id={self.user_id}, session_id='{self.session_id}')>"
 
+
+class ChatSession(Base):
+    """
+    チャットセッションごとの最新の状態を格納するテーブル。
+    ターン数の採番と、ユーザーの最新のセッションの検索を、会話履歴を集計せずに行うために使う。
+    """
+    __tablename__ = 'chat_sessions'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, comment="会話の所有者を示すユーザーID (users.id)")
+    session_id = Column(String(255), nullable=False, comment="チャットセッションごとのID")
+    last_turn = Column(Integer, nullable=False, default=0, comment="セッションで最後に採番したターン数")
+    last_activity = Column(DateTime, nullable=False, server_default=func.now(), comment="最後にターンを採番した日時")
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+
+    user = relationship("User", back_populates="chat_sessions")
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'session_id', name='uq_chat_session_user_id_session_id'),
+        # ユーザーの最新のセッションを、インデックスの先頭の1件として取得する
+        Index('ix_chat_session_user_id_last_activity', 'user_id', 'last_activity'),
+    )
+
+    def __repr__(self):
+        return f"<ChatSession(user_id={self.user_id}, session_id='{self.session_id}', last_turn={self.last_turn})>"
+
+
+class ConversationSummary(Base):
+    """
+    セッションごとの会話の要約を格納するテーブル。
+    直近のターンより前の会話は要約だけをプロンプトに含め、プロンプトの長さを抑える。
+    """
+    __tablename__ = 'conversation_summaries'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, comment="会話の所有者を示すユーザーID (users.id)")
+    session_id = Column(String(255), nullable=False, comment="チャットセッションごとのID")
+    summary = Column(Text, nullable=False, comment="summarized_turn までの会話の要約")
+    summarized_turn = Column(Integer, nullable=False, default=0, comment="要約に含めた最後のターン数")
+    updated_at = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now())
+
+    user = relationship("User", back_populates="conversation_summaries")
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'session_id', name='uq_summary_user_id_session_id'),
+    )
+
+    def __repr__(self):
+        return f"<ConversationSummary(user_id={self.user_id}, session_id='{self.session_id}', summarized_turn={self.summarized_turn})>"
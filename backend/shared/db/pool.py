@@ -0,0 +1,206 @@
+# backend/shared/db/pool.py
+
+import os
+import time
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+# API Gateway・ワーカー・スクリプトで同時実行数が大きく異なるため、接続プールの設定をプロファイルとして切り替える。
+# プロファイルは DB_POOL_PROFILE で選び、個々の値は DB_POOL_SIZE などの環境変数で上書きできる。
+DB_POOL_PROFILE = os.getenv("DB_POOL_PROFILE", "script")
+
+
+@dataclass(frozen=True)
+class PoolProfile:
+    pool_size: int
+    max_overflow: int
+    # 接続が空くのを待つ最大の時間（秒）。超えると TimeoutError になる
+    pool_timeout: float
+    # この秒数より古い接続は作り直す。MySQLの wait_timeout より短くし、"MySQL server has gone away" を防ぐ
+    pool_recycle: int
+    # 接続を貸し出す前に生存確認を行う
+    pool_pre_ping: bool = True
+
+
+POOL_PROFILES: Dict[str, PoolProfile] = {
+    # 非同期のエンドポイントが多数同時に動くため、大きめのプールにする
+    "gateway": PoolProfile(pool_size=10, max_overflow=20, pool_timeout=10, pool_recycle=1800),
+    # タスク・会話履歴の書き込み・要約のスレッド程度しか同時に使わない
+    "worker": PoolProfile(pool_size=3, max_overflow=2, pool_timeout=30, pool_recycle=1800),
+    # 一度きりのスクリプト。接続を溜め込まない
+    "script": PoolProfile(pool_size=1, max_overflow=2, pool_timeout=60, pool_recycle=3600),
+}
+
+
+def get_pool_profile(name: str = DB_POOL_PROFILE) -> PoolProfile:
+    """プロファイルを返す。環境変数で指定された値があれば、プロファイルの値より優先する。"""
+    if name not in POOL_PROFILES:
+        raise ValueError(f"不明な接続プールのプロファイルです: {name} (選択肢: {', '.join(POOL_PROFILES)})")
+    profile = POOL_PROFILES[name]
+    return PoolProfile(
+        pool_size=int(os.getenv("DB_POOL_SIZE", profile.pool_size)),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", profile.max_overflow)),
+        pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", profile.pool_timeout)),
+        pool_recycle=int(os.getenv("DB_POOL_RECYCLE", profile.pool_recycle)),
+        pool_pre_ping=os.getenv("DB_POOL_PRE_PING", str(profile.pool_pre_ping)).lower() == "true",
+    )
+
+
+class PoolMetrics:
+    """接続プールの計測値。貸し出し待ちの時間・接続の確立にかかった時間・無効化された接続の数などを集計する。"""
+
+    def __init__(self, name: str, profile_name: str):
+        self.name = name
+        self.profile_name = profile_name
+        self.pool = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "checkouts": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "timeouts": 0,
+            "connects": 0,
+            "connect_seconds_total": 0.0,
+            "connect_seconds_max": 0.0,
+            # pre_ping で切断が見つかった場合や、接続エラーで破棄された接続の数
+            "invalidations": 0,
+        }
+
+    def record_wait(self, seconds: float, timed_out: bool = False) -> None:
+        with self._lock:
+            if timed_out:
+                self._stats["timeouts"] += 1
+            else:
+                self._stats["checkouts"] += 1
+                self._stats["wait_seconds_total"] += seconds
+            self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], seconds)
+
+    def record_connect(self, seconds: float) -> None:
+        with self._lock:
+            self._stats["connects"] += 1
+            self._stats["connect_seconds_total"] += seconds
+            self._stats["connect_seconds_max"] = max(self._stats["connect_seconds_max"], seconds)
+
+    def record_invalidation(self) -> None:
+        with self._lock:
+            self._stats["invalidations"] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        checkouts = stats.pop("checkouts")
+        connects = stats.pop("connects")
+        wait_total = stats.pop("wait_seconds_total")
+        connect_total = stats.pop("connect_seconds_total")
+        result = {
+            "profile": self.profile_name,
+            "checkouts": checkouts,
+            "wait_ms_avg": round(wait_total / checkouts * 1000, 3) if checkouts else 0.0,
+            "wait_ms_max": round(stats.pop("wait_seconds_max") * 1000, 3),
+            "timeouts": stats.pop("timeouts"),
+            "connects": connects,
+            "connect_ms_avg": round(connect_total / connects * 1000, 3) if connects else 0.0,
+            "connect_ms_max": round(stats.pop("connect_seconds_max") * 1000, 3),
+            "invalidations": stats.pop("invalidations"),
+        }
+        pool = self.pool
+        if isinstance(pool, QueuePool):
+            result.update({
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                # 負の値は、pool_size に満たない数しか接続を作っていないことを表す
+                "overflow": pool.overflow(),
+            })
+        return result
+
+
+class _TimedCheckoutMixin:
+    """接続の貸し出しを待った時間を PoolMetrics に記録する（SQLAlchemyには貸し出し前のイベントが無いため）。"""
+
+    _pool_metrics: Optional[PoolMetrics] = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            if self._pool_metrics is not None:
+                self._pool_metrics.record_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        if self._pool_metrics is not None:
+            self._pool_metrics.record_wait(time.perf_counter() - started)
+        return connection
+
+    def recreate(self):
+        # engine.dispose() などで作り直されたプールにも、同じ計測先を引き継ぐ
+        pool = super().recreate()
+        pool._pool_metrics = self._pool_metrics
+        if self._pool_metrics is not None:
+            self._pool_metrics.pool = pool
+        return pool
+
+
+class InstrumentedQueuePool(_TimedCheckoutMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncAdaptedQueuePool(_TimedCheckoutMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+_metrics_registry: Dict[str, PoolMetrics] = {}
+
+
+def engine_options(url: str, profile_name: str = DB_POOL_PROFILE, async_engine: bool = False) -> dict:
+    """create_engine / create_async_engine に渡す接続プールの設定。"""
+    profile = get_pool_profile(profile_name)
+    options = {"pool_pre_ping": profile.pool_pre_ping}
+    if url.startswith("sqlite"):
+        # SQLiteは接続が軽く、既定のプールをそのまま使う
+        return options
+    options.update(
+        poolclass=InstrumentedAsyncAdaptedQueuePool if async_engine else InstrumentedQueuePool,
+        pool_size=profile.pool_size,
+        max_overflow=profile.max_overflow,
+        pool_timeout=profile.pool_timeout,
+        pool_recycle=profile.pool_recycle,
+    )
+    return options
+
+
+def instrument_engine(engine, name: str, profile_name: str = DB_POOL_PROFILE) -> PoolMetrics:
+    """
+    エンジンに計測用のイベントを登録し、PoolMetrics を返す。
+    非同期エンジンの場合は engine.sync_engine を渡す。
+    """
+    metrics = PoolMetrics(name, profile_name)
+    metrics.pool = engine.pool
+    if isinstance(engine.pool, _TimedCheckoutMixin):
+        engine.pool._pool_metrics = metrics
+
+    @event.listens_for(engine, "do_connect")
+    def _before_connect(dialect, connection_record, cargs, cparams):
+        connection_record.info["_connect_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        started = connection_record.info.pop("_connect_started", None)
+        if started is not None:
+            metrics.record_connect(time.perf_counter() - started)
+
+    @event.listens_for(engine, "invalidate")
+    def _on_invalidate(dbapi_connection, connection_record, exception):
+        metrics.record_invalidation()
+
+    _metrics_registry[name] = metrics
+    return metrics
+
+
+def get_pool_metrics() -> Dict[str, dict]:
+    """このプロセスで作成したエンジンごとの、接続プールの計測値を返す。"""
+    return {name: metrics.snapshot() for name, metrics in _metrics_registry.items()}
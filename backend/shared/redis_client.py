@@ -0,0 +1,38 @@
+# backend/shared/redis_client.py
+
+import os
+import threading
+
+import redis
+import redis.asyncio as aioredis
+
+# Celeryの結果バックエンドと同じRedisを、ワーカー状態などの共有データ置き場として使う
+REDIS_URL = os.getenv("REDIS_URL", os.getenv("CELERY_RESULT_BACKEND", "redis://redis:6379/1"))
+
+_redis_client = None
+_async_redis_client = None
+_redis_lock = threading.Lock()
+
+
+def get_redis() -> redis.Redis:
+    """
+    プロセス内で共有する同期Redisクライアントを返す。
+    接続プールはクライアント内部で管理されるため、初回呼び出し時に一度だけ生成する。
+    """
+    global _redis_client
+    if _redis_client is None:
+        with _redis_lock:
+            if _redis_client is None:
+                _redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+    return _redis_client
+
+
+def get_async_redis() -> aioredis.Redis:
+    """
+    API Gatewayのイベントループ上で共有する非同期Redisクライアントを返す。
+    pub/subの購読など、リクエストを長時間保持する処理で利用する。
+    """
+    global _async_redis_client
+    if _async_redis_client is None:
+        _async_redis_client = aioredis.Redis.from_url(REDIS_URL, decode_responses=True)
+    return _async_redis_client
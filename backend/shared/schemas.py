@@ -20,6 +20,8 @@ class TokenData(BaseModel):
     JWTトークンのペイロード（中身）のデータ形式。
     """
     username: Optional[str] = None
+    user_id: Optional[int] = None
+    token_version: int = 0
 
 
 # =======================================
@@ -83,10 +85,18 @@ class TaskResultResponse(BaseModel):
     ai_message: Optional[str] = None
     detail: Optional[str] = None # 失敗時の詳細情報
 
+
+class TaskResultBatchResponse(BaseModel):
+    """
+    複数のタスクの結果を一括で取得するエンドポイントのレスポンス。指定したタスクIDの順に並ぶ。
+    """
+    results: List[TaskResultResponse]
+
 class HistoryTurn(BaseModel):
     """
     会話履歴の1ターン分を表すスキーマ
     """
+    turn: int
     human_message: str
     ai_message: str
 
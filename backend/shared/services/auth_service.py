@@ -72,6 +72,25 @@ class AuthService:
         encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
         return encoded_jwt
 
+    def decode_token_claims(self, token: str) -> Optional[dict]:
+        """
+        JWTトークンを検証し、ペイロード全体を返します。
+
+        Args:
+            token: デコードするJWTトークン。
+
+        Returns:
+            トークンが有効であればペイロード（sub: ユーザー名, uid: ユーザーID, ver: トークンの世代）、
+            無効であればNone。
+        """
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
+            return None
+        if payload.get("sub") is None:
+            return None
+        return payload
+
     def decode_token(self, token: str) -> Optional[str]:
         """
         JWTトークンをデコードし、ペイロードからユーザー名を抽出します。
@@ -0,0 +1,167 @@
+# backend/shared/services/principal_cache.py
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 認証済みユーザーの情報をキャッシュし、リクエストごとのDB問い合わせを省くか
+PRINCIPAL_CACHE_ENABLED = os.getenv("PRINCIPAL_CACHE_ENABLED", "true").lower() == "true"
+# プロセス内のキャッシュの有効期間（秒）。他のプロセスで無効化された場合も、この時間が経てば反映される
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+# プロセス内に保持するユーザー数の上限。超えた場合は最も古く使われたものから捨てる
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
+# Redisにもキャッシュし、複数のプロセス・コンテナでDBへの問い合わせを共有するか
+PRINCIPAL_CACHE_REDIS_ENABLED = os.getenv("PRINCIPAL_CACHE_REDIS_ENABLED", "true").lower() == "true"
+PRINCIPAL_CACHE_REDIS_TTL_SECONDS = int(os.getenv("PRINCIPAL_CACHE_REDIS_TTL_SECONDS", "600"))
+PRINCIPAL_CACHE_KEY_PREFIX = "auth:principal:"
+
+
+@dataclass(frozen=True)
+class Principal:
+    """
+    認証済みのユーザー。リクエストの処理に必要な項目だけを持ち、DBのセッションに依存しない。
+    token_version はトークンの失効に使い、パスワードの変更などで加算される。
+    """
+    id: int
+    username: str
+    token_version: int = 0
+
+    @classmethod
+    def from_user(cls, user) -> "Principal":
+        return cls(id=user.id, username=user.username, token_version=user.token_version or 0)
+
+
+class PrincipalCache:
+    """
+    ユーザーIDから Principal を引く、件数の上限と有効期間つきのキャッシュ。
+    プロセス内の LRU を先に参照し、無ければ（設定されていれば）Redis を参照する。
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = PRINCIPAL_CACHE_TTL_SECONDS,
+        max_entries: int = PRINCIPAL_CACHE_MAX_ENTRIES,
+        redis_client=None,
+        redis_ttl_seconds: int = PRINCIPAL_CACHE_REDIS_TTL_SECONDS,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.redis_client = redis_client
+        self.redis_ttl_seconds = redis_ttl_seconds
+        self._entries: "OrderedDict[int, Tuple[float, Principal]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, int] = {"hits": 0, "redis_hits": 0, "misses": 0, "invalidations": 0, "redis_errors": 0}
+
+    @staticmethod
+    def _redis_key(user_id: int) -> str:
+        return f"{PRINCIPAL_CACHE_KEY_PREFIX}{user_id}"
+
+    def get_local(self, user_id: int) -> Optional[Principal]:
+        """プロセス内のキャッシュだけを参照する。I/Oを伴わないため、イベントループ上で直接呼べる。"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                expires_at, principal = entry
+                if expires_at > now:
+                    self._entries.move_to_end(user_id)
+                    self._stats["hits"] += 1
+                    return principal
+                del self._entries[user_id]
+        return None
+
+    def get(self, user_id: int) -> Optional[Principal]:
+        principal = self.get_local(user_id)
+        if principal is not None:
+            return principal
+
+        if self.redis_client is not None:
+            try:
+                raw = self.redis_client.get(self._redis_key(user_id))
+            except Exception as e:
+                raw = None
+                self._count("redis_errors")
+                logger.warning(f"ユーザー情報のキャッシュ（Redis）の参照に失敗しました: {e}")
+            if raw:
+                principal = Principal(**json.loads(raw))
+                self._put_local(principal)
+                self._count("redis_hits")
+                return principal
+
+        self._count("misses")
+        return None
+
+    def put(self, principal: Principal) -> None:
+        self._put_local(principal)
+        if self.redis_client is not None:
+            try:
+                self.redis_client.set(
+                    self._redis_key(principal.id),
+                    json.dumps(asdict(principal), ensure_ascii=False),
+                    ex=self.redis_ttl_seconds,
+                )
+            except Exception as e:
+                self._count("redis_errors")
+                logger.warning(f"ユーザー情報のキャッシュ（Redis）の保存に失敗しました: {e}")
+
+    def invalidate(self, user_id: int) -> None:
+        """
+        ユーザーのキャッシュを破棄する（パスワードの変更・ユーザーの削除時に呼ぶ）。
+        他のプロセスのプロセス内キャッシュは、有効期間が過ぎるまで残る。
+        """
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._stats["invalidations"] += 1
+        if self.redis_client is not None:
+            try:
+                self.redis_client.delete(self._redis_key(user_id))
+            except Exception as e:
+                self._count("redis_errors")
+                logger.warning(f"ユーザー情報のキャッシュ（Redis）の破棄に失敗しました: {e}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _put_local(self, principal: Principal) -> None:
+        with self._lock:
+            self._entries[principal.id] = (time.monotonic() + self.ttl_seconds, principal)
+            self._entries.move_to_end(principal.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries)}
+
+
+_principal_cache: Optional[PrincipalCache] = None
+_principal_cache_lock = threading.Lock()
+
+
+def get_principal_cache() -> Optional[PrincipalCache]:
+    """プロセス内で共有する PrincipalCache を返す。キャッシュが無効な場合は None。"""
+    global _principal_cache
+    if not PRINCIPAL_CACHE_ENABLED:
+        return None
+    if _principal_cache is None:
+        with _principal_cache_lock:
+            if _principal_cache is None:
+                redis_client = None
+                if PRINCIPAL_CACHE_REDIS_ENABLED:
+                    from shared.redis_client import get_redis
+
+                    redis_client = get_redis()
+                _principal_cache = PrincipalCache(redis_client=redis_client)
+    return _principal_cache
@@ -6,6 +6,7 @@ from sqlalchemy.orm import Session
 from shared.db.models import User
 from shared.schemas import UserCreate # Pydanticモデルをsharedからインポート
 from .auth_service import AuthService
+from .principal_cache import get_principal_cache
 
 
 class UserService:
@@ -49,7 +50,7 @@ class UserService:
         """
         return db.query(User).filter(User.id == user_id).first()
 
-    def create(self, db: Session, user_create: UserCreate) -> User:
+    def create(self, db: Session, user_create: UserCreate, hashed_password: Optional[str] = None) -> User:
         """
         新規ユーザーを作成し、データベースに保存します。
         パスワードはハッシュ化してから保存します。
@@ -57,12 +58,14 @@ class UserService:
         Args:
             db: SQLAlchemyのセッションオブジェクト。
             user_create: 作成するユーザーの情報（ユーザー名と平文パスワード）。
+            hashed_password: ハッシュ化済みのパスワード。bcryptの計算を別スレッドで済ませた場合に渡す。
 
         Returns:
             作成されたUserモデルのインスタンス。
         """
         # 平文のパスワードをハッシュ化
-        hashed_password = self.auth_service.get_password_hash(user_create.password)
+        if hashed_password is None:
+            hashed_password = self.auth_service.get_password_hash(user_create.password)
         
         # 新しいUserモデルインスタンスを作成
         db_user = User(
@@ -79,3 +82,40 @@ class UserService:
         
         return db_user
 
+    def update_password(self, db: Session, user: User, new_password: str) -> User:
+        """
+        パスワードを変更します。
+        トークンの世代を進めて変更前に発行したトークンを無効にし、キャッシュされたユーザー情報を破棄します。
+
+        Args:
+            db: SQLAlchemyのセッションオブジェクト。
+            user: パスワードを変更するユーザー。
+            new_password: 新しい平文のパスワード。
+
+        Returns:
+            更新されたUserモデルのインスタンス。
+        """
+        user.hashed_password = self.auth_service.get_password_hash(new_password)
+        user.token_version = (user.token_version or 0) + 1
+        db.commit()
+        db.refresh(user)
+        self._invalidate_principal(user.id)
+        return user
+
+    def delete(self, db: Session, user: User) -> None:
+        """
+        ユーザーと、その会話履歴を削除します。キャッシュされたユーザー情報も破棄します。
+
+        Args:
+            db: SQLAlchemyのセッションオブジェクト。
+            user: 削除するユーザー。
+        """
+        user_id = user.id
+        db.delete(user)
+        db.commit()
+        self._invalidate_principal(user_id)
+
+    def _invalidate_principal(self, user_id: int) -> None:
+        cache = get_principal_cache()
+        if cache is not None:
+            cache.invalidate(user_id)
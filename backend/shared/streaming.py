@@ -0,0 +1,82 @@
+# backend/shared/streaming.py
+
+import json
+import logging
+import os
+from typing import Optional
+
+from redis.exceptions import RedisError
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# ワーカーからブラウザへ途中経過・トークンを中継するRedisのチャンネルとイベントログ
+STREAM_CHANNEL_PREFIX = "chat:stream:"
+STREAM_LOG_PREFIX = "chat:stream-log:"
+# タスクの完了（done / error）だけを通知するチャンネル。結果の long-poll はトークンのイベントを受け取らずに済む
+TASK_DONE_CHANNEL_PREFIX = "chat:task-done:"
+# 購読開始前に発行されたイベントを取りこぼさないよう、ログを一定時間保持する
+STREAM_LOG_TTL_SECONDS = int(os.getenv("STREAM_LOG_TTL_SECONDS", "600"))
+
+# ストリームを終了させるイベント種別
+TERMINAL_EVENT_TYPES = ("done", "error")
+
+
+def stream_channel(task_id: str) -> str:
+    return f"{STREAM_CHANNEL_PREFIX}{task_id}"
+
+
+def stream_log_key(task_id: str) -> str:
+    return f"{STREAM_LOG_PREFIX}{task_id}"
+
+
+def task_done_channel(task_id: str) -> str:
+    return f"{TASK_DONE_CHANNEL_PREFIX}{task_id}"
+
+
+class StreamPublisher:
+    """
+    1つのタスクに紐づくストリームイベントをRedisへ発行するクラス。
+    各イベントには連番(seq)を付与し、ログ(リスト)への追記とpub/sub発行を1往復で行う。
+    ストリーミングは補助的な経路のため、Redisのエラーは記録するだけで応答生成は止めない。
+    """
+
+    def __init__(self, task_id: str, client=None):
+        self.task_id = task_id
+        self.client = client or get_redis()
+        self.seq = 0
+        # 終了イベント（done / error）を発行済みか
+        self.finished = False
+
+    def publish(self, event_type: str, **data) -> None:
+        self.seq += 1
+        payload = json.dumps({"seq": self.seq, "type": event_type, **data}, ensure_ascii=False)
+        log_key = stream_log_key(self.task_id)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.rpush(log_key, payload)
+        pipe.expire(log_key, STREAM_LOG_TTL_SECONDS)
+        pipe.publish(stream_channel(self.task_id), payload)
+        if event_type in TERMINAL_EVENT_TYPES:
+            self.finished = True
+            pipe.publish(task_done_channel(self.task_id), payload)
+        try:
+            pipe.execute()
+        except RedisError as e:
+            logger.warning(f"ストリームイベントの発行に失敗しました (task_id: {self.task_id}): {e}")
+
+    def progress(self, node: str, message: Optional[str] = None) -> None:
+        """グラフのノードの開始を通知する。"""
+        self.publish("progress", node=node, message=message)
+
+    def token(self, text: str) -> None:
+        """LLMが生成したトークン（チャンク）を通知する。"""
+        if text:
+            self.publish("token", text=text)
+
+    def done(self, final_response: str) -> None:
+        """最終応答を通知し、ストリームを終了する。"""
+        self.publish("done", ai_message=final_response)
+
+    def error(self, detail: str) -> None:
+        self.publish("error", detail=detail)
@@ -0,0 +1,125 @@
+# backend/shared/task_results.py
+
+import json
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import redis.asyncio as aioredis
+from celery import states
+
+from .celery_app import celery_app, result_backend_url
+from .redis_client import get_async_redis
+from .streaming import TASK_DONE_CHANNEL_PREFIX, TERMINAL_EVENT_TYPES, stream_log_key, task_done_channel
+
+# AsyncResult.ready()/get() は同期のRedisクライアントでイベントループを止めるため、
+# API Gatewayでは結果バックエンドのキーを非同期クライアントで直接読み、Celeryのデコード処理だけを借りる
+
+_async_result_client = None
+
+
+def get_async_result_redis() -> aioredis.Redis:
+    """Celeryの結果バックエンド（Redis）に接続する非同期クライアントを返す。"""
+    global _async_result_client
+    if _async_result_client is None:
+        _async_result_client = aioredis.Redis.from_url(result_backend_url)
+    return _async_result_client
+
+
+@dataclass
+class TaskState:
+    """API向けに整理したタスクの状態。status は PENDING / SUCCESS / FAILURE のいずれか。"""
+    task_id: str
+    status: str
+    result: Optional[str] = None
+    detail: Optional[str] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.status != "PENDING"
+
+
+def task_state_from_meta(task_id: str, meta: dict) -> TaskState:
+    """結果バックエンドのメタデータを TaskState に変換する。未完了（STARTED なども含む）は PENDING とする。"""
+    status = meta.get("status", states.PENDING)
+    if status not in states.READY_STATES:
+        return TaskState(task_id=task_id, status="PENDING")
+    if status == states.SUCCESS:
+        return TaskState(task_id=task_id, status="SUCCESS", result=meta.get("result"))
+    error = celery_app.backend.exception_to_python(meta.get("result"))
+    return TaskState(task_id=task_id, status="FAILURE", detail=str(error))
+
+
+def task_state_from_event(task_id: str, event: dict) -> TaskState:
+    """
+    ワーカーが発行した終了イベント（done / error）を TaskState に変換する。
+    done は会話の保存より前に発行されるため、結果バックエンドより早く完了を知ることができる。
+    """
+    if event.get("type") == "done":
+        return TaskState(task_id=task_id, status="SUCCESS", result=event.get("ai_message"))
+    return TaskState(task_id=task_id, status="FAILURE", detail=event.get("detail"))
+
+
+async def get_task_states(task_ids: List[str]) -> Dict[str, TaskState]:
+    """
+    複数のタスクの状態を、結果バックエンドへの1回の MGET でまとめて取得する。
+    結果がまだ保存されていないタスクは、ストリームのログの最後が終了イベントであればそれを使う。
+    """
+    backend = celery_app.backend
+    raws = await get_async_result_redis().mget([backend.get_key_for_task(task_id) for task_id in task_ids])
+    results = {}
+    for task_id, raw in zip(task_ids, raws):
+        if raw:
+            results[task_id] = task_state_from_meta(task_id, backend.decode_result(raw))
+        else:
+            results[task_id] = TaskState(task_id=task_id, status="PENDING")
+
+    pending = [task_id for task_id, state in results.items() if not state.ready]
+    if pending:
+        pipe = get_async_redis().pipeline(transaction=False)
+        for task_id in pending:
+            pipe.lindex(stream_log_key(task_id), -1)
+        for task_id, last_event in zip(pending, await pipe.execute()):
+            if last_event:
+                event = json.loads(last_event)
+                if event.get("type") in TERMINAL_EVENT_TYPES:
+                    results[task_id] = task_state_from_event(task_id, event)
+    return results
+
+
+async def get_task_state(task_id: str) -> TaskState:
+    """タスクの状態を非同期に取得する。"""
+    return (await get_task_states([task_id]))[task_id]
+
+
+async def wait_for_task_states(task_ids: List[str], timeout: float) -> Dict[str, TaskState]:
+    """
+    指定したタスクのいずれかが完了するまで、最大 timeout 秒待ってから全タスクの状態を返す。
+    既に完了しているタスクがあれば待たずに返す。
+    先に完了通知のチャンネルを購読してから現在の状態を読むことで、その間に完了したタスクを取りこぼさない。
+    """
+    if timeout <= 0:
+        return await get_task_states(task_ids)
+
+    pubsub = get_async_redis().pubsub()
+    await pubsub.subscribe(*[task_done_channel(task_id) for task_id in task_ids])
+    try:
+        results = await get_task_states(task_ids)
+        if any(state.ready for state in results.values()):
+            return results
+
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return results
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining)
+            if message is None:
+                continue
+            task_id = message["channel"][len(TASK_DONE_CHANNEL_PREFIX):]
+            if task_id in results:
+                results[task_id] = task_state_from_event(task_id, json.loads(message["data"]))
+                return results
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.aclose()
@@ -0,0 +1,61 @@
+# backend/shared/worker_status.py
+
+import json
+import os
+import time
+from typing import List
+
+from redis.exceptions import RedisError
+
+from .redis_client import get_async_redis, get_redis
+
+# ウォームアップ済みワーカーを示すキー。ワーカーが定期的にTTLを延長し、停止・クラッシュ時は自然に消える
+WORKER_READY_KEY_PREFIX = "worker:ready:"
+WORKER_READY_TTL_SECONDS = int(os.getenv("WORKER_READY_TTL_SECONDS", "30"))
+
+
+def _ready_key(worker_name: str) -> str:
+    return f"{WORKER_READY_KEY_PREFIX}{worker_name}"
+
+
+def mark_worker_ready(worker_name: str, info: dict) -> None:
+    """ワーカーがウォームアップを終え、タスクを受け付けられる状態になったことを記録する。"""
+    payload = dict(info, worker=worker_name, ready_at=time.time())
+    get_redis().set(_ready_key(worker_name), json.dumps(payload), ex=WORKER_READY_TTL_SECONDS)
+
+
+def refresh_worker_ready(worker_name: str) -> bool:
+    """準備完了キーのTTLを延長する。キーが存在しなければFalseを返す。"""
+    return bool(get_redis().expire(_ready_key(worker_name), WORKER_READY_TTL_SECONDS))
+
+
+def clear_worker_ready(worker_name: str) -> None:
+    """ワーカー停止時に準備完了キーを削除する。"""
+    get_redis().delete(_ready_key(worker_name))
+
+
+def get_ready_workers() -> List[dict]:
+    """
+    現在ウォームアップ済みのワーカー一覧を返す。
+    Redisに接続できない場合は空のリストを返す。
+    """
+    try:
+        client = get_redis()
+        keys = list(client.scan_iter(match=f"{WORKER_READY_KEY_PREFIX}*"))
+        if not keys:
+            return []
+        return [json.loads(value) for value in client.mget(keys) if value]
+    except RedisError:
+        return []
+
+
+async def get_ready_workers_async() -> List[dict]:
+    """get_ready_workers の非同期版。API Gatewayのイベントループを止めずにRedisを参照する。"""
+    try:
+        client = get_async_redis()
+        keys = [key async for key in client.scan_iter(match=f"{WORKER_READY_KEY_PREFIX}*")]
+        if not keys:
+            return []
+        return [json.loads(value) for value in await client.mget(keys) if value]
+    except RedisError:
+        return []
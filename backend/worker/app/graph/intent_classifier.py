@@ -0,0 +1,302 @@
+# backend/worker/app/graph/intent_classifier.py
+
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INTENT_LABELS = ("knowledge_question", "chitchat", "greeting")
+
+# ワーカーに同梱するラベル付きの例文ファイル (1行1件のJSON: {"text": ..., "intent": ...})
+INTENT_EXAMPLES_PATH = os.getenv(
+    "INTENT_EXAMPLES_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "intent_examples.jsonl"),
+)
+# この確信度以上のときだけ分類器の結果を採用し、それ未満はLLMによる分類に任せる
+INTENT_CONFIDENCE_THRESHOLD = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", "0.8"))
+# コサイン類似度を確率に変換するソフトマックスの温度。小さいほど確信度が極端になる
+INTENT_SOFTMAX_TEMPERATURE = float(os.getenv("INTENT_SOFTMAX_TEMPERATURE", "0.05"))
+INTENT_PRECLASSIFIER_ENABLED = os.getenv("INTENT_PRECLASSIFIER_ENABLED", "true").lower() == "true"
+# 例文のEmbeddingに失敗した場合（Ollamaの起動前など）に、学習をやり直すまでの時間（秒）。失敗が続くと倍にしていく
+INTENT_FIT_RETRY_SECONDS = float(os.getenv("INTENT_FIT_RETRY_SECONDS", "10"))
+INTENT_FIT_RETRY_MAX_SECONDS = float(os.getenv("INTENT_FIT_RETRY_MAX_SECONDS", "300"))
+
+
+def load_examples(path: str = INTENT_EXAMPLES_PATH) -> List[Tuple[str, str]]:
+    """ラベル付きの例文を (テキスト, 意図) のリストとして読み込む。"""
+    examples = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if record.get("intent") not in INTENT_LABELS:
+                raise ValueError(f"{path}:{line_no}: 不明な意図ラベルです: {record.get('intent')}")
+            examples.append((record["text"], record["intent"]))
+    return examples
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+def _softmax(scores: np.ndarray, temperature: float) -> np.ndarray:
+    logits = scores / temperature
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+@dataclass
+class IntentPrediction:
+    intent: str
+    confidence: float
+    scores: Dict[str, float]
+    accepted: bool
+
+
+class IntentClassifier:
+    """
+    文のEmbeddingに対する最近傍重心(nearest-centroid)法で意図を分類する軽量な分類器。
+    意図ごとに例文ベクトルの平均(重心)を求め、入力との類似度をソフトマックスで確信度に変換する。
+    確信度がしきい値以上のときだけ結果を採用し、LLMによる分類を省略できるようにする。
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        threshold: float = INTENT_CONFIDENCE_THRESHOLD,
+        temperature: float = INTENT_SOFTMAX_TEMPERATURE,
+        examples_path: str = INTENT_EXAMPLES_PATH,
+    ):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.temperature = temperature
+        self.examples_path = examples_path
+        self.labels: List[str] = []
+        self._centroids: Optional[np.ndarray] = None
+        self._unavailable = False
+        # Embeddingに失敗した後、次に学習を試みる時刻（time.monotonic）と、その次の待ち時間
+        self._retry_at = 0.0
+        self._retry_delay = INTENT_FIT_RETRY_SECONDS
+        self._lock = threading.Lock()
+
+        self.decided = 0
+        self.fallbacks = 0
+        self.predict_seconds = 0.0
+        self._per_class = defaultdict(lambda: {"predicted": 0, "decided": 0, "confidence_sum": 0.0})
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """テキストを正規化済みのベクトル行列に変換する。Embeddingキャッシュがあれば一括で引く。"""
+        if hasattr(self.embeddings, "embed_queries"):
+            vectors = self.embeddings.embed_queries(texts)
+        else:
+            vectors = [self.embeddings.embed_query(text) for text in texts]
+        return _normalize_rows(np.asarray(vectors, dtype=np.float32))
+
+    def fit(self, examples: List[Tuple[str, str]]) -> "IntentClassifier":
+        """例文から意図ごとの重心を計算する。"""
+        vectors = self.embed([text for text, _ in examples])
+        return self.fit_vectors(vectors, [label for _, label in examples])
+
+    def fit_vectors(self, vectors: np.ndarray, labels: List[str]) -> "IntentClassifier":
+        self.labels = [label for label in INTENT_LABELS if label in labels]
+        label_array = np.asarray(labels)
+        centroids = np.stack([vectors[label_array == label].mean(axis=0) for label in self.labels])
+        self._centroids = _normalize_rows(centroids)
+        return self
+
+    @property
+    def is_fitted(self) -> bool:
+        return self._centroids is not None
+
+    def ensure_fitted(self) -> bool:
+        """
+        初回呼び出し時に例文ファイルから学習する。
+        例文ファイルが無い・不正な場合は分類器を無効にし、以降は常にLLMへ任せる。
+        Embeddingに失敗した場合は一時的な障害とみなし、待ち時間を置いてから次の呼び出しで学習をやり直す。
+        """
+        if self.is_fitted or self._unavailable or time.monotonic() < self._retry_at:
+            return self.is_fitted
+        with self._lock:
+            if self.is_fitted or self._unavailable or time.monotonic() < self._retry_at:
+                return self.is_fitted
+            start = time.perf_counter()
+            try:
+                examples = load_examples(self.examples_path)
+            except (OSError, ValueError) as e:
+                logger.warning(f"意図分類器の例文を読み込めないため、LLMによる分類のみを使います: {e}")
+                self._unavailable = True
+                return False
+            try:
+                self.fit(examples)
+            except Exception as e:
+                logger.warning(
+                    f"意図分類器を学習できませんでした。{self._retry_delay:.0f}秒後に再試行し、それまではLLMによる分類を使います: {e}"
+                )
+                self._retry_at = time.monotonic() + self._retry_delay
+                self._retry_delay = min(self._retry_delay * 2, INTENT_FIT_RETRY_MAX_SECONDS)
+                return False
+            logger.info(f"意図分類器を学習しました ({len(examples)} 件, {time.perf_counter() - start:.3f}s)")
+        return True
+
+    def predict_vectors(self, vectors: np.ndarray) -> np.ndarray:
+        """正規化済みベクトルに対する各意図の確信度 (行ごとの確率) を返す。"""
+        return _softmax(vectors @ self._centroids.T, self.temperature)
+
+    def predict(self, text: str) -> IntentPrediction:
+        probs = self.predict_vectors(self.embed([text]))[0]
+        index = int(np.argmax(probs))
+        confidence = float(probs[index])
+        return IntentPrediction(
+            intent=self.labels[index],
+            confidence=confidence,
+            scores={label: round(float(p), 4) for label, p in zip(self.labels, probs)},
+            accepted=confidence >= self.threshold,
+        )
+
+    def classify(self, text: str) -> Optional[IntentPrediction]:
+        """
+        グラフから呼び出す入口。分類器が使えない場合はNoneを返す。
+        採用可否(accepted)に関わらず、意図ごとの確信度を集計する。
+        """
+        if not self.ensure_fitted():
+            return None
+        start = time.perf_counter()
+        try:
+            prediction = self.predict(text)
+        except Exception as e:
+            logger.warning(f"意図分類器での分類に失敗しました: {e}")
+            return None
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self.predict_seconds += elapsed
+            per_class = self._per_class[prediction.intent]
+            per_class["predicted"] += 1
+            per_class["confidence_sum"] += prediction.confidence
+            if prediction.accepted:
+                self.decided += 1
+                per_class["decided"] += 1
+            else:
+                self.fallbacks += 1
+        return prediction
+
+    def stats(self) -> dict:
+        total = self.decided + self.fallbacks
+        return {
+            "fitted": self.is_fitted,
+            "threshold": self.threshold,
+            "decided": self.decided,
+            "fallbacks": self.fallbacks,
+            "decided_rate": round(self.decided / total, 4) if total else 0.0,
+            "avg_predict_ms": round(self.predict_seconds / total * 1000, 3) if total else 0.0,
+            "per_class": {
+                label: {
+                    "predicted": counts["predicted"],
+                    "decided": counts["decided"],
+                    "avg_confidence": round(counts["confidence_sum"] / counts["predicted"], 4),
+                }
+                for label, counts in self._per_class.items()
+            },
+        }
+
+
+def leave_one_out(classifier: IntentClassifier, vectors: np.ndarray, labels: List[str]) -> List[Tuple[str, str, float]]:
+    """
+    1件ずつ除外して学習し直し、除外した例文を分類する。
+    戻り値は (正解, 予測, 確信度) のリスト。
+    """
+    results = []
+    for i in range(len(labels)):
+        mask = np.arange(len(labels)) != i
+        classifier.fit_vectors(vectors[mask], [label for j, label in enumerate(labels) if j != i])
+        probs = classifier.predict_vectors(vectors[i:i + 1])[0]
+        index = int(np.argmax(probs))
+        results.append((labels[i], classifier.labels[index], float(probs[index])))
+    classifier.fit_vectors(vectors, labels)
+    return results
+
+
+def report(results: List[Tuple[str, str, float]], threshold: float) -> None:
+    """意図ごとの採用率・適合率・再現率・平均確信度と、しきい値ごとの採用率と正解率を表示する。"""
+    print(f"\n--- 意図ごとの評価 (しきい値: {threshold}) ---")
+    print(f"{'intent':<20}{'support':>8}{'decided':>9}{'precision':>11}{'recall':>8}{'avg_conf':>10}")
+    for label in INTENT_LABELS:
+        support = [r for r in results if r[0] == label]
+        predicted = [r for r in results if r[1] == label]
+        decided = [r for r in predicted if r[2] >= threshold]
+        correct = [r for r in decided if r[0] == label]
+        precision = len(correct) / len(decided) if decided else 0.0
+        recall = len(correct) / len(support) if support else 0.0
+        avg_conf = sum(r[2] for r in predicted) / len(predicted) if predicted else 0.0
+        print(f"{label:<20}{len(support):>8}{len(decided):>9}{precision:>11.3f}{recall:>8.3f}{avg_conf:>10.3f}")
+
+    print("\n--- しきい値ごとの採用率 (LLMを省略できる割合) と採用分の正解率 ---")
+    print(f"{'threshold':>10}{'coverage':>10}{'accuracy':>10}")
+    for t in (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95):
+        decided = [r for r in results if r[2] >= t]
+        coverage = len(decided) / len(results) if results else 0.0
+        accuracy = sum(1 for r in decided if r[0] == r[1]) / len(decided) if decided else 0.0
+        print(f"{t:>10.2f}{coverage:>10.3f}{accuracy:>10.3f}")
+
+    errors = [r for r in results if r[0] != r[1] and r[2] >= threshold]
+    if errors:
+        print(f"\n採用されるはずの誤分類: {len(errors)} 件")
+
+
+def main() -> None:
+    from .. import resources
+
+    parser = argparse.ArgumentParser(description="Embeddingによる意図の事前分類器の学習・評価を行います。")
+    parser.add_argument("command", choices=["train", "eval", "predict"])
+    parser.add_argument("texts", nargs="*", help="predict で分類するテキスト")
+    parser.add_argument("--examples", default=INTENT_EXAMPLES_PATH, help="ラベル付き例文ファイル")
+    parser.add_argument("--threshold", type=float, default=INTENT_CONFIDENCE_THRESHOLD)
+    parser.add_argument("--temperature", type=float, default=INTENT_SOFTMAX_TEMPERATURE)
+    args = parser.parse_args()
+
+    # ワーカーと同じEmbeddingモデル・キャッシュを使う
+    classifier = IntentClassifier(resources.get_embeddings(), threshold=args.threshold, temperature=args.temperature)
+    examples = load_examples(args.examples)
+    labels = [label for _, label in examples]
+
+    start = time.perf_counter()
+    vectors = classifier.embed([text for text, _ in examples])
+    classifier.fit_vectors(vectors, labels)
+    print(f"{len(examples)} 件の例文で学習しました ({time.perf_counter() - start:.3f}s)")
+    for label in INTENT_LABELS:
+        print(f"  - {label}: {labels.count(label)} 件")
+
+    if args.command == "train":
+        # 学習データに対する正解率と、重心同士の類似度 (近いほど区別が難しい) を表示する
+        probs = classifier.predict_vectors(vectors)
+        predicted = [classifier.labels[i] for i in probs.argmax(axis=1)]
+        accuracy = sum(1 for p, t in zip(predicted, labels) if p == t) / len(labels)
+        print(f"\n学習データでの正解率: {accuracy:.3f}")
+        similarity = classifier._centroids @ classifier._centroids.T
+        print("重心間のコサイン類似度:")
+        for i, label in enumerate(classifier.labels):
+            print(f"  {label:<20}" + " ".join(f"{s:.3f}" for s in similarity[i]))
+    elif args.command == "eval":
+        report(leave_one_out(classifier, vectors, labels), args.threshold)
+    else:
+        for text in args.texts:
+            prediction = classifier.predict(text)
+            decision = prediction.intent if prediction.accepted else "LLMへ委譲"
+            print(f"「{text}」 -> {decision} (確信度: {prediction.confidence:.3f}, {prediction.scores})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+# backend/worker/app/graph/prompts.py
+
+import hashlib
+from dataclasses import dataclass
+from typing import Any, Dict, List, Literal, Sequence
+
+from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.pydantic_v1 import BaseModel, Field
+
+# --- クエリ生成で参照する知識ベースの概要 ---
+KNOWLEDGE_INDEX = """
+- **イベント概要**:
+  - オープンキャンパス基本情報、参加・予約方法、主なプログラム一覧、体験型模擬授業詳細
+  - 保護者向け説明会、総合型選抜プレゼン講座、交通アクセスと無料送迎バス、無料昼食体験
+- **大学の概要**:
+  - 理念とビジョン、歴史と学長メッセージ
+- **大学の特色**:
+  - **大学の特色まとめ**
+  - 少人数教育、学生自主研究制度、最先端の研究環境、地域連携と国際交流
+- **学部・学科**:
+  - **学部・学科一覧**
+  - **システム科学技術学部**:
+    - 学部概要
+    - 機械工学科（概要）
+    - 知能メカトロニクス学科（概要）
+    - 情報工学科（概要）
+    - 建築環境システム学科（概要）
+    - **経営システム工学科**:
+      - 学科概要
+      - **研究室**:
+        - **経営システム工学科の研究室一覧**
+        - **サイバーフィジカルシステム研究室（山口研）**: 
+          - 研究室概要、オープンキャンパス出展内容
+          - **オープンキャンパス出展メンバー一覧 (注: ここに記載のメンバーが、現在オープンキャンパスに参加しているメンバーの全てです)**:
+            - 吉田快, 佐藤翔真, 高橋潤大, 小川春翔, 山根拓真, 成田明音, 新井美羽, 高橋夢叶
+        - 先端ビジネス会計研究室（朴研）: 研究室概要
+        - 応用経済研究室（嶋崎(善)研）: 研究室概要
+        - 環境システム研究室（金澤研）: 研究室概要
+        - 経営数理解析（星野研）: 研究室概要
+  - **生物資源科学部**:
+    - 応用生物科学科、生物生産科学科、生物環境科学科、アグリビジネス学科の概要
+- **キャンパスライフ**:
+  - **キャンパスライフ概要**
+  - 年間行事、クラブ活動、施設紹介、学生寮「清新寮」
+- **学生支援**:
+  - **学生支援概要**
+  - 奨学金と経済的支援、相談窓口とキャリア支援
+"""
+
+SYNONYM_RULES = """- 「メンバー」「メンバー一覧」に関する質問は、「オープンキャンパス出展メンバー一覧」に関する質問として解釈してください。現在利用可能なメンバー情報は、オープンキャンパスの出展者に限定されています。
+- 「山口研」は「サイバーフィジカルシステム研究室」の通称です。
+"""
+
+# --- Pydanticモデル定義 ---
+
+class Intent(BaseModel):
+    """ユーザーの入力の意図を分類する。"""
+    intent: Literal["knowledge_question", "chitchat", "greeting"] = Field(
+        description="ユーザーの入力の意図。'knowledge_question'は情報検索が必要な質問、'chitchat'は雑談、'greeting'は挨拶。",
+        default="chitchat"
+    )
+
+class MultiQuery(BaseModel):
+    """ユーザーの質問を分析し、複数の検索クエリを生成する。"""
+    queries: List[str] = Field(
+        description="生成された3〜5個の検索クエリのリスト。"
+    )
+
+class RouterDecision(BaseModel):
+    """ユーザーの入力の意図分類と、検索クエリの生成を1回でまとめて行う。"""
+    intent: Literal["knowledge_question", "chitchat", "greeting"] = Field(
+        description="ユーザーの入力の意図。'knowledge_question'は情報検索が必要な質問、'chitchat'は雑談、'greeting'は挨拶。",
+        default="chitchat"
+    )
+    queries: List[str] = Field(
+        description="intentが'knowledge_question'の場合に生成する3〜5個の検索クエリのリスト。それ以外の場合は空のリスト。",
+        default_factory=list
+    )
+
+
+# --- プロンプトテンプレート ---
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    """
+    LLMに渡すプロンプトの組み立て方。
+    system は全リクエストで1バイトも変わらない先頭部分（ペルソナ・ルール・知識インデックス・出力形式）、
+    user_template はその後ろに付くリクエストごとの部分（会話履歴・参考情報・質問）。
+    先頭部分が毎回同じであれば、Ollamaは前回のリクエストで計算したKVキャッシュを再利用でき、
+    その部分のプリフィルを省略できる。
+    """
+    name: str
+    system: str
+    user_template: str
+
+    def render(self, history_messages: Sequence[Any] = (), **values: Any) -> List[Any]:
+        """[システム, 会話履歴..., ユーザー] のメッセージ列を組み立てる。values は user_template に埋め込む値。"""
+        return [("system", self.system), *history_messages, ("human", self.user_template.format(**values))]
+
+    @property
+    def fingerprint(self) -> str:
+        """先頭部分のハッシュ。ログやベンチマークで、先頭部分が変わっていないことを確認するために使う。"""
+        return hashlib.sha256(self.system.encode("utf-8")).hexdigest()[:12]
+
+
+PROMPTS: Dict[str, PromptTemplate] = {}
+
+
+def register_prompt(template: PromptTemplate) -> PromptTemplate:
+    PROMPTS[template.name] = template
+    return template
+
+
+def get_prompt(name: str) -> PromptTemplate:
+    try:
+        return PROMPTS[name]
+    except KeyError:
+        raise KeyError(f"未登録のプロンプトです: {name} (登録済み: {', '.join(PROMPTS)})") from None
+
+
+def format_summary(summary) -> str:
+    """会話の要約を、ユーザーメッセージの先頭に添える形に整える。要約が無ければ空文字列。"""
+    return f"【これまでの会話の要約】\n{summary}\n\n" if summary else ""
+
+
+# 応答生成・雑談で共通の書き出し。両方のプロンプトの先頭を揃え、交互に呼ばれてもこの部分は再利用できるようにする
+PERSONA = "あなたは「APU-NaviAI」、秋田県立大学本荘キャンパスのオープンキャンパスを案内するAIナビゲーターです。\n"
+
+_INTENT_RULES = """- 情報を求めている具体的な質問は 'knowledge_question'
+- 単純な挨拶（こんにちは、など）は 'greeting'
+- 上記以外（ありがとう、すごい、など）は 'chitchat'"""
+
+_QUERY_STRATEGY = """- **書き換えクエリ**: ユーザーの質問を、概要やルールにある言葉を使ってより具体的に書き換える。「山口研のメンバーは？」と聞かれたら、「山口研のオープンキャンパス出展メンバー一覧」のように、概要にある言葉に近づけること。
+- **仮想文書クエリ**: 質問の答えがありそうな文書のタイトルや要約を、概要を参考にしつつ生成する。
+- **キーワードクエリ**: 概要に含まれる固有名詞や専門用語を抜き出す。"""
+
+_KNOWLEDGE_REFERENCE = f"""---
+【利用可能なドキュメントの概要】
+{KNOWLEDGE_INDEX}
+---
+【同義語と解釈のルール】
+{SYNONYM_RULES}---"""
+
+register_prompt(PromptTemplate(
+    name="classify_intent",
+    system=f"""以下のユーザーの最後の発言を分析し、その意図を分類してください。
+{_INTENT_RULES}
+{JsonOutputParser(pydantic_object=Intent).get_format_instructions()}""",
+    user_template='ユーザーの発言: "{user_input}"',
+))
+
+register_prompt(PromptTemplate(
+    name="query_expansion",
+    system=f"""あなたは、ユーザーの質問を分析し、ベクトル検索のヒット率を最大化するために、多様な検索クエリを生成する専門家です。
+与えられた【利用可能なドキュメントの概要】と【同義語と解釈のルール】を**最優先の参考情報**として、ユーザーの質問に答えられる情報がどのドキュメントにありそうか見当をつけ、最適な検索クエリを3〜5個生成してください。
+
+**クエリ生成の戦略:**
+{_QUERY_STRATEGY}
+
+{JsonOutputParser(pydantic_object=MultiQuery).get_format_instructions()}
+
+{_KNOWLEDGE_REFERENCE}""",
+    user_template="""【会話履歴】
+{history}
+
+【最後の質問】
+{user_input}""",
+))
+
+register_prompt(PromptTemplate(
+    name="fused_router",
+    system=f"""あなたは、オープンキャンパス案内AIの入力を振り分ける専門家です。
+ユーザーの最後の発言について、次の2つを1つのJSONでまとめて回答してください。
+
+**1. 意図の分類 (intent):**
+{_INTENT_RULES}
+
+**2. 検索クエリの生成 (queries):**
+intentが 'knowledge_question' の場合のみ、ベクトル検索のヒット率を最大化するための多様な検索クエリを3〜5個生成してください。それ以外の場合は空のリストにしてください。
+与えられた【利用可能なドキュメントの概要】と【同義語と解釈のルール】を**最優先の参考情報**として、ユーザーの質問に答えられる情報がどのドキュメントにありそうか見当をつけてください。
+{_QUERY_STRATEGY}
+
+{JsonOutputParser(pydantic_object=RouterDecision).get_format_instructions()}
+
+{_KNOWLEDGE_REFERENCE}""",
+    user_template="""【会話履歴】
+{history}
+
+【最後の発言】
+{user_input}""",
+))
+
+register_prompt(PromptTemplate(
+    name="rag_response",
+    system=(
+        PERSONA
+        + "あなたの最も重要な役割は、与えられた【参考情報】の断片的な情報を組み合わせ、ユーザーの質問に対して包括的で分かりやすい回答を**合成して生成する**ことです。\n\n"
+        "**【回答のルール】**\n"
+        "1. **【リアルタイム情報】を最優先で確認し、回答の中心に据えてください。**\n"
+        "2. **次に【参考情報】を使い、リアルタイム情報やユーザーの質問に関連する詳細を補強してください。情報が複数のソースにまたがっていても、積極的に統合してください。**\n"
+        "3. **例えば、「経営システム工学科の出展は？」と聞かれ、参考情報に『山口研の出展内容』しかなくても、「経営システム工学科では、現在山口研が中心となって以下のような展示を行っていますよ」と、持っている情報で最大限の回答を作成してください。**\n"
+        "4. **回答には、どの【参考情報】のどの部分を根拠にしたか、番号で `[1]` のように示してください。**\n"
+        "5. **全ての情報を組み合わせても、全く答えられない場合にのみ、「申し訳ありませんが、その質問に関する情報は現在持ち合わせておりません。」と回答してください。**\n\n"
+        "【参考情報】と【リアルタイム情報】は、ユーザーの最後のメッセージの先頭に添付されています。"
+    ),
+    user_template="""{summary}{reference_info}
+
+【質問】
+{user_input}""",
+))
+
+register_prompt(PromptTemplate(
+    name="chitchat",
+    system=(
+        PERSONA
+        + "あなたの役割は、来場者であるユーザーを歓迎し、親切で少し親しみやすい口調で自然な会話をすることです。\n"
+        "最初の挨拶では、必ず自己紹介と「オープンキャンパスへようこそ！」といった歓迎の言葉を述べてください。\n"
+        "オープンキャンパスに関する専門的な知識は持っていないという設定で、一般的な知識や感情表現を交えながら、楽しい雑談で応答してください。"
+    ),
+    user_template="{summary}{user_input}",
+))
+
+register_prompt(PromptTemplate(
+    name="conversation_summary",
+    system=(
+        "あなたは、オープンキャンパス案内AIとユーザーの会話を要約する担当です。\n"
+        "【これまでの要約】に【新しい会話】の内容を統合し、今後の会話で必要になる情報だけを残した要約を1つ作成してください。\n\n"
+        "**【要約のルール】**\n"
+        "1. ユーザーが知りたがっていること、関心を示した学科・研究室・イベント、ユーザー自身について述べたことを優先して残してください。\n"
+        "2. AIの回答は、結論（固有名詞・日時・場所など）だけを残し、説明や言い回し、`[1]` のような参照番号は省いてください。\n"
+        "3. 箇条書きではなく、簡潔な文章で書いてください。\n"
+        "4. 要約の本文だけを出力し、前置きや見出しは付けないでください。"
+    ),
+    user_template="""【これまでの要約】
+{summary}
+
+【新しい会話】
+{turns}
+
+要約は{max_chars}文字以内で出力してください。""",
+))
@@ -0,0 +1,118 @@
+# backend/worker/app/graph/schedule_index.py
+
+import json
+import os
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, time
+from typing import Any, Callable, Dict, List, Tuple
+
+
+class _MtimeCache:
+    """
+    ファイルの読み込み結果を、更新時刻とサイズが変わるまで使い回すキャッシュ。
+    読み込みに失敗した場合はキャッシュせず、例外をそのまま呼び出し元へ返す。
+    """
+
+    def __init__(self):
+        self._entries: Dict[Tuple[str, str], Tuple[Tuple[int, int], Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: str, loader: Callable[[str], Any]) -> Any:
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        key = (loader.__name__, path)
+        cached = self._entries.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        value = loader(path)
+        with self._lock:
+            self._entries[key] = (signature, value)
+        return value
+
+
+_cache = _MtimeCache()
+
+
+class TimetableIndex:
+    """
+    1つのタイムテーブルの全イベントを、時刻で二分探索できる形に前処理したもの。
+
+    - 開催中のイベント: 全イベントの開始・終了時刻を境界点として時間軸を区間に分け、
+      各境界点と各区間で開催中のイベントをあらかじめ求めておく。検索は境界点の二分探索だけで済む。
+    - これから始まるイベント: 開始時刻順に並べ、開始時刻の範囲を二分探索で切り出す。
+    表示用の文字列も読み込み時に組み立てておく。
+    """
+
+    def __init__(self, events: List[dict]):
+        # (開始, 終了, ファイル内の順序, 開催中の表示, 開始前の表示)。時刻の形式が不正なデータはスキップする
+        parsed = []
+        for order, event in enumerate(events):
+            try:
+                start_time = time.fromisoformat(event["start_time"])
+                end_time = time.fromisoformat(event["end_time"])
+                ongoing_label = f"「{event['event_name']}」（〜{event['end_time']} @ {event['location']}）"
+                upcoming_label = f"「{event['event_name']}」（{event['start_time']}〜 @ {event['location']}）"
+            except (ValueError, KeyError, TypeError):
+                continue
+            parsed.append((start_time, end_time, order, ongoing_label, upcoming_label))
+
+        # 開催中のイベントは、従来どおりファイル内の順序で並べる
+        self._points: List[time] = sorted({p[0] for p in parsed} | {p[1] for p in parsed})
+        self._at_point: List[List[str]] = []
+        self._after_point: List[List[str]] = []
+        for i, point in enumerate(self._points):
+            self._at_point.append([p[3] for p in parsed if p[0] <= point <= p[1]])
+            if i + 1 < len(self._points):
+                # 境界点の間の区間では、区間全体を含むイベントだけが開催中になる
+                following = self._points[i + 1]
+                self._after_point.append([p[3] for p in parsed if p[0] <= point and following <= p[1]])
+            else:
+                self._after_point.append([])
+
+        # これから始まるイベントは、開始時刻順 (同時刻は表示文字列順) に並べる
+        upcoming = sorted((p[0], p[4]) for p in parsed)
+        self._upcoming_starts: List[time] = [start for start, _ in upcoming]
+        self._upcoming_labels: List[str] = [label for _, label in upcoming]
+
+    def ongoing(self, now: time) -> List[str]:
+        """now の時点で開催中 (開始 <= now <= 終了) のイベントの表示文字列を返す。"""
+        i = bisect_left(self._points, now)
+        if i < len(self._points) and self._points[i] == now:
+            return self._at_point[i]
+        if i == 0:
+            return []
+        return self._after_point[i - 1]
+
+    def upcoming(self, now: time, until: time) -> List[str]:
+        """now より後、until 以前に始まるイベントの表示文字列を、開始時刻順に返す。"""
+        lo = bisect_right(self._upcoming_starts, now)
+        hi = bisect_right(self._upcoming_starts, until)
+        return self._upcoming_labels[lo:hi]
+
+
+def _load_timetable(path: str) -> TimetableIndex:
+    with open(path, "r", encoding="utf-8") as f:
+        return TimetableIndex(json.load(f))
+
+
+def _load_event_date(path: str) -> date:
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    return datetime.strptime(config["eventDate"], "%Y-%m-%d").date()
+
+
+def get_timetable_index(path: str) -> TimetableIndex:
+    """
+    タイムテーブルJSONの索引を返す。ファイルが更新された場合のみ読み込み直す。
+    ファイルが無い場合は FileNotFoundError、JSONが不正な場合は json.JSONDecodeError を送出する。
+    """
+    return _cache.get(path, _load_timetable)
+
+
+def get_event_date(path: str) -> date:
+    """
+    event_config.json の開催日を返す。ファイルが更新された場合のみ読み込み直す。
+    ファイルが無い場合は FileNotFoundError、開催日が無い場合は KeyError を送出する。
+    """
+    return _cache.get(path, _load_event_date)
@@ -0,0 +1,190 @@
+# backend/worker/app/lifecycle.py
+
+import logging
+import os
+import socket
+import threading
+import time
+
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown, worker_shutdown
+from redis.exceptions import RedisError
+
+from shared import worker_status
+from . import resources
+
+logger = logging.getLogger(__name__)
+
+# ウォームアップで使うダミー入力
+WARMUP_QUERY = "オープンキャンパスの基本情報"
+WARMUP_PROMPT = "こんにちは"
+# ウォームアップと準備完了の登録を行うか。応答を生成しないワーカー（要約用の summary_worker）では無効にし、
+# Gateway が応答可能なワーカーとして数えないようにする
+WORKER_WARMUP_ENABLED = os.getenv("WORKER_WARMUP_ENABLED", "true").lower() == "true"
+# これらのステップが成功するまで、ワーカーを準備完了として登録しない
+WARMUP_CRITICAL_STEPS = ("compile_graph", "embed", "llm")
+# 必須のステップに失敗した場合に、ウォームアップをやり直すまでの時間（秒）。失敗が続くと倍にしていく
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", "15"))
+WARMUP_RETRY_MAX_SECONDS = float(os.getenv("WARMUP_RETRY_MAX_SECONDS", "120"))
+
+# コンパイル済みグラフはプロセスごとに一度だけ構築し、全タスクで使い回す
+_chat_app = None
+_chat_app_lock = threading.Lock()
+
+_warmup_info: dict = {}
+_heartbeat_stop = threading.Event()
+
+
+def _worker_name() -> str:
+    """Redis上でワーカープロセスを識別する名前（ホスト名:PID）。"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def get_chat_app():
+    """
+    コンパイル済みのLangGraphパイプラインを返す。
+    初回呼び出し時にのみ build_graph を実行する。
+    """
+    global _chat_app
+    if _chat_app is None:
+        with _chat_app_lock:
+            if _chat_app is None:
+                from .graph.build import build_graph
+
+                start = time.perf_counter()
+                _chat_app = build_graph(
+                    rag_retriever=resources.get_rag_retriever(),
+                    llm=resources.get_llm(),
+                    intent_classifier=resources.get_intent_classifier(),
+                    lexical_index=resources.get_lexical_index(),
+                )
+                logger.info(f"LangGraphパイプラインをコンパイルしました ({time.perf_counter() - start:.3f}s)")
+    return _chat_app
+
+
+def warm_up() -> dict:
+    """
+    グラフのコンパイルに加え、Embedding・ベクトル検索・LLMを一度ずつ呼び出して
+    Chroma/Ollama のコールドスタートを最初のユーザーリクエストより前に済ませる。
+    各ステップの所要時間（秒）を返す。失敗したステップは記録した上でスキップする。
+    """
+    def fit_intent_classifier():
+        # 例文のEmbeddingから意図分類器の重心を計算しておく
+        intent_classifier = resources.get_intent_classifier()
+        return intent_classifier is None or intent_classifier.ensure_fitted()
+
+    steps = {
+        "compile_graph": get_chat_app,
+        "embed": lambda: resources.get_embeddings().embed_query(WARMUP_QUERY),
+        "intent_classifier": fit_intent_classifier,
+        "retrieve": lambda: resources.get_rag_retriever().invoke(WARMUP_QUERY),
+        # 保存済みのBM25索引を読み込んでおく（無効化されている場合は何もしない）
+        "lexical_index": lambda: resources.get_lexical_index() is None or resources.get_lexical_index().current(),
+        # 生成トークン数を1に抑え、モデルのロードだけを行う
+        "llm": lambda: resources.get_llm().invoke([("human", WARMUP_PROMPT)], num_predict=1),
+    }
+
+    timings = {}
+    for name, step in steps.items():
+        start = time.perf_counter()
+        try:
+            step()
+            timings[name] = round(time.perf_counter() - start, 3)
+        except Exception as e:
+            logger.warning(f"ウォームアップ '{name}' に失敗しました: {e}")
+            timings[name] = None
+    logger.info(f"ウォームアップ完了: {timings}")
+    return timings
+
+
+def _heartbeat_loop(worker_name: str) -> None:
+    """準備完了キーのTTLを定期的に延長する。Redis再起動などでキーが消えた場合は再登録する。"""
+    interval = max(1, worker_status.WORKER_READY_TTL_SECONDS // 3)
+    while not _heartbeat_stop.wait(interval):
+        try:
+            if not worker_status.refresh_worker_ready(worker_name):
+                worker_status.mark_worker_ready(worker_name, _warmup_info)
+        except RedisError as e:
+            logger.warning(f"準備完了キーの更新に失敗しました: {e}")
+
+
+def _warm_up_and_mark_ready() -> bool:
+    """
+    ウォームアップを行い、必須のステップがすべて成功した場合だけ準備完了として登録する。
+    Ollama の起動待ちなどで失敗した場合は登録せず False を返し、Gateway はこのワーカーにタスクを送らない。
+    """
+    global _warmup_info
+    timings = warm_up()
+    failed = [name for name in WARMUP_CRITICAL_STEPS if timings.get(name) is None]
+    if failed:
+        logger.warning(f"必須のウォームアップ {failed} に失敗したため、準備完了として登録しません")
+        return False
+    _warmup_info = {"warmup": timings, "warm": all(v is not None for v in timings.values())}
+
+    worker_name = _worker_name()
+    try:
+        worker_status.mark_worker_ready(worker_name, _warmup_info)
+    except RedisError as e:
+        # ハートビートが再登録する
+        logger.warning(f"準備完了キーの登録に失敗しました: {e}")
+    threading.Thread(target=_heartbeat_loop, args=(worker_name,), daemon=True).start()
+    return True
+
+
+def _retry_warm_up() -> None:
+    """準備完了になるか、ワーカーが終了するまでウォームアップをやり直す。"""
+    delay = WARMUP_RETRY_SECONDS
+    while not _heartbeat_stop.wait(delay):
+        if _warm_up_and_mark_ready():
+            return
+        delay = min(delay * 2, WARMUP_RETRY_MAX_SECONDS)
+
+
+def _warm_up_in_background() -> None:
+    if not _warm_up_and_mark_ready():
+        _retry_warm_up()
+
+
+def _is_prefork_pool(sender) -> bool:
+    pool_cls = getattr(sender, "pool_cls", None)
+    module = pool_cls if isinstance(pool_cls, str) else getattr(pool_cls, "__module__", "")
+    return "prefork" in (module or "")
+
+
+@worker_init.connect
+def _on_worker_init(sender=None, **kwargs):
+    """
+    threads/solo プールではメインプロセスがタスクを実行するため、ここでウォームアップする。
+    worker_init はタスクの受信開始前に呼ばれるので、ウォームアップ中のワーカーにタスクは配送されない。
+    失敗した場合の再試行は、受信開始を止めないようバックグラウンドで行う。
+    prefork の場合は子プロセス側（worker_process_init）で行う。
+    """
+    if WORKER_WARMUP_ENABLED and not _is_prefork_pool(sender):
+        if not _warm_up_and_mark_ready():
+            threading.Thread(target=_retry_warm_up, daemon=True).start()
+
+
+@worker_process_init.connect
+def _on_worker_process_init(**kwargs):
+    """
+    prefork の子プロセスごとにグラフを構築し、ウォームアップする。
+    worker_process_init が worker_proc_alive_timeout（既定4秒）を超えると子プロセスが再起動されるため、
+    ウォームアップはバックグラウンドのスレッドで行い、完了した時点で準備完了を登録する。
+    """
+    if WORKER_WARMUP_ENABLED:
+        threading.Thread(target=_warm_up_in_background, daemon=True).start()
+
+
+@worker_shutdown.connect
+@worker_process_shutdown.connect
+def _on_worker_shutdown(**kwargs):
+    _heartbeat_stop.set()
+    # 長期記憶への登録待ちの会話履歴を、プロセスの終了前に登録する
+    if resources.registry.is_loaded("history_writer") and resources.get_history_writer() is not None:
+        try:
+            resources.get_history_writer().close()
+        except Exception as e:
+            logger.error(f"終了時の長期記憶への登録に失敗しました: {e}")
+    try:
+        worker_status.clear_worker_ready(_worker_name())
+    except RedisError:
+        pass
@@ -0,0 +1,171 @@
+# backend/worker/app/rag/context_packer.py
+
+import os
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Set
+
+# 参考情報としてプロンプトに入れるトークン数の上限（推定値）
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# 文字shingleのJaccard係数がこの値以上のチャンクは、ほぼ重複とみなして順位の低い方を除く
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+# ほぼ重複の判定に使う文字shingleの長さ
+CONTEXT_SHINGLE_SIZE = int(os.getenv("CONTEXT_SHINGLE_SIZE", "5"))
+# 1つのソースごとに付く「[n] ソース: ...\n内容: 」の見出しのうち、ソース名を除いた部分のトークン数
+SOURCE_HEADER_TOKENS = 8
+
+_CJK_RE = re.compile(r"[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    トークン数の概算。Qwen系のトークナイザーでは日本語はおおよそ1文字1トークン、
+    英数字・記号は4文字で1トークン程度になるため、それぞれを数えて合計する。
+    """
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int, suffix: str = "…") -> str:
+    """推定トークン数が max_tokens に収まるよう、末尾を切り詰める。"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    budget = max(max_tokens - estimate_tokens(suffix), 0)
+    lo, hi = 0, len(text)
+    # 推定トークン数は文字数に対して単調に増えるため、収まる最長の長さを二分探索する
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo] + suffix
+
+
+def shingles(text: str, size: int = CONTEXT_SHINGLE_SIZE) -> Set[str]:
+    """空白の違い・全角半角の違いを無視した、文字単位のshingle集合。"""
+    normalized = _SPACE_RE.sub("", unicodedata.normalize("NFKC", text).lower())
+    if len(normalized) <= size:
+        return {normalized}
+    return {normalized[i:i + size] for i in range(len(normalized) - size + 1)}
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def source_key(metadata: Optional[dict]) -> str:
+    """
+    チャンクの出典を一意に表すキー。ファイル名は研究室・学科ごとに重複するため、
+    知識ベースからの相対パス（source_path）を使う。source_path の無い古いインデックスでは、
+    学科・研究室・ファイル名を組み合わせる。
+    """
+    metadata = metadata or {}
+    if metadata.get("source_path"):
+        return metadata["source_path"]
+    return "/".join(str(metadata[key]) for key in ("department", "lab", "source") if metadata.get(key))
+
+
+@dataclass
+class PackedSource:
+    """同じソースから選ばれたチャンクのまとまり。プロンプトではこの単位で [n] の番号を付ける。"""
+    source: str
+    metadata: dict
+    score: float
+    chunks: List[str] = field(default_factory=list)
+
+    @property
+    def text(self) -> str:
+        return "\n\n".join(self.chunks)
+
+
+@dataclass
+class PackedContext:
+    sources: List[PackedSource]
+    candidates: int
+    duplicates: int
+    dropped: int
+    kept_tokens: int
+    dropped_tokens: int
+
+    def summary(self) -> str:
+        return (
+            f"候補 {self.candidates} 件 → ほぼ重複 {self.duplicates} 件を除去, 予算超過で {self.dropped} 件を除外, "
+            f"{sum(len(s.chunks) for s in self.sources)} 件 / {len(self.sources)} ソースを採用 "
+            f"(推定 {self.kept_tokens} トークン, 削減 {self.dropped_tokens} トークン)"
+        )
+
+
+def pack_context(
+    texts: Sequence[str],
+    metadatas: Sequence[dict],
+    scores: Optional[Sequence[float]] = None,
+    token_budget: int = CONTEXT_TOKEN_BUDGET,
+    dedup_threshold: float = CONTEXT_DEDUP_THRESHOLD,
+) -> PackedContext:
+    """
+    検索で得たチャンクを、プロンプトに入れる参考情報として詰め直す。
+
+    1. スコアの高い順（scores が無ければ渡された順）に並べる
+    2. 既に採用したチャンクとほぼ重複するものを除く
+    3. 推定トークン数が予算に収まる範囲で、スコアの高いものから採用する
+       （最も順位の高いチャンクだけで予算を超える場合は、そのチャンクを予算に収まるよう切り詰めて採用する）
+    4. 採用したチャンクをソースごとにまとめ、最もスコアの高いチャンクの順にソースを並べる
+    """
+    if scores is None:
+        scores = [-rank for rank in range(len(texts))]
+    order = sorted(range(len(texts)), key=lambda i: scores[i], reverse=True)
+
+    kept: List[int] = []
+    kept_texts: Dict[int, str] = {}
+    kept_shingles: List[Set[str]] = []
+    duplicates = dropped = kept_tokens = dropped_tokens = 0
+    seen_sources: Set[str] = set()
+    for i in order:
+        text = texts[i]
+        text_shingles = shingles(text)
+        cost = estimate_tokens(text)
+        if any(jaccard(text_shingles, other) >= dedup_threshold for other in kept_shingles):
+            duplicates += 1
+            dropped_tokens += cost
+            continue
+        source = source_key(metadatas[i])
+        if source not in seen_sources:
+            cost += SOURCE_HEADER_TOKENS + estimate_tokens(source)
+        if kept_tokens + cost > token_budget:
+            if kept:
+                dropped += 1
+                dropped_tokens += estimate_tokens(text)
+                continue
+            # 最初の1件は参考情報が空にならないよう、見出しを含めて予算に収まるまで切り詰めて採用する
+            header_tokens = cost - estimate_tokens(text)
+            truncated = truncate_to_tokens(text, max(token_budget - header_tokens, 0))
+            dropped_tokens += estimate_tokens(text) - estimate_tokens(truncated)
+            text = truncated
+            cost = header_tokens + estimate_tokens(text)
+        kept.append(i)
+        kept_texts[i] = text
+        kept_shingles.append(text_shingles)
+        kept_tokens += cost
+        seen_sources.add(source)
+
+    groups: Dict[str, PackedSource] = {}
+    for i in kept:
+        metadata = metadatas[i] or {}
+        source = source_key(metadata)
+        if source not in groups:
+            groups[source] = PackedSource(source=source, metadata=dict(metadata), score=scores[i])
+        groups[source].chunks.append(kept_texts[i])
+
+    return PackedContext(
+        sources=list(groups.values()),
+        candidates=len(texts),
+        duplicates=duplicates,
+        dropped=dropped,
+        kept_tokens=kept_tokens,
+        dropped_tokens=dropped_tokens,
+    )
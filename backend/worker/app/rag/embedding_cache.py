@@ -0,0 +1,202 @@
+# backend/worker/app/rag/embedding_cache.py
+
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+# ワーカーと load_knowledge.py で共有する、ディスク上のEmbeddingキャッシュ
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "/app/worker/data/embedding_cache/embeddings.sqlite3")
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str, kind: str = "query") -> str:
+    """
+    キャッシュキー用に、Unicode正規化と前後の空白の除去を行う。
+    連続する空白を1つにまとめるのは検索クエリだけにする。文書（チャンク）では改行や字下げも
+    Embeddingの入力の一部であり、まとめると異なるベクトルになるはずの文書が同じキーになってしまう。
+    """
+    normalized = unicodedata.normalize("NFKC", text)
+    if kind == "query":
+        normalized = _WHITESPACE_RE.sub(" ", normalized)
+    return normalized.strip()
+
+
+class _DiskTier:
+    """SQLiteにベクトルをfloat32のバイト列として保存する永続キャッシュ。"""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._lock = threading.Lock()
+
+    # SQLiteのバインド変数の上限を超えないよう、IN句は分割して問い合わせる
+    _LOOKUP_BATCH = 500
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        rows = []
+        for i in range(0, len(keys), self._LOOKUP_BATCH):
+            batch = keys[i:i + self._LOOKUP_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            with self._lock:
+                rows.extend(self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall())
+        return {key: np.frombuffer(blob, dtype=np.float32).tolist() for key, blob in rows}
+
+    def put_many(self, items: Dict[str, List[float]]) -> None:
+        rows = [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items.items()]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    (モデル名, 正規化テキスト) をキーにEmbeddingをキャッシュするラッパー。
+    プロセス内のLRUとディスク(SQLite)の2段構成で、どちらにも無いテキストだけを
+    まとめて元のEmbeddingモデルへ問い合わせる。
+    """
+
+    def __init__(
+        self,
+        underlying: Embeddings,
+        model_name: str,
+        max_memory_entries: int = 4096,
+        disk_path: Optional[str] = EMBEDDING_CACHE_PATH,
+    ):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.max_memory_entries = max_memory_entries
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        # LRUとヒット数などのカウンタを守る。タスクと記憶の書き込みスレッドから同時に呼ばれる
+        self._lock = threading.Lock()
+        self._disk = None
+        if disk_path:
+            try:
+                self._disk = _DiskTier(disk_path)
+            except sqlite3.Error as e:
+                logger.warning(f"Embeddingのディスクキャッシュを開けませんでした ({disk_path}): {e}")
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.compute_seconds = 0.0
+
+    def _key(self, kind: str, text: str) -> str:
+        raw = f"{self.model_name}\0{kind}\0{normalize_text(text, kind)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: List[float]) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _embed_cached(self, kind: str, texts: List[str], compute) -> List[List[float]]:
+        keys = [self._key(kind, text) for text in texts]
+        results: Dict[str, List[float]] = {}
+
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    results[key] = self._memory[key]
+            self.memory_hits += len(results)
+
+        pending = [key for key in dict.fromkeys(keys) if key not in results]
+        if pending and self._disk is not None:
+            from_disk = self._disk.get_many(pending)
+            results.update(from_disk)
+            with self._lock:
+                self.disk_hits += len(from_disk)
+                for key, vector in from_disk.items():
+                    self._remember(key, vector)
+
+        # どのキャッシュにも無いテキストだけをまとめて計算する
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in results and key not in missing:
+                missing[key] = text
+        if missing:
+            start = time.perf_counter()
+            vectors = compute(list(missing.values()))
+            elapsed = time.perf_counter() - start
+            computed = dict(zip(missing.keys(), vectors))
+            results.update(computed)
+            with self._lock:
+                self.compute_seconds += elapsed
+                self.misses += len(missing)
+                for key, vector in computed.items():
+                    self._remember(key, vector)
+            if self._disk is not None:
+                self._disk.put_many(computed)
+
+        return [results[key] for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed_cached("document", texts, self.underlying.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_cached("query", [text], lambda texts: [self.underlying.embed_query(texts[0])])[0]
+
+    def embed_queries(self, texts: List[str], max_workers: int = 4) -> List[List[float]]:
+        """
+        複数の検索クエリをまとめてベクトル化する。
+        embed_documents は文書用の指示文(passage:)が付くため使わず、キャッシュに無いクエリだけを
+        embed_query で並行に計算する。
+        """
+        def compute(missing: List[str]) -> List[List[float]]:
+            if len(missing) == 1:
+                return [self.underlying.embed_query(missing[0])]
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(missing))) as executor:
+                return list(executor.map(self.underlying.embed_query, missing))
+
+        return self._embed_cached("query", texts, compute)
+
+    def snapshot(self) -> dict:
+        """集計用の生カウンタを返す。リクエスト単位の差分計算に使う。"""
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "compute_seconds": self.compute_seconds,
+            }
+
+    def stats(self, since: Optional[dict] = None) -> dict:
+        """
+        ヒット率と、キャッシュによって短縮できた推定時間を返す。
+        since に snapshot() の結果を渡すと、その時点からの差分を集計する。
+        短縮時間は「1テキストあたりの平均計算時間 × ヒット数」で見積もる。
+        """
+        current = self.snapshot()
+        base = since or {key: 0 for key in current}
+        delta = {key: current[key] - base[key] for key in current}
+
+        hits = delta["memory_hits"] + delta["disk_hits"]
+        total = hits + delta["misses"]
+        avg_compute = current["compute_seconds"] / current["misses"] if current["misses"] else 0.0
+        return {
+            "model": self.model_name,
+            "memory_hits": delta["memory_hits"],
+            "disk_hits": delta["disk_hits"],
+            "misses": delta["misses"],
+            "hit_ratio": round(hits / total, 4) if total else 0.0,
+            "compute_seconds": round(delta["compute_seconds"], 3),
+            "saved_seconds": round(hits * avg_compute, 3),
+        }
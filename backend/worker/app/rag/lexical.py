@@ -0,0 +1,200 @@
+# backend/worker/app/rag/lexical.py
+
+import json
+import logging
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from heapq import nlargest
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+# load_knowledge.py がChromaDBと同じディレクトリに書き出す、BM25の索引ファイル
+LEXICAL_INDEX_FILENAME = "lexical_index.json"
+LEXICAL_INDEX_FORMAT_VERSION = 1
+
+# ハイブリッド検索（BM25 + ベクトル検索）の設定
+HYBRID_SEARCH_ENABLED = os.getenv("HYBRID_SEARCH_ENABLED", "true").lower() == "true"
+# 1クエリあたりにBM25で取得する件数
+LEXICAL_TOP_K = int(os.getenv("LEXICAL_TOP_K", "10"))
+# Reciprocal Rank Fusion の定数k。大きいほど下位の結果も均等に効く
+RRF_K = int(os.getenv("RRF_K", "60"))
+# 統合後にプロンプトへ渡すチャンク数の上限
+HYBRID_TOP_K = int(os.getenv("HYBRID_TOP_K", "12"))
+
+# 英数字の単語と、ひらがな・カタカナ・漢字の連続をそれぞれ1つのまとまりとして取り出す
+_TOKEN_RUN_RE = re.compile(r"[a-z0-9]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    BM25用に日本語を考慮してトークン化する。
+    英数字は単語単位、日本語は文字bi-gram（1文字だけの場合はその文字）に分割する。
+    形態素解析を使わないため、「山口研」「吉田快」のような辞書に無い固有名詞も部分一致で拾える。
+    """
+    normalized = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+    for run in _TOKEN_RUN_RE.findall(normalized):
+        if run.isascii() or len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25Index:
+    """
+    チャンクに対するOkapi BM25の転置索引。
+    ChromaDBと同じチャンク（ID・本文・メタデータ）を保持し、検索結果をDocumentとして返す。
+    """
+
+    def __init__(
+        self,
+        ids: List[str],
+        texts: List[str],
+        metadatas: List[dict],
+        k1: float = 1.5,
+        b: float = 0.75,
+        postings: Optional[Dict[str, List[Tuple[int, int]]]] = None,
+        doc_lengths: Optional[List[int]] = None,
+    ):
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        self.k1 = k1
+        self.b = b
+        if postings is None or doc_lengths is None:
+            postings, doc_lengths = self._build_postings(texts)
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.avg_doc_length = (sum(doc_lengths) / len(doc_lengths)) if doc_lengths else 0.0
+        total = len(texts)
+        self.idf = {
+            token: math.log(1 + (total - len(entries) + 0.5) / (len(entries) + 0.5))
+            for token, entries in postings.items()
+        }
+
+    @staticmethod
+    def _build_postings(texts: List[str]):
+        postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        doc_lengths = []
+        for doc_index, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_lengths.append(sum(counts.values()))
+            for token, tf in counts.items():
+                postings[token].append((doc_index, tf))
+        return dict(postings), doc_lengths
+
+    @classmethod
+    def from_collection(cls, collection) -> "BM25Index":
+        """ChromaDBのコレクションに登録済みの全チャンクから索引を作る。"""
+        data = collection.get(include=["documents", "metadatas"])
+        return cls(data["ids"], data["documents"], [m or {} for m in data["metadatas"]])
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[Document, float]]:
+        """クエリに対するBM25スコアの上位k件を、(Document, スコア) のリストで返す。"""
+        scores: Dict[int, float] = defaultdict(float)
+        for token in set(tokenize(query)):
+            entries = self.postings.get(token)
+            if not entries:
+                continue
+            idf = self.idf[token]
+            for doc_index, tf in entries:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_index] / (self.avg_doc_length or 1.0))
+                scores[doc_index] += idf * tf * (self.k1 + 1) / (tf + norm)
+        top = nlargest(k, scores.items(), key=lambda item: item[1])
+        return [
+            (Document(page_content=self.texts[i], metadata=dict(self.metadatas[i])), score)
+            for i, score in top
+        ]
+
+    def save(self, path: str) -> None:
+        """索引をJSONで保存する。途中で中断しても壊れたファイルが残らないよう、一時ファイル経由で置き換える。"""
+        payload = {
+            "version": LEXICAL_INDEX_FORMAT_VERSION,
+            "k1": self.k1,
+            "b": self.b,
+            "ids": self.ids,
+            "texts": self.texts,
+            "metadatas": self.metadatas,
+            "doc_lengths": self.doc_lengths,
+            "postings": self.postings,
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        if payload.get("version") != LEXICAL_INDEX_FORMAT_VERSION:
+            raise ValueError(f"BM25索引の形式が異なります: {payload.get('version')}")
+        return cls(
+            payload["ids"],
+            payload["texts"],
+            payload["metadatas"],
+            k1=payload["k1"],
+            b=payload["b"],
+            postings={token: [tuple(entry) for entry in entries] for token, entries in payload["postings"].items()},
+            doc_lengths=payload["doc_lengths"],
+        )
+
+
+class LexicalIndexStore:
+    """
+    保存済みのBM25索引を読み込み、ファイルの更新時刻が変わったときだけ読み込み直す。
+    索引が無い・壊れている場合はNoneを返し、ベクトル検索のみで動作させる。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._mtime = None
+        self._index: Optional[BM25Index] = None
+        self._lock = threading.Lock()
+
+    def current(self) -> Optional[BM25Index]:
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return None
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    try:
+                        self._index = BM25Index.load(self.path)
+                        logger.info(f"BM25索引を読み込みました ({len(self._index)} チャンク): {self.path}")
+                    except (OSError, ValueError, KeyError) as e:
+                        logger.warning(f"BM25索引を読み込めませんでした: {e}")
+                        self._index = None
+                    self._mtime = mtime
+        return self._index
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[List[Document]], k: int = 60, limit: Optional[int] = None
+) -> List[Tuple[Document, float]]:
+    """
+    複数の検索結果の順位を Reciprocal Rank Fusion (score = Σ 1 / (k + 順位)) で統合する。
+    同じ本文のチャンクは1つにまとめ、統合後のスコアの高い順に (Document, スコア) を返す。
+    """
+    scores: Dict[str, float] = defaultdict(float)
+    documents: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            scores[doc.page_content] += 1.0 / (k + rank)
+            documents.setdefault(doc.page_content, doc)
+    ordered = sorted(scores, key=lambda content: scores[content], reverse=True)
+    if limit is not None:
+        ordered = ordered[:limit]
+    return [(documents[content], scores[content]) for content in ordered]
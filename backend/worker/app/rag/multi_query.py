@@ -0,0 +1,63 @@
+# backend/worker/app/rag/multi_query.py
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStoreRetriever
+
+# 複数クエリの検索を並行実行するスレッド数
+MULTI_QUERY_MAX_WORKERS = int(os.getenv("MULTI_QUERY_MAX_WORKERS", "5"))
+
+
+def embed_queries(embeddings, queries: List[str], max_workers: int = MULTI_QUERY_MAX_WORKERS) -> List[List[float]]:
+    """
+    全クエリのEmbeddingを一度に求める。
+    CachedEmbeddings であればキャッシュを一括で引き、無いものだけを並行に計算する。
+    """
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(queries, max_workers=max_workers)
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(queries))) as executor:
+        return list(executor.map(embeddings.embed_query, queries))
+
+
+def _search_by_vector(retriever: VectorStoreRetriever, query: str, vector: List[float]) -> List[Document]:
+    """retriever の検索設定（mmr / similarity と search_kwargs）をそのまま使って、ベクトルで検索する。"""
+    vectorstore = retriever.vectorstore
+    if retriever.search_type == "mmr":
+        return vectorstore.max_marginal_relevance_search_by_vector(vector, **retriever.search_kwargs)
+    if retriever.search_type == "similarity":
+        return vectorstore.similarity_search_by_vector(vector, **retriever.search_kwargs)
+    # スコア閾値付きなど、ベクトル指定に対応しない検索方式は通常の経路で実行する
+    return retriever.invoke(query)
+
+
+def retrieve_many(retriever: VectorStoreRetriever, queries: List[str], max_workers: int = MULTI_QUERY_MAX_WORKERS) -> List[List[Document]]:
+    """
+    複数の検索クエリを、まとめてベクトル化した上で並行に検索する。
+    全体の所要時間は各クエリの合計ではなく、最も遅いクエリに揃う。
+    戻り値はクエリと同じ順序の検索結果リスト。
+    """
+    if not queries:
+        return []
+
+    start = time.perf_counter()
+    vectors = embed_queries(retriever.vectorstore.embeddings, queries, max_workers=max_workers)
+    embed_seconds = time.perf_counter() - start
+    print(f"  - {len(queries)} 件のクエリをベクトル化しました ({embed_seconds:.3f}s)")
+
+    def search(args):
+        query, vector = args
+        search_start = time.perf_counter()
+        docs = _search_by_vector(retriever, query, vector)
+        return docs, time.perf_counter() - search_start
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(queries))) as executor:
+        outcomes = list(executor.map(search, zip(queries, vectors)))
+
+    for query, (docs, seconds) in zip(queries, outcomes):
+        print(f"  - クエリ「{query[:30]}...」で {len(docs)} 件取得 ({seconds:.3f}s)")
+    print(f"  - 複数クエリ検索の合計所要時間: {time.perf_counter() - start:.3f}s")
+    return [docs for docs, _ in outcomes]
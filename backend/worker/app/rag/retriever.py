@@ -1,25 +1,16 @@
 # backend/worker/app/rag/retriever.py
 
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_core.vectorstores import VectorStoreRetriever
-from langchain_community.embeddings import OllamaEmbeddings
 
-from backend.worker.app.core.config import settings
+from .. import resources
 
 def get_retriever() -> VectorStoreRetriever:
     """
     知識ベース用のChromaDBから情報を検索するためのRetrieverを初期化して返す。
+    ChromaDBのクライアントとEmbeddingモデルは、プロセス内で共有するものを使う。
     """
-    # Embeddingモデルを初期化
-    embedding_model = OllamaEmbeddings(model="mxbai-embed-large", base_url="http://ollama:11434")
-
-    # 永続化されたChromaDBに接続
-    vectorstore_knowledge = Chroma(
-        persist_directory=settings.CHROMA_KNOWLEDGE_PATH,
-        embedding_function=embedding_model,
-    )
+    # 永続化されたChromaDBに接続（初回呼び出し時にのみ生成される）
+    vectorstore_knowledge = resources.get_vectorstore_knowledge()
 
     # Retrieverを作成して返す
     return vectorstore_knowledge.as_retriever(search_kwargs={"k": 3})
-
@@ -0,0 +1,239 @@
+# backend/worker/app/rag/snapshot_index.py
+
+import glob
+import json
+import logging
+import os
+import threading
+import uuid
+from typing import Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+logger = logging.getLogger(__name__)
+
+# load_knowledge.py がChromaDBと同じディレクトリに書き出す、Embedding行列とそのサイドカー。
+# 行列は書き出すたびに別名のファイル（knowledge_snapshot.<世代>.npy）にし、サイドカーの matrix_file で参照する。
+# サイドカーの置き換えだけで行列とサイドカーの組が切り替わるため、読み込み途中に食い違った組を読むことがない
+SNAPSHOT_MATRIX_FILENAME = "knowledge_snapshot.npy"
+SNAPSHOT_MATRIX_PATTERN = "knowledge_snapshot*.npy"
+SNAPSHOT_META_FILENAME = "knowledge_snapshot.json"
+SNAPSHOT_FORMAT_VERSION = 1
+# 行列の保存形式。float16 にするとファイルとページキャッシュが半分になるが、検索時にfloat32へ変換する分だけ遅くなる
+SNAPSHOT_DTYPE = os.getenv("SNAPSHOT_DTYPE", "float32")
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def export_snapshot(
+    directory: str,
+    ids: List[str],
+    embeddings: Any,
+    texts: List[str],
+    metadatas: List[dict],
+    dtype: str = SNAPSHOT_DTYPE,
+) -> int:
+    """
+    チャンクのEmbeddingを行ごとに正規化した行列(.npy)と、ID・本文・メタデータのサイドカー(.json)を書き出す。
+    行列は新しい名前のファイルに書き出してから、それを参照するサイドカーを置き換える。
+    ワーカーはサイドカーの更新を検知して読み込み直すため、常に対応する行列とサイドカーの組を読む。
+    戻り値は書き出した行数。
+    """
+    if len(ids) == 0:
+        # チャンクが無い場合も、空の行列として書き出す（np.asarray([]) は1次元になるため）
+        matrix = np.zeros((0, 0), dtype=np.float32)
+    else:
+        matrix = np.asarray(embeddings, dtype=np.float32)
+    if matrix.ndim != 2 or len(matrix) != len(ids):
+        raise ValueError(f"Embedding行列の形が不正です: {matrix.shape} (チャンク数 {len(ids)})")
+    matrix = _normalize_rows(matrix).astype(dtype)
+
+    matrix_filename = f"knowledge_snapshot.{uuid.uuid4().hex[:12]}.npy"
+    matrix_path = os.path.join(directory, matrix_filename)
+    tmp_matrix_path = matrix_path + ".tmp"
+    with open(tmp_matrix_path, "wb") as f:
+        np.save(f, matrix)
+    os.replace(tmp_matrix_path, matrix_path)
+
+    meta_path = os.path.join(directory, SNAPSHOT_META_FILENAME)
+    tmp_meta_path = meta_path + ".tmp"
+    with open(tmp_meta_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "version": SNAPSHOT_FORMAT_VERSION,
+            "rows": len(ids),
+            "dimension": int(matrix.shape[1]) if len(ids) else 0,
+            "dtype": dtype,
+            "matrix_file": matrix_filename,
+            "ids": ids,
+            "texts": texts,
+            "metadatas": metadatas,
+        }, f, ensure_ascii=False)
+    os.replace(tmp_meta_path, meta_path)
+
+    # 古い世代の行列を削除する。開いているワーカーはメモリマップを保持しているため、そのまま検索を続けられる
+    for path in glob.glob(os.path.join(directory, SNAPSHOT_MATRIX_PATTERN)):
+        if os.path.basename(path) != matrix_filename:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"古いスナップショットの削除に失敗しました ({path}): {e}")
+    return len(ids)
+
+
+def snapshot_matrix_path(directory: str) -> str:
+    """サイドカーが参照している行列のパス。"""
+    with open(os.path.join(directory, SNAPSHOT_META_FILENAME), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    return os.path.join(directory, meta.get("matrix_file", SNAPSHOT_MATRIX_FILENAME))
+
+
+def maximal_marginal_relevance(
+    query: np.ndarray, candidates: np.ndarray, k: int, lambda_mult: float = 0.5
+) -> List[int]:
+    """
+    正規化済みのクエリと候補行列に対するMMR。候補同士の類似度行列を一度に計算し、
+    選択済みの文書との最大類似度をベクトルで更新していくため、各ステップは配列演算1回で済む。
+    戻り値は candidates の行番号（選択順）。
+    """
+    if len(candidates) == 0 or k <= 0:
+        return []
+    relevance = candidates @ query
+    similarity = candidates @ candidates.T
+    first = int(np.argmax(relevance))
+    selected = [first]
+    max_similarity = similarity[first].copy()
+    chosen = np.zeros(len(candidates), dtype=bool)
+    chosen[first] = True
+    for _ in range(min(k, len(candidates)) - 1):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[chosen] = -np.inf
+        index = int(np.argmax(scores))
+        selected.append(index)
+        chosen[index] = True
+        np.maximum(max_similarity, similarity[index], out=max_similarity)
+    return selected
+
+
+class KnowledgeSnapshot:
+    """
+    読み込み済みのスナップショット。行列は np.load(mmap_mode="r") で開くため、
+    同じファイルを開いた全プロセスがOSのページキャッシュを共有し、プロセスごとにコピーを持たない。
+    """
+
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, SNAPSHOT_META_FILENAME), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"スナップショットの形式が異なります: {meta.get('version')}")
+        # matrix_file の無いサイドカーは、固定の名前で行列を書き出していた頃のもの
+        matrix_file = meta.get("matrix_file", SNAPSHOT_MATRIX_FILENAME)
+        self.matrix = np.load(os.path.join(directory, matrix_file), mmap_mode="r")
+        if self.matrix.shape[0] != meta["rows"]:
+            raise ValueError(f"スナップショットの行数が一致しません: {self.matrix.shape[0]} != {meta['rows']}")
+        self.ids: List[str] = meta["ids"]
+        self.texts: List[str] = meta["texts"]
+        self.metadatas: List[dict] = meta["metadatas"]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _scores(self, query: np.ndarray) -> np.ndarray:
+        return np.asarray(self.matrix @ query.astype(self.matrix.dtype), dtype=np.float32)
+
+    def top_k(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """コサイン類似度の上位k件の (行番号, 類似度) を、類似度の高い順に返す。"""
+        k = min(k, len(self))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        scores = self._scores(query)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return top, scores[top]
+
+    def document(self, row: int) -> Document:
+        return Document(page_content=self.texts[row], metadata=dict(self.metadatas[row] or {}))
+
+
+class SnapshotVectorStore(VectorStore):
+    """
+    スナップショットをNumPyで検索する読み取り専用のベクトルストア。
+    Chromaと同じ as_retriever / *_by_vector のインターフェースを持つため、既存の検索経路をそのまま使える。
+    load_knowledge.py がスナップショットを書き直すと、次の検索から新しい内容を読み込む。
+    """
+
+    def __init__(self, directory: str, embedding_function: Embeddings):
+        self.directory = directory
+        self._embedding_function = embedding_function
+        self._snapshot: Optional[KnowledgeSnapshot] = None
+        self._signature = None
+        self._lock = threading.Lock()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding_function
+
+    def snapshot(self) -> KnowledgeSnapshot:
+        """
+        最新のスナップショットを返す。サイドカーの更新時刻が変わったときだけ開き直す。
+        開き直しに失敗した場合（書き出しの途中で古い行列が削除された場合など）は、読み込み済みのものを使い続け、
+        次の検索で再び開き直す。
+        """
+        stat = os.stat(os.path.join(self.directory, SNAPSHOT_META_FILENAME))
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature != self._signature:
+            with self._lock:
+                if signature != self._signature:
+                    try:
+                        snapshot = KnowledgeSnapshot(self.directory)
+                    except (OSError, ValueError) as e:
+                        if self._snapshot is None:
+                            raise
+                        logger.warning(f"スナップショットを読み込めないため、前回の内容で検索します: {e}")
+                        return self._snapshot
+                    self._snapshot = snapshot
+                    self._signature = signature
+                    logger.info(f"ベクトル検索用スナップショットを読み込みました ({len(self._snapshot)} チャンク)")
+        return self._snapshot
+
+    def similarity_search_by_vector_with_scores(self, embedding: List[float], k: int = 4) -> List[Tuple[Document, float]]:
+        snapshot = self.snapshot()
+        query = _normalize_rows(np.asarray([embedding], dtype=np.float32))[0]
+        rows, scores = snapshot.top_k(query, k)
+        return [(snapshot.document(int(row)), float(score)) for row, score in zip(rows, scores)]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_scores(embedding, k=k)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return self.similarity_search_by_vector(self._embedding_function.embed_query(query), k=k)
+
+    def max_marginal_relevance_search_by_vector(
+        self, embedding: List[float], k: int = 4, fetch_k: int = 20, lambda_mult: float = 0.5, **kwargs: Any
+    ) -> List[Document]:
+        snapshot = self.snapshot()
+        query = _normalize_rows(np.asarray([embedding], dtype=np.float32))[0]
+        rows, _ = snapshot.top_k(query, fetch_k)
+        candidates = np.asarray(snapshot.matrix[rows], dtype=np.float32)
+        selected = maximal_marginal_relevance(query, candidates, k=k, lambda_mult=lambda_mult)
+        return [snapshot.document(int(rows[i])) for i in selected]
+
+    def max_marginal_relevance_search(
+        self, query: str, k: int = 4, fetch_k: int = 20, lambda_mult: float = 0.5, **kwargs: Any
+    ) -> List[Document]:
+        return self.max_marginal_relevance_search_by_vector(
+            self._embedding_function.embed_query(query), k=k, fetch_k=fetch_k, lambda_mult=lambda_mult
+        )
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, **kwargs: Any) -> List[str]:
+        raise NotImplementedError("スナップショットは読み取り専用です。load_knowledge.py で再構築してください。")
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None, **kwargs: Any):
+        raise NotImplementedError("スナップショットは load_knowledge.py が書き出したファイルから読み込みます。")
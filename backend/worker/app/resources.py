@@ -0,0 +1,330 @@
+# backend/worker/app/resources.py
+
+import argparse
+import importlib
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+# --- 外部サービス・永続化先の設定 ---
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://ollama:11434")
+# 最後のリクエストからモデルをメモリに残しておく時間。アンロードされるとKVキャッシュも失われる
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+CHAT_MODEL = "qwen2.5:32b-instruct"
+EMBEDDING_MODEL = "mxbai-embed-large"
+MEMORY_EMBEDDING_MODEL = "nomic-embed-text"
+CHROMA_KNOWLEDGE_PATH = "/app/worker/data/vectorstore_knowledge"
+CHROMA_MEMORY_PATH = "/app/worker/data/vectorstore_memory"
+# 知識検索の実装。"snapshot" にすると、load_knowledge.py が書き出したEmbedding行列をメモリマップしてNumPyで検索する
+KNOWLEDGE_SEARCH_BACKEND = os.getenv("KNOWLEDGE_SEARCH_BACKEND", "chroma")
+NEO4J_URI = "bolt://neo4j:7687"
+NEO4J_USERNAME = "neo4j"
+NEO4J_PASSWORD = "password"
+# リソースの生成に失敗した後、次に生成を試みるまでの時間（秒）。失敗が続くと倍にしていく
+RESOURCE_RETRY_SECONDS = float(os.getenv("RESOURCE_RETRY_SECONDS", "10"))
+RESOURCE_RETRY_MAX_SECONDS = float(os.getenv("RESOURCE_RETRY_MAX_SECONDS", "300"))
+
+
+class ResourceUnavailableError(RuntimeError):
+    """生成に失敗したリソースが、再試行までの待ち時間中に要求されたときの例外。"""
+
+
+class ResourceRegistry:
+    """
+    LLM・Embedding・ベクトルストア・外部接続などの重いオブジェクトを、
+    初めて使われたときに一度だけ生成し、プロセス内で共有するためのレジストリ。
+    生成にかかった時間（モジュールのimportを含む）を記録する。
+    生成に失敗した場合は結果を記録せずに例外を送出し、待ち時間を置いてから次の get で生成をやり直す。
+    """
+
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._instances: Dict[str, Any] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._timings: Dict[str, float] = {}
+        # 生成に失敗したリソースの (次に生成を試みる時刻（time.monotonic）, その次の待ち時間, 最後のエラー)
+        self._failures: Dict[str, Tuple[float, float, Exception]] = {}
+        self._registry_lock = threading.Lock()
+
+    def register(self, name: str):
+        """生成関数を登録するデコレータ。"""
+        def decorator(factory: Callable[[], Any]) -> Callable[[], Any]:
+            self._factories[name] = factory
+            self._locks[name] = threading.Lock()
+            return factory
+        return decorator
+
+    def get(self, name: str) -> Any:
+        if name in self._instances:
+            return self._instances[name]
+        if name not in self._factories:
+            raise KeyError(f"未登録のリソースです: {name}")
+        # 他のリソースの生成を待たせないよう、ロックはリソースごとに分ける
+        with self._locks[name]:
+            if name not in self._instances:
+                failure = self._failures.get(name)
+                if failure is not None and time.monotonic() < failure[0]:
+                    raise ResourceUnavailableError(f"リソース '{name}' は利用できません: {failure[2]}")
+                start = time.perf_counter()
+                try:
+                    instance = self._factories[name]()
+                except Exception as e:
+                    delay = failure[1] if failure is not None else RESOURCE_RETRY_SECONDS
+                    self._failures[name] = (time.monotonic() + delay, min(delay * 2, RESOURCE_RETRY_MAX_SECONDS), e)
+                    logger.error(f"リソース '{name}' の生成に失敗しました。{delay:.0f}秒後に再試行します: {e}")
+                    raise
+                elapsed = time.perf_counter() - start
+                with self._registry_lock:
+                    self._instances[name] = instance
+                    self._timings[name] = elapsed
+                self._failures.pop(name, None)
+                logger.info(f"リソース '{name}' を生成しました ({elapsed:.3f}s)")
+        return self._instances[name]
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._instances
+
+    def names(self):
+        return list(self._factories)
+
+    def timings(self) -> Dict[str, float]:
+        """生成済みのリソースと、その生成にかかった秒数。"""
+        return {name: round(seconds, 3) for name, seconds in self._timings.items()}
+
+
+registry = ResourceRegistry()
+
+
+@registry.register("llm")
+def _create_llm():
+    from langchain_community.chat_models import ChatOllama
+
+    return ChatOllama(
+        model=CHAT_MODEL,
+        # model="deepseek-r1:671b",
+        # model="deepseek-r1:70b",
+        base_url=OLLAMA_BASE_URL, temperature=0.0,
+        # プロンプトの先頭部分のKVキャッシュを再利用できるよう、リクエストの合間もモデルを常駐させる
+        keep_alive=OLLAMA_KEEP_ALIVE)
+
+
+@registry.register("embeddings")
+def _create_embeddings():
+    from langchain_community.embeddings import OllamaEmbeddings
+
+    from .rag.embedding_cache import CachedEmbeddings
+
+    # 同じ検索クエリ・記憶テキストを何度もOllamaへ問い合わせないよう、キャッシュで包む
+    return CachedEmbeddings(
+        OllamaEmbeddings(model=EMBEDDING_MODEL, base_url=OLLAMA_BASE_URL),
+        model_name=EMBEDDING_MODEL,
+    )
+
+
+@registry.register("memory_embedder")
+def _create_memory_embedder():
+    from langchain_community.embeddings import OllamaEmbeddings
+
+    return OllamaEmbeddings(model=MEMORY_EMBEDDING_MODEL, base_url=OLLAMA_BASE_URL)
+
+
+@registry.register("vectorstore_knowledge")
+def _create_vectorstore_knowledge():
+    if KNOWLEDGE_SEARCH_BACKEND == "snapshot":
+        from .rag.snapshot_index import SNAPSHOT_META_FILENAME, SnapshotVectorStore
+
+        if os.path.exists(os.path.join(CHROMA_KNOWLEDGE_PATH, SNAPSHOT_META_FILENAME)):
+            return SnapshotVectorStore(CHROMA_KNOWLEDGE_PATH, embedding_function=get_embeddings())
+        logger.warning("ベクトル検索用スナップショットが見つからないため、ChromaDBで検索します。")
+
+    from langchain_community.vectorstores import Chroma
+
+    return Chroma(persist_directory=CHROMA_KNOWLEDGE_PATH, embedding_function=get_embeddings())
+
+
+@registry.register("vectorstore_memory")
+def _create_vectorstore_memory():
+    from langchain_community.vectorstores import Chroma
+
+    return Chroma(persist_directory=CHROMA_MEMORY_PATH, embedding_function=get_embeddings())
+
+
+@registry.register("rag_retriever")
+def _create_rag_retriever():
+    return get_vectorstore_knowledge().as_retriever(
+        search_type="mmr",
+        search_kwargs={'k': 10, 'fetch_k': 50}
+    )
+
+
+@registry.register("answer_cache")
+def _create_answer_cache():
+    from .services.answer_cache import KnowledgeVersion, SemanticAnswerCache
+
+    # 同一・類似の質問に対して、グラフ全体の実行を省略するための応答キャッシュ
+    return SemanticAnswerCache(
+        embeddings=get_embeddings(),
+        knowledge_version=KnowledgeVersion(CHROMA_KNOWLEDGE_PATH),
+        similarity_threshold=float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95")),
+        ttl_seconds=int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "1800")),
+        max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "512")),
+    )
+
+
+@registry.register("intent_classifier")
+def _create_intent_classifier():
+    from .graph.intent_classifier import INTENT_PRECLASSIFIER_ENABLED, IntentClassifier
+
+    # 挨拶・雑談など明らかな入力は、LLMを使わずにEmbeddingの近傍で意図を分類する
+    return IntentClassifier(get_embeddings()) if INTENT_PRECLASSIFIER_ENABLED else None
+
+
+@registry.register("lexical_index")
+def _create_lexical_index():
+    from .rag.lexical import HYBRID_SEARCH_ENABLED, LEXICAL_INDEX_FILENAME, LexicalIndexStore
+
+    # load_knowledge.py がChromaDBと同じチャンクから作成したBM25索引。更新されると自動で読み込み直す
+    if not HYBRID_SEARCH_ENABLED:
+        return None
+    return LexicalIndexStore(os.path.join(CHROMA_KNOWLEDGE_PATH, LEXICAL_INDEX_FILENAME))
+
+
+@registry.register("history_writer")
+def _create_history_writer():
+    from .services.history_writer import MEMORY_WRITE_BEHIND_ENABLED, MemoryWriteBehind
+
+    # 会話履歴の長期記憶への登録（ベクトル化）を応答から切り離し、バックグラウンドでまとめて行う
+    if not MEMORY_WRITE_BEHIND_ENABLED:
+        return None
+    return MemoryWriteBehind(vectorstore_factory=get_vectorstore_memory)
+
+
+@registry.register("spacy_nlp")
+def _create_spacy_nlp():
+    import spacy
+
+    # workerコンテナでja_core_news_smがダウンロード済みであることを前提
+    try:
+        return spacy.load("ja_core_news_sm")
+    except OSError:
+        logger.error("SpaCy 'ja_core_news_sm' モデルが見つかりません。コンテナビルド中にインストールされているか確認してください。")
+        raise
+
+
+@registry.register("neo4j_driver")
+def _create_neo4j_driver():
+    from neo4j import GraphDatabase
+
+    driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USERNAME, NEO4J_PASSWORD))
+    try:
+        driver.verify_connectivity()
+    except Exception:
+        driver.close()
+        raise
+    logger.info("Neo4jドライバーが正常に初期化されました。")
+    return driver
+
+
+def get_llm():
+    return registry.get("llm")
+
+
+def get_embeddings():
+    return registry.get("embeddings")
+
+
+def get_memory_embedder():
+    return registry.get("memory_embedder")
+
+
+def get_vectorstore_knowledge():
+    return registry.get("vectorstore_knowledge")
+
+
+def get_vectorstore_memory():
+    return registry.get("vectorstore_memory")
+
+
+def get_rag_retriever():
+    return registry.get("rag_retriever")
+
+
+def get_answer_cache():
+    return registry.get("answer_cache")
+
+
+def get_intent_classifier():
+    return registry.get("intent_classifier")
+
+
+def get_lexical_index():
+    return registry.get("lexical_index")
+
+
+def get_history_writer():
+    return registry.get("history_writer")
+
+
+def get_spacy_nlp():
+    return registry.get("spacy_nlp")
+
+
+def get_neo4j_driver():
+    return registry.get("neo4j_driver")
+
+
+# --- import時間の計測 ---
+
+PROFILED_MODULES = (
+    "worker.app.tasks",
+    "worker.app.lifecycle",
+    "worker.app.rag.retriever",
+    "worker.app.rag.graph_retriever",
+    "worker.app.services.memory_service",
+)
+
+
+def profile_imports(modules=PROFILED_MODULES) -> Dict[str, float]:
+    """
+    モジュールを順にimportし、それぞれの所要時間（秒）を返す。
+    既にimport済みの依存は後続のモジュールの時間に含まれないため、順序に注意する。
+    """
+    timings = {}
+    for module in modules:
+        start = time.perf_counter()
+        importlib.import_module(module)
+        timings[module] = round(time.perf_counter() - start, 3)
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="ワーカーのimport時間と、リソースの生成時間を計測します。")
+    parser.add_argument("--load", nargs="*", metavar="NAME", help="続けて生成するリソース（名前を省略すると全て）")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    print("--- import時間 ---")
+    for module, seconds in profile_imports().items():
+        print(f"  {module:<40} {seconds:.3f}s")
+    loaded = [name for name in registry.names() if registry.is_loaded(name)]
+    print(f"import時に生成されたリソース: {loaded or 'なし'}")
+    print(f"読み込み済みモジュール数: {len(sys.modules)}")
+
+    if args.load is not None:
+        print("\n--- リソースの生成時間 ---")
+        for name in args.load or registry.names():
+            try:
+                registry.get(name)
+            except Exception as e:
+                print(f"  {name:<24} 失敗: {e}")
+        for name, seconds in registry.timings().items():
+            print(f"  {name:<24} {seconds:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+# backend/worker/app/services/answer_cache.py
+
+import logging
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# load_knowledge.py が知識ベースを再構築するたびに書き換えるバージョンファイル
+KNOWLEDGE_VERSION_FILENAME = "knowledge_version.txt"
+
+
+def normalize_question(text: str) -> str:
+    """全角・半角や末尾の記号の揺れを吸収した、キャッシュ用の正規化済み質問文を返す。"""
+    normalized = unicodedata.normalize("NFKC", text).strip().lower()
+    return normalized.rstrip("?？!！。.、, 　")
+
+
+class KnowledgeVersion:
+    """
+    知識ベースのバージョンファイルを読み、更新時刻が変わったときだけ再読込する。
+    ファイルが存在しない場合は "unversioned" を返す。
+    """
+
+    def __init__(self, vectorstore_path: str):
+        self.path = os.path.join(vectorstore_path, KNOWLEDGE_VERSION_FILENAME)
+        self._mtime = None
+        self._version = "unversioned"
+
+    def current(self) -> str:
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return "unversioned"
+        if mtime != self._mtime:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._version = f.read().strip() or "unversioned"
+            self._mtime = mtime
+        return self._version
+
+
+@dataclass
+class CacheEntry:
+    question: str
+    answer: str
+    scope: str
+    knowledge_version: str
+    vector: np.ndarray
+    latency_seconds: float
+    created_at: float = field(default_factory=time.time)
+
+
+@dataclass
+class CacheHit:
+    answer: str
+    similarity: float
+    saved_seconds: float
+
+
+class SemanticAnswerCache:
+    """
+    質問文のEmbeddingの近傍探索で、過去の回答を再利用する応答キャッシュ。
+    エントリは scope（イベント状況など）と知識ベースのバージョンで区別され、
+    TTLの経過・LRUの上限・知識ベースの再構築によって無効になる。
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        knowledge_version: KnowledgeVersion,
+        similarity_threshold: float = 0.95,
+        ttl_seconds: int = 1800,
+        max_entries: int = 512,
+    ):
+        self.embeddings = embeddings
+        self.knowledge_version = knowledge_version
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 直近のlookupで計算したベクトルを、store時に使い回す
+        self._last_vector: Optional[tuple] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self.lookup_seconds = 0.0
+
+    def _embed(self, normalized: str) -> np.ndarray:
+        # 別のスレッドが途中で書き換えても、質問文とベクトルの組が食い違わないよう1回だけ読む
+        last_vector = self._last_vector
+        if last_vector is not None and last_vector[0] == normalized:
+            return last_vector[1]
+        vector = np.asarray(self.embeddings.embed_query(normalized), dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        self._last_vector = (normalized, vector)
+        return vector
+
+    def _live_entries(self, scope: str, version: str) -> List[tuple]:
+        """期限切れ・旧バージョンのエントリを掃除し、同じscopeの有効なエントリを返す。"""
+        now = time.time()
+        live = []
+        for key, entry in list(self._entries.items()):
+            if now - entry.created_at > self.ttl_seconds or entry.knowledge_version != version:
+                del self._entries[key]
+            elif entry.scope == scope:
+                live.append((key, entry))
+        return live
+
+    def lookup(self, question: str, scope: str) -> Optional[CacheHit]:
+        """類似度が閾値以上の回答があれば返す。"""
+        start = time.perf_counter()
+        normalized = normalize_question(question)
+        version = self.knowledge_version.current()
+
+        with self._lock:
+            live = self._live_entries(scope, version)
+            best = None
+            exact = self._entries.get((scope, normalized))
+            if exact is not None and exact.knowledge_version == version:
+                best = ((scope, normalized), exact, 1.0)
+
+        if best is None and live:
+            # 完全一致しない場合のみEmbeddingを計算する
+            vector = self._embed(normalized)
+            matrix = np.stack([entry.vector for _, entry in live])
+            similarities = matrix @ vector
+            index = int(np.argmax(similarities))
+            if similarities[index] >= self.similarity_threshold:
+                key, entry = live[index]
+                best = (key, entry, float(similarities[index]))
+
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.lookup_seconds += elapsed
+            if best is None:
+                self.misses += 1
+                return None
+            key, entry, similarity = best
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            saved = max(0.0, entry.latency_seconds - elapsed)
+            self.hits += 1
+            self.saved_seconds += saved
+
+        logger.info(f"応答キャッシュにヒットしました (類似度: {similarity:.3f}, 元の質問: {entry.question}, 短縮: {saved:.2f}s)")
+        return CacheHit(answer=entry.answer, similarity=similarity, saved_seconds=saved)
+
+    def store(self, question: str, scope: str, answer: str, latency_seconds: float) -> None:
+        """パイプラインで生成した回答を登録する。"""
+        normalized = normalize_question(question)
+        vector = self._embed(normalized)
+        entry = CacheEntry(
+            question=question,
+            answer=answer,
+            scope=scope,
+            knowledge_version=self.knowledge_version.current(),
+            vector=vector,
+            latency_seconds=latency_seconds,
+        )
+        with self._lock:
+            key = (scope, normalized)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "saved_seconds": round(self.saved_seconds, 3),
+            "avg_lookup_ms": round(self.lookup_seconds / total * 1000, 3) if total else 0.0,
+        }
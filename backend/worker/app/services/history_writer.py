@@ -0,0 +1,162 @@
+# backend/worker/app/services/history_writer.py
+
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 長期記憶（ベクトルストア）への会話履歴の登録を応答から切り離し、バックグラウンドでまとめて行うか。
+# DB（短期記憶）への保存はタスクの中で同期的に行うため、ここで遅れるのは長期記憶の検索結果への反映だけ
+MEMORY_WRITE_BEHIND_ENABLED = os.getenv("MEMORY_WRITE_BEHIND_ENABLED", "true").lower() == "true"
+# 1回のベクトル化でまとめるターン数の上限
+MEMORY_UPSERT_BATCH_SIZE = int(os.getenv("MEMORY_UPSERT_BATCH_SIZE", "32"))
+# 溜まったターンを登録するまでの最大の待ち時間（秒）
+MEMORY_UPSERT_FLUSH_INTERVAL_SECONDS = float(os.getenv("MEMORY_UPSERT_FLUSH_INTERVAL_SECONDS", "1.0"))
+# 登録に失敗したターンを捨てるまでの再試行回数
+MEMORY_UPSERT_MAX_RETRIES = int(os.getenv("MEMORY_UPSERT_MAX_RETRIES", "5"))
+
+
+@dataclass
+class PendingTurn:
+    """まだ長期記憶に登録されていない会話の1ターン。"""
+    user_id: int
+    session_id: str
+    turn: int
+    human_message: str
+    ai_message: str
+    attempts: int = 0
+
+    @property
+    def key(self) -> Tuple[int, str, int]:
+        return (self.user_id, self.session_id, self.turn)
+
+
+def memory_vector_id(user_id: int, session_id: str, turn: int) -> str:
+    """長期記憶のベクトルのID。同じターンを何度書き込んでも1件になるよう、ターンから決める。"""
+    return f"history:{user_id}:{session_id}:{turn}"
+
+
+def memory_vector_text(human_message: str, ai_message: str) -> str:
+    return f"ユーザーの質問: {human_message}\nAIの応答: {ai_message}"
+
+
+def memory_vector_metadata(user_id: int, session_id: str, turn: int) -> dict:
+    return {
+        "user_id": user_id,
+        "session_id": session_id,
+        "turn": turn,
+        "type": "conversation_history" # 知識と区別するためのメタデータ
+    }
+
+
+class MemoryWriteBehind:
+    """
+    長期記憶（ベクトルストア）への会話履歴の登録を溜めておき、バックグラウンドのスレッドでまとめて行う。
+
+    - 全ターンのテキストを1回の add_texts (embed_documents) でベクトル化し、ターンから決まるIDで upsert する
+    - 会話履歴そのもの（DB）は、タスクの中で bulk_create_history_records により保存済みであることを前提とする。
+      そのため、ワーカーが落ちて登録待ちのターンが失われても、失われるのは長期記憶の検索対象だけで、
+      会話履歴や要約には影響しない
+    """
+
+    def __init__(
+        self,
+        vectorstore_factory: Callable,
+        batch_size: int = MEMORY_UPSERT_BATCH_SIZE,
+        flush_interval: float = MEMORY_UPSERT_FLUSH_INTERVAL_SECONDS,
+    ):
+        self.vectorstore_factory = vectorstore_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending: Dict[Tuple[int, str, int], PendingTurn] = {}
+        self._condition = threading.Condition()
+        # flush() の同時実行（バックグラウンドとシャットダウン時）を防ぐ
+        self._flush_lock = threading.Lock()
+        self._stopped = False
+        self._stats = {"submitted": 0, "written": 0, "batches": 0, "failures": 0, "dropped": 0}
+        self._thread = threading.Thread(target=self._run, name="memory-write-behind", daemon=True)
+        self._thread.start()
+
+    def submit(self, user_id: int, session_id: str, turn: int, human_message: str, ai_message: str) -> None:
+        """ターンを登録待ちに加える。すぐに戻り、ベクトル化はバックグラウンドで行う。"""
+        item = PendingTurn(user_id, session_id, turn, human_message, ai_message)
+        with self._condition:
+            self._pending[item.key] = item
+            self._stats["submitted"] += 1
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                if not self._stopped and len(self._pending) < self.batch_size:
+                    self._condition.wait(self.flush_interval)
+                if self._stopped:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("長期記憶の登録スレッドで予期しないエラーが発生しました。")
+
+    def flush(self) -> int:
+        """登録待ちのターンを全て登録する。登録した（試みた）ターン数を返す。"""
+        with self._flush_lock:
+            with self._condition:
+                batch = sorted(self._pending.values(), key=lambda item: item.key)
+            if not batch:
+                return 0
+            for start in range(0, len(batch), self.batch_size):
+                self._write_batch(batch[start:start + self.batch_size])
+            return len(batch)
+
+    def _write_batch(self, batch: List[PendingTurn]) -> None:
+        started = time.perf_counter()
+        try:
+            self.vectorstore_factory().add_texts(
+                texts=[memory_vector_text(item.human_message, item.ai_message) for item in batch],
+                metadatas=[memory_vector_metadata(item.user_id, item.session_id, item.turn) for item in batch],
+                ids=[memory_vector_id(item.user_id, item.session_id, item.turn) for item in batch],
+            )
+        except Exception as e:
+            self._handle_failure(batch, e)
+            return
+
+        with self._condition:
+            for item in batch:
+                # 登録中に同じキーで再登録されたものは残す
+                if self._pending.get(item.key) is item:
+                    del self._pending[item.key]
+            self._stats["written"] += len(batch)
+            self._stats["batches"] += 1
+        logger.info(f"長期記憶に会話履歴を {len(batch)} ターン登録しました ({time.perf_counter() - started:.3f}s)")
+
+    def _handle_failure(self, batch: List[PendingTurn], error: Exception) -> None:
+        """失敗したターンは登録待ちに残し、次回に再試行する。再試行の上限を超えたものは捨てる。"""
+        dropped = []
+        with self._condition:
+            self._stats["failures"] += 1
+            for item in batch:
+                item.attempts += 1
+                if item.attempts >= MEMORY_UPSERT_MAX_RETRIES and self._pending.get(item.key) is item:
+                    del self._pending[item.key]
+                    dropped.append(item)
+            self._stats["dropped"] += len(dropped)
+        logger.error(f"長期記憶への会話履歴の登録に失敗しました ({len(batch)} ターン): {error}")
+        for item in dropped:
+            logger.error(f"再試行の上限に達したため、長期記憶への登録を諦めました: {item.key}")
+
+    def close(self, timeout: float = 10.0) -> None:
+        """バックグラウンドのスレッドを止め、残っているターンを登録する（ワーカーの終了時に呼ぶ）。"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join(timeout)
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {**self._stats, "pending": len(self._pending)}
@@ -1,17 +1,48 @@
 # backend/worker/app/services/memory_service.py
 
+import os
 import logging
-from typing import List
-import numpy as np
-from sklearn.cluster import AgglomerativeClustering
+from dataclasses import dataclass, field
+from typing import List, Optional
 from sqlalchemy.orm import Session
 from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
-from langchain_community.embeddings import OllamaEmbeddings
-from shared.db.crud import get_history_by_session_id, create_history_record
+from shared.db.crud import (
+    allocate_turn,
+    bulk_create_history_records,
+    get_conversation_summary,
+    get_history_after_turn,
+    get_history_turn_range,
+    save_conversation_summary,
+)
+from .. import resources
+from .history_writer import memory_vector_id, memory_vector_metadata, memory_vector_text
+from ..graph.prompts import get_prompt
+from ..rag.context_packer import estimate_tokens, truncate_to_tokens
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# --- 会話履歴の要約の設定 ---
+MEMORY_SUMMARY_ENABLED = os.getenv("MEMORY_SUMMARY_ENABLED", "true").lower() == "true"
+# 要約せずにそのままプロンプトに含める、直近の会話ターン数
+MEMORY_RECENT_TURNS = int(os.getenv("MEMORY_RECENT_TURNS", "2"))
+# 要約と直近の会話を合わせて、プロンプトに含める会話履歴のトークン数の上限（推定値）
+MEMORY_HISTORY_TOKEN_CAP = int(os.getenv("MEMORY_HISTORY_TOKEN_CAP", "1200"))
+# 要約の長さの上限（推定トークン数）
+MEMORY_SUMMARY_MAX_TOKENS = int(os.getenv("MEMORY_SUMMARY_MAX_TOKENS", "300"))
+# 要約の入力に含める、1回分のAIの応答の長さの上限（推定トークン数）
+SUMMARY_INPUT_MAX_TOKENS_PER_ANSWER = 400
+# 要約が追いついていない場合も含め、DBから読む直近の会話の最大件数
+HISTORY_FETCH_LIMIT = 5
+
+
+@dataclass
+class ConversationContext:
+    """プロンプトに含める会話の文脈。summary は直近のターンより前の会話の要約。"""
+    summary: Optional[str] = None
+    messages: List[BaseMessage] = field(default_factory=list)
+
+
 class MemoryService:
     def __init__(self, db_session: Session, vectorstore_memory):
         """
@@ -20,58 +51,128 @@ class MemoryService:
         """
         self.db_session = db_session
         self.vectorstore_memory = vectorstore_memory # 長期記憶用ベクトルストア
-        self.embedder = OllamaEmbeddings(
-            model="nomic-embed-text",
-            base_url="http://ollama:11434"
-        )
+
+    @property
+    def embedder(self):
+        """記憶用のEmbeddingモデル。タスクごとに生成せず、プロセス内で共有するものを返す。"""
+        return resources.get_memory_embedder()
 
     def get_history(self, user_id: int, session_id: str) -> List[BaseMessage]:
         """
-        短期記憶（DB）から会話履歴を取得します。
-        ※このデモでは、意味的重複排除や長期記憶からの取得は省略し、
-        　短期記憶のみを返すシンプルな実装とします。
+        短期記憶（DB）から、要約されていない直近の会話履歴を取得します。
+        """
+        return self.get_context(user_id, session_id).messages
+
+    def get_context(self, user_id: int, session_id: str) -> ConversationContext:
+        """
+        プロンプトに含める会話の文脈（要約 + 要約されていない直近のターン）を取得します。
+        要約と直近のターンを合わせた推定トークン数が MEMORY_HISTORY_TOKEN_CAP を超える場合は、
+        古いターンから省き、最新のターンだけでも超える場合はAIの応答を切り詰めます。
         """
         logger.info(f"短期記憶からメッセージを取得中 (Session ID: {session_id})")
-        return self._get_short_term_memory(user_id, session_id)
+        summary, summarized_turn = None, 0
+        if MEMORY_SUMMARY_ENABLED:
+            record = get_conversation_summary(self.db_session, session_id, user_id)
+            if record is not None:
+                summary = truncate_to_tokens(record.summary, MEMORY_SUMMARY_MAX_TOKENS)
+                summarized_turn = record.summarized_turn
 
-    def _get_short_term_memory(self, user_id: int, session_id: str) -> List[BaseMessage]:
-        """DBから直近の会話履歴を取得します"""
-        history_records = get_history_by_session_id(self.db_session, session_id, user_id)
-        history_records.reverse()
+        # 要約の更新が遅れている場合も、要約済みでないターンは落とさないよう、要約済みのターンより後を全て候補にする
+        records = get_history_after_turn(self.db_session, session_id, user_id, summarized_turn, limit=HISTORY_FETCH_LIMIT)
+        budget = MEMORY_HISTORY_TOKEN_CAP - (estimate_tokens(summary) if summary else 0)
 
-        history: List[BaseMessage] = []
-        for record in history_records:
-            history.append(HumanMessage(content=record.human_message))
-            history.append(AIMessage(content=record.ai_message))
-        return history
+        kept = []
+        used = 0
+        for record in records:
+            human_tokens = estimate_tokens(record.human_message)
+            cost = human_tokens + estimate_tokens(record.ai_message)
+            if kept and used + cost > budget:
+                break
+            ai_message = record.ai_message
+            if not kept and cost > budget:
+                ai_message = truncate_to_tokens(ai_message, max(budget - human_tokens, 0))
+                cost = human_tokens + estimate_tokens(ai_message)
+            kept.append((record.human_message, ai_message))
+            used += cost
+        kept.reverse()
+
+        messages: List[BaseMessage] = []
+        for human_message, ai_message in kept:
+            messages.append(HumanMessage(content=human_message))
+            messages.append(AIMessage(content=ai_message))
+        logger.info(
+            f"会話の文脈: 要約 {'あり' if summary else 'なし'} (ターン{summarized_turn}まで), "
+            f"直近 {len(kept)}/{len(records)} ターン, 推定 {used + (estimate_tokens(summary) if summary else 0)} トークン"
+        )
+        return ConversationContext(summary=summary, messages=messages)
+
+    def next_turn(self, user_id: int, session_id: str) -> int:
+        """
+        次のターン数を採番します。採番はセッションのカウンター（chat_sessions）で行うため、
+        保存が終わる前に同じセッションで次の質問が来ても、ターン数が重複しません。
+        """
+        return allocate_turn(self.db_session, session_id, user_id)
+
+    def update_summary(self, user_id: int, session_id: str, llm) -> Optional[int]:
+        """
+        直近 MEMORY_RECENT_TURNS ターンより前で、まだ要約に含まれていないターンを要約に統合します。
+        要約を更新した場合は要約に含めた最後のターン数を、更新が不要だった場合はNoneを返します。
+        """
+        record = get_conversation_summary(self.db_session, session_id, user_id)
+        summarized_turn = record.summarized_turn if record is not None else 0
+        latest = get_history_after_turn(self.db_session, session_id, user_id, summarized_turn, limit=1)
+        if not latest:
+            return None
+        target_turn = latest[0].turn - MEMORY_RECENT_TURNS
+        if target_turn <= summarized_turn:
+            return None
+
+        turns = get_history_turn_range(self.db_session, session_id, user_id, summarized_turn, target_turn)
+        turns_text = "\n".join(
+            f"ユーザー: {turn.human_message}\nAI: {truncate_to_tokens(turn.ai_message, SUMMARY_INPUT_MAX_TOKENS_PER_ANSWER)}"
+            for turn in turns
+        )
+        prompt_messages = get_prompt("conversation_summary").render(
+            summary=record.summary if record is not None else "なし",
+            turns=turns_text,
+            max_chars=MEMORY_SUMMARY_MAX_TOKENS,
+        )
+        # 要約が長くなりすぎないよう、生成するトークン数にも上限を設ける
+        summary = llm.invoke(prompt_messages, num_predict=MEMORY_SUMMARY_MAX_TOKENS * 2).content.strip()
+        summary = truncate_to_tokens(summary, MEMORY_SUMMARY_MAX_TOKENS)
+        save_conversation_summary(self.db_session, session_id, user_id, summary, target_turn)
+        logger.info(
+            f"会話の要約を更新しました (Session ID: {session_id}, ターン{summarized_turn + 1}〜{target_turn}, "
+            f"推定 {estimate_tokens(summary)} トークン)"
+        )
+        return target_turn
 
     def save_history(self, user_id: int, session_id: str, turn: int, human_message: str, ai_message: str):
         """
         会話のやりとりを短期記憶（DB）と長期記憶（ベクトルストア）の両方に保存します。
+        DBへの保存はこの場で行い、次の質問からすぐ会話履歴として参照できるようにします。
+        長期記憶への登録は、書き込み用のキュー（history_writer）があればバックグラウンドでまとめて行います。
         """
         # --- 1. 短期記憶（リレーショナルDB）への保存 ---
-        create_history_record(
-            db=self.db_session,
-            user_id=user_id,
-            session_id=session_id,
-            turn=turn,
-            human_message=human_message,
-            ai_message=ai_message
-        )
+        # 同じターンが既に保存済みの場合は何もしない
+        bulk_create_history_records(self.db_session, [{
+            "user_id": user_id,
+            "session_id": session_id,
+            "turn": turn,
+            "human_message": human_message,
+            "ai_message": ai_message,
+        }])
         logger.info(f"短期記憶（DB）に会話履歴を保存しました (Turn: {turn})")
 
         # --- 2. 長期記憶（ベクトルストア）への保存 ---
-        long_term_memory_text = f"ユーザーの質問: {human_message}\nAIの応答: {ai_message}"
+        writer = resources.get_history_writer()
+        if writer is not None:
+            # ベクトル化は他のターンとまとめて行い、応答タスクを待たせない
+            writer.submit(user_id, session_id, turn, human_message, ai_message)
+            return
         self.vectorstore_memory.add_texts(
-            texts=[long_term_memory_text],
-            metadatas=[
-                {
-                    "user_id": user_id,
-                    "session_id": session_id,
-                    "turn": turn,
-                    "type": "conversation_history" # 知識と区別するためのメタデータ
-                }
-            ]
+            texts=[memory_vector_text(human_message, ai_message)],
+            metadatas=[memory_vector_metadata(user_id, session_id, turn)],
+            ids=[memory_vector_id(user_id, session_id, turn)],
         )
         logger.info(f"長期記憶（ベクトルストア）に会話履歴を保存しました (Turn: {turn})")
-
@@ -1,40 +1,37 @@
 # backend/worker/app/tasks.py
 
 from contextlib import contextmanager
-from sqlalchemy import text
-from langchain_community.chat_models import ChatOllama
-from langchain_community.embeddings import OllamaEmbeddings
-from langchain_community.vectorstores import Chroma
 from sqlalchemy.orm import Session
+from datetime import date
 import time
-import GPUtil
 
 from shared.celery_app import celery_app
+from shared.db.pool import get_pool_metrics
 from shared.db.session import SessionLocal
-from .services.memory_service import MemoryService
-from .graph.build import build_graph, AgentState
-
-# --- Worker起動時に一度だけ読み込む設定 ---
-llm = ChatOllama(
-    model="qwen2.5:32b-instruct",
-    # model="deepseek-r1:671b",
-    # model="deepseek-r1:70b",
-    base_url="http://ollama:11434", temperature=0.0)
-
-EMBEDDINGS = OllamaEmbeddings(model="mxbai-embed-large", base_url="http://ollama:11434")
-CHROMA_KNOWLEDGE_PATH = "/app/worker/data/vectorstore_knowledge"
-CHROMA_MEMORY_PATH = "/app/worker/data/vectorstore_memory"
-vectorstore_knowledge = Chroma(persist_directory=CHROMA_KNOWLEDGE_PATH, embedding_function=EMBEDDINGS)
-rag_retriever = vectorstore_knowledge.as_retriever(
-    search_type="mmr",
-    search_kwargs={'k': 10, 'fetch_k': 50}
-)
-vectorstore_memory = Chroma(persist_directory=CHROMA_MEMORY_PATH, embedding_function=EMBEDDINGS)
+from shared.streaming import StreamPublisher
+from .services.memory_service import MEMORY_RECENT_TURNS, MEMORY_SUMMARY_ENABLED, ConversationContext, MemoryService
+from .graph import tools
+from .lifecycle import get_chat_app
+from . import resources
+
+# LLM・Embedding・ベクトルストアなどの重いオブジェクトは resources で初回利用時に生成し、
+# プロセス内で共有する。タスクモジュールのimport自体はワーカー起動を遅らせない。
+
+def answer_cache_scope() -> str:
+    """
+    キャッシュを共有できる範囲。イベント前後で回答内容（残り日数の案内など）が変わるため、
+    イベント状況と日付で区別する。グラフモードごとの回答品質を比較できるよう、モードでも区別する。
+    """
+    from .graph.build import GRAPH_MODE
+
+    return f"{GRAPH_MODE}:{tools.get_event_context()}:{date.today().isoformat()}"
 
 def wait_for_gpu(memory_threshold_mb=2000, interval=1, timeout=60):
     """
     指定した空きVRAM以上になるまで待機する関数
     """
+    import GPUtil
+
     start_time = time.time()
     while True:
         gpus = GPUtil.getGPUs()
@@ -60,10 +57,64 @@ def get_db():
     finally:
         db.close()
 
-@celery_app.task(name='worker.app.tasks.run_chat_graph')
-def run_chat_graph(user_id: int, session_id: str, user_input: str) -> str:
+@contextmanager
+def publish_error_on_failure(publisher: StreamPublisher):
+    """
+    終了イベントを発行する前に例外で終わった場合に error を発行し、
+    ストリームや結果のロングポーリングで待っているクライアントにすぐ知らせる。
+    """
+    try:
+        yield
+    except Exception as e:
+        if not publisher.finished:
+            publisher.error(str(e))
+        raise
+
+def _run_pipeline(user_input: str, context: ConversationContext, publisher: StreamPublisher, cache_scope: str, default_response: str) -> str:
+    """
+    LangGraphパイプラインを実行して応答を生成し、再利用できる応答であればキャッシュに登録する。
+    """
+    from .graph.build import AgentState, GRAPH_MODE
+
+    # プロセス起動時にコンパイル済みのグラフを使い回す
+    app = get_chat_app()
+
+    # AgentStateの初期化
+    initial_state = AgentState(
+        user_input=user_input,
+        history_messages=context.messages,
+        conversation_summary=context.summary,
+        intent="",
+        expanded_queries=[],
+        event_context="",
+        knowledge_docs=[],
+        realtime_schedule_info=None,
+        final_response="",
+        _retrieved_docs_metadata=[],
+        _retrieved_scores=[]
+    )
+
+    start = time.perf_counter()
+    final_state = app.invoke(
+        initial_state,
+        config={"configurable": {"stream_publisher": publisher}},
+    )
+    latency_seconds = time.perf_counter() - start
+    print(f"---TASK: パイプライン実行時間 (モード: {GRAPH_MODE}, 意図: {final_state.get('intent')}): {latency_seconds:.2f}s---")
+    final_response = final_state.get("final_response", default_response)
+    # 記憶への保存を待たずに、最終応答をクライアントへ届ける
+    publisher.done(final_response)
+
+    # 履歴を前提とした回答や、時刻で変わるリアルタイム情報を含む回答はキャッシュしない
+    if not context.messages and not context.summary and not final_state.get("realtime_schedule_info"):
+        resources.get_answer_cache().store(user_input, cache_scope, final_response, latency_seconds)
+    return final_response
+
+@celery_app.task(bind=True, name='worker.app.tasks.run_chat_graph')
+def run_chat_graph(self, user_id: int, session_id: str, user_input: str) -> str:
     """
     AIの思考パイプラインを呼び出し、対話処理全体を管理するタスク。
+    途中経過とLLMのトークンは、タスクIDごとのRedisチャンネルへストリーミングする。
     """
     # print(f"---TASK: GPU空き待機開始 (user_id: {user_id}, session_id: {session_id})---")
     # wait_for_gpu()
@@ -71,36 +122,30 @@ def run_chat_graph(user_id: int, session_id: str, user_input: str) -> str:
 
     print(f"---TASK: 開始 (user_id: {user_id}, session_id: {session_id})---")
     final_response = "エラーにより応答を生成できませんでした。"
-    with get_db() as db:
-        memory_service = MemoryService(db_session=db, vectorstore_memory=vectorstore_memory)
-        history_messages = memory_service.get_history(user_id=user_id, session_id=session_id)
-        
-        # build_graphに標準RAGのretrieverを渡す
-        app = build_graph(rag_retriever=rag_retriever, llm=llm)
-
-        # AgentStateの初期化
-        initial_state = AgentState(
-            user_input=user_input,
-            history_messages=history_messages,
-            intent="",
-            expanded_queries=[],
-            event_context="",
-            knowledge_docs=[],
-            realtime_schedule_info=None,
-            final_response="",
-            _retrieved_docs_metadata=[]
-        )
-        
-        final_state = app.invoke(initial_state)
-        final_response = final_state.get("final_response", final_response)
-        
-        print("---TASK: 会話を記憶に保存中---")
-        last_turn_result = db.execute(
-            text("SELECT MAX(turn) FROM conversation_history WHERE session_id = :session_id"),
-            {"session_id": session_id}
-        ).scalar()
-        current_turn = (last_turn_result or 0) + 1
+    publisher = StreamPublisher(self.request.id)
+    embeddings = resources.get_embeddings()
+    answer_cache = resources.get_answer_cache()
+    embedding_snapshot = embeddings.snapshot()
+    with publish_error_on_failure(publisher), get_db() as db:
+        memory_service = MemoryService(db_session=db, vectorstore_memory=resources.get_vectorstore_memory())
+        context = memory_service.get_context(user_id=user_id, session_id=session_id)
+
+        # 会話履歴が無い場合だけ応答キャッシュを参照する（保存する条件と同じ）。
+        # 履歴があると、同じ質問文でも直前の会話を前提にした質問の可能性がある
+        cache_scope = answer_cache_scope()
+        cached = None
+        if not context.messages and not context.summary:
+            cached = answer_cache.lookup(user_input, cache_scope)
 
+        if cached is not None:
+            final_response = cached.answer
+            publisher.done(final_response)
+        else:
+            final_response = _run_pipeline(user_input, context, publisher, cache_scope, final_response)
+
+        print("---TASK: 会話を記憶に保存中---")
+        current_turn = memory_service.next_turn(user_id=user_id, session_id=session_id)
+        # DBへの保存はこの場で行い、長期記憶のベクトル化だけをバックグラウンドでまとめて行う
         memory_service.save_history(
             user_id=user_id,
             session_id=session_id,
@@ -109,5 +154,52 @@ def run_chat_graph(user_id: int, session_id: str, user_input: str) -> str:
             ai_message=final_response,
         )
 
+    if MEMORY_SUMMARY_ENABLED and current_turn > MEMORY_RECENT_TURNS:
+        try:
+            update_conversation_summary.delay(user_id, session_id)
+        except Exception as e:
+            print(f"---TASK: 要約タスクの登録に失敗しました: {e}---")
+
+    print(f"---TASK: Embeddingキャッシュ: {embeddings.stats(since=embedding_snapshot)}---")
     print(f"---TASK: 終了 (応答: {final_response})---")
-    return final_response
\ No newline at end of file
+    return final_response
+
+@celery_app.task(name='worker.app.tasks.update_conversation_summary', ignore_result=True)
+def update_conversation_summary(user_id: int, session_id: str):
+    """
+    セッションの会話の要約を更新するタスク。応答の生成とは切り離して実行し、ユーザーを待たせない。
+    backgroundキューに送られ、要約用のワーカー（summary_worker）が処理する（celery_app の task_routes）。
+    """
+    start = time.perf_counter()
+    with get_db() as db:
+        memory_service = MemoryService(db_session=db, vectorstore_memory=None)
+        summarized_turn = memory_service.update_summary(user_id, session_id, resources.get_llm())
+    if summarized_turn is not None:
+        print(f"---TASK: 会話の要約を更新 (session_id: {session_id}, ターン{summarized_turn}まで): {time.perf_counter() - start:.2f}s---")
+
+@celery_app.task(name='worker.app.tasks.get_worker_metrics')
+def get_worker_metrics() -> dict:
+    """
+    ワーカープロセス内のキャッシュなどの計測値を返すタスク。
+    計測のためだけにリソースを生成しないよう、生成済みのものだけを集計する。
+    """
+    from .graph.build import GRAPH_MODE
+
+    registry = resources.registry
+    intent_classifier = resources.get_intent_classifier() if registry.is_loaded("intent_classifier") else None
+    return {
+        "graph_mode": GRAPH_MODE,
+        # 実際に使われている知識検索の実装（スナップショットが無い場合はChromaになる）
+        "knowledge_search": (
+            type(resources.get_vectorstore_knowledge()).__name__ if registry.is_loaded("vectorstore_knowledge") else None
+        ),
+        "answer_cache": resources.get_answer_cache().stats() if registry.is_loaded("answer_cache") else None,
+        "embedding_cache": resources.get_embeddings().stats() if registry.is_loaded("embeddings") else None,
+        "intent_classifier": intent_classifier.stats() if intent_classifier is not None else None,
+        "history_writer": (
+            resources.get_history_writer().stats()
+            if registry.is_loaded("history_writer") and resources.get_history_writer() is not None else None
+        ),
+        "db_pool": get_pool_metrics(),
+        "resources": registry.timings(),
+    }
@@ -10,6 +10,11 @@ do
 done
 echo "Database is ready!"
 
+# 起動コマンドが指定された場合（要約用の summary_worker など）は、そのコマンドで起動する
+if [ "$#" -gt 0 ]; then
+  exec "$@"
+fi
+
 echo "Starting Celery worker for GPU..."
 # ★★★ 修正点 ★★★
 # Celeryアプリケーションのパスから`backend.`を削除
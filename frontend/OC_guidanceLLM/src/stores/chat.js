@@ -1,6 +1,16 @@
 import { defineStore } from 'pinia';
 import { v4 as uuidv4 } from 'uuid';
 import apiClient from '../services/api';
+import { useAuthStore } from './auth';
+
+// 履歴を画面に表示する形式に変換する
+const toMessages = (turns) => turns.flatMap(turn => [
+  { id: uuidv4(), sender: 'user', content: turn.human_message },
+  { id: uuidv4(), sender: 'ai', content: turn.ai_message },
+]);
+
+// 結果のロングポーリングで、1回のリクエストがサーバー側で待つ秒数（サーバーの上限は30秒）
+const RESULT_WAIT_SECONDS = 25;
 
 export const useChatStore = defineStore('chat', {
   state: () => ({
@@ -9,6 +19,9 @@ export const useChatStore = defineStore('chat', {
     sessionId: localStorage.getItem('sessionId'),
     isLoading: false,
     errorMessage: null,
+    // さらに古い履歴を読み込むときの before_turn（X-Next-Before-Turn ヘッダー）。古い履歴が無ければ null
+    historyNextBeforeTurn: null,
+    isLoadingOlderHistory: false,
   }),
 
   actions: {
@@ -24,6 +37,7 @@ export const useChatStore = defineStore('chat', {
 
     /**
      * 要件: バックエンドから指定されたセッションIDの会話履歴を読み込むアクション
+     * 最新の1ページ分だけを読み込み、それより古い履歴は loadOlderHistory で読み込む。
      */
     async loadHistory() {
       if (!this.sessionId) return;
@@ -31,25 +45,42 @@ export const useChatStore = defineStore('chat', {
       this.errorMessage = null;
       try {
         const response = await apiClient.get(`/chat/history/${this.sessionId}`);
-        const loadedMessages = [];
         // 取得した履歴をmessages配列に整形して格納
-        response.data.forEach(turn => {
-          loadedMessages.push({ id: uuidv4(), sender: 'user', content: turn.human_message });
-          loadedMessages.push({ id: uuidv4(), sender: 'ai', content: turn.ai_message });
-        });
-        this.messages = loadedMessages;
+        this.messages = toMessages(response.data);
+        this.historyNextBeforeTurn = response.headers['x-next-before-turn'] ?? null;
       } catch (error) {
         console.error('[loadHistory] 履歴の読み込みに失敗しました:', error);
         // 履歴の取得に失敗した場合（例: サーバーからセッションが見つからない）、セッション情報をクリア
         localStorage.removeItem('sessionId');
         this.sessionId = null;
         this.messages = [];
+        this.historyNextBeforeTurn = null;
         this.errorMessage = '過去の会話の読み込みに失敗しました。新しい会話を開始してください。';
       } finally {
         this.isLoading = false;
       }
     },
 
+    /**
+     * 表示中の履歴より古い1ページ分を読み込み、先頭に追加する。
+     */
+    async loadOlderHistory() {
+      if (!this.sessionId || !this.historyNextBeforeTurn || this.isLoadingOlderHistory) return;
+      this.isLoadingOlderHistory = true;
+      try {
+        const response = await apiClient.get(`/chat/history/${this.sessionId}`, {
+          params: { before_turn: this.historyNextBeforeTurn },
+        });
+        this.messages = [...toMessages(response.data), ...this.messages];
+        this.historyNextBeforeTurn = response.headers['x-next-before-turn'] ?? null;
+      } catch (error) {
+        console.error('[loadOlderHistory] 以前の会話の読み込みに失敗しました:', error);
+        this.errorMessage = '以前の会話の読み込みに失敗しました。';
+      } finally {
+        this.isLoadingOlderHistory = false;
+      }
+    },
+
     /**
      * 要件: 新しい会話を開始するアクション
      */
@@ -57,6 +88,7 @@ export const useChatStore = defineStore('chat', {
       // 新しいユニークなIDを生成
       const newSessionId = uuidv4();
       this.messages = [];
+      this.historyNextBeforeTurn = null;
       this.sessionId = newSessionId;
       this.isLoading = false;
       this.errorMessage = null;
@@ -87,7 +119,11 @@ export const useChatStore = defineStore('chat', {
         });
         const { task_id } = initialResponse.data;
 
-        this.pollForResult(task_id, aiPlaceholder.id);
+        // ストリーミングで受信し、利用できない場合はポーリングに切り替える
+        this.streamResult(task_id, aiPlaceholder.id).catch((error) => {
+          console.warn('[streamResult] ストリーミングに失敗したため、ポーリングに切り替えます:', error);
+          this.pollForResult(task_id, aiPlaceholder.id);
+        });
 
       } catch (error) {
         console.error('Error sending message:', error);
@@ -103,29 +139,88 @@ export const useChatStore = defineStore('chat', {
       }
     },
 
-    pollForResult(taskId, placeholderId) {
-      const interval = setInterval(async () => {
-        try {
-          const statusResponse = await apiClient.get(`/chat/results/${taskId}`);
+    /**
+     * SSEでタスクの途中経過とトークンを受信し、プレースホルダーを逐次更新する。
+     * EventSourceはAuthorizationヘッダーを付与できないため、fetchのストリームを読む。
+     */
+    async streamResult(taskId, placeholderId) {
+      const authStore = useAuthStore();
+      const response = await fetch(`${apiClient.defaults.baseURL}/chat/stream/${taskId}`, {
+        headers: {
+          Accept: 'text/event-stream',
+          Authorization: `Bearer ${authStore.accessToken}`,
+        },
+      });
+      if (!response.ok || !response.body) {
+        throw new Error(`stream request failed: ${response.status}`);
+      }
+
+      const message = this.messages.find(m => m.id === placeholderId);
+      const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+      let buffer = '';
+
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += value;
+
+        // SSEのイベントは空行で区切られる
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+          const rawEvent = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+          const dataLine = rawEvent.split('\n').find(line => line.startsWith('data: '));
+          if (!dataLine || !message) continue;
+
+          const event = JSON.parse(dataLine.slice('data: '.length));
+          if (event.type === 'progress') {
+            message.statusText = event.message;
+          } else if (event.type === 'token') {
+            message.isStreaming = true;
+            message.isPending = false;
+            message.content += event.text;
+          } else if (event.type === 'done' || event.type === 'error') {
+            message.content = event.type === 'done' ? event.ai_message : 'エラー: 応答の生成に失敗しました。';
+            message.isPending = false;
+            message.isStreaming = false;
+            this.isLoading = false;
+            reader.cancel();
+            return;
+          }
+        }
+      }
+      // 終了イベントを受け取る前に切断された場合は、ポーリングで結果を取得する
+      throw new Error('stream closed before completion');
+    },
+
+    /**
+     * ロングポーリングで結果を取得する。サーバーはタスクが完了した時点で応答するため、
+     * 完了するか待ち時間が過ぎるまで1つのリクエストで待ち、未完了なら再度リクエストする。
+     */
+    async pollForResult(taskId, placeholderId) {
+      try {
+        while (true) {
+          const statusResponse = await apiClient.get(`/chat/results/${taskId}`, {
+            params: { wait: RESULT_WAIT_SECONDS },
+          });
           const { status, ai_message } = statusResponse.data;
 
           if (status === 'SUCCESS' || status === 'FAILURE') {
-            clearInterval(interval);
             this.isLoading = false;
-            
+
             const finalMessage = status === 'SUCCESS' ? ai_message : 'エラー: 応答の生成に失敗しました。';
-            
+
             const message = this.messages.find(m => m.id === placeholderId);
             if (message) {
               message.content = finalMessage;
               message.isPending = false;
             }
+            return;
           }
-        } catch (error) {
-          clearInterval(interval);
-          this.handleSendError(error, placeholderId);
         }
-      }, 2000);
+      } catch (error) {
+        this.handleSendError(error, placeholderId);
+      }
     },
 
     handleSendError(error, placeholderId) {
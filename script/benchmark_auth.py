@@ -0,0 +1,134 @@
+# script/benchmark_auth.py
+
+import os
+import sys
+import logging
+import argparse
+import statistics
+import time
+from typing import Callable, Dict, List
+
+# --- パス設定 ---
+try:
+    _current_file_path = os.path.abspath(__file__)
+    _script_dir = os.path.dirname(_current_file_path)
+    _project_root = os.path.dirname(os.path.dirname(_script_dir))
+    if _project_root not in sys.path:
+        sys.path.append(_project_root)
+except NameError:
+    if os.getcwd() not in sys.path:
+        sys.path.append(os.getcwd())
+
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from api_gateway.app.dependencies import get_current_user
+from shared.db.session import SessionLocal, engine
+from shared.services.auth_service import AuthService
+from shared.services.principal_cache import Principal, get_principal_cache
+from shared.services.user_service import UserService
+
+# --- ロギング設定 ---
+log_format = '%(asctime)s - %(levelname)s - %(message)s'
+logging.basicConfig(level=logging.INFO, format=log_format)
+# TestClient のリクエストごとのログを抑える
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+class QueryCounter:
+    """エンジンで実行されたSQLの数を数える。"""
+
+    def __init__(self, target_engine):
+        self.count = 0
+        event.listen(target_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args, **kwargs):
+        self.count += 1
+
+
+def build_app() -> FastAPI:
+    """
+    認証の依存関係だけを持つエンドポイント。chat_router と同じく、ルーター全体と引数の両方で get_current_user を指定する。
+    """
+    app = FastAPI(dependencies=[Depends(get_current_user)])
+
+    @app.get("/whoami")
+    def whoami(current_user: Principal = Depends(get_current_user)):
+        return {"id": current_user.id}
+
+    return app
+
+
+def run_scenario(client: TestClient, token: str, rounds: int, counter: QueryCounter, before_each: Callable[[], None]) -> Dict[str, float]:
+    headers = {"Authorization": f"Bearer {token}"}
+    latencies: List[float] = []
+    queries_before = counter.count
+    for _ in range(rounds):
+        before_each()
+        started = time.perf_counter()
+        response = client.get("/whoami", headers=headers)
+        latencies.append((time.perf_counter() - started) * 1000)
+        response.raise_for_status()
+    latencies.sort()
+    return {
+        "mean_ms": round(statistics.mean(latencies), 3),
+        "p50_ms": round(latencies[len(latencies) // 2], 3),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 3),
+        "db_queries_per_request": round((counter.count - queries_before) / rounds, 2),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="認証済みリクエスト1回あたりの、ユーザーの特定にかかる時間とDBへの問い合わせ回数を計測します。"
+    )
+    parser.add_argument("--username", required=True, help="計測に使う既存のユーザー名")
+    parser.add_argument("--rounds", type=int, default=500, help="シナリオごとのリクエスト数")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    auth_service = AuthService()
+    db = SessionLocal()
+    try:
+        user = UserService(auth_service=auth_service).get_by_username(db, username=args.username)
+        if user is None:
+            logging.error(f"ユーザー {args.username} が見つかりません。")
+            sys.exit(1)
+        # 従来のトークン（ユーザー名のみ）と、ユーザーIDとトークンの世代を含むトークン
+        legacy_token = auth_service.create_access_token(data={"sub": user.username})
+        token = auth_service.create_access_token(data={"sub": user.username, "uid": user.id, "ver": user.token_version or 0})
+    finally:
+        db.close()
+
+    cache = get_principal_cache()
+    counter = QueryCounter(engine)
+    client = TestClient(build_app())
+    clear_local = cache.clear if cache is not None else (lambda: None)
+    clear_all = (lambda: cache.invalidate(user.id)) if cache is not None else (lambda: None)
+
+    results = {
+        # ユーザー名でDBを引く、従来どおりの経路
+        "legacy_token": run_scenario(client, legacy_token, args.rounds, counter, lambda: None),
+        # 毎回キャッシュを破棄し、DBから引き直す
+        "cache_miss": run_scenario(client, token, args.rounds, counter, clear_all),
+    }
+    if cache is not None:
+        if cache.redis_client is not None:
+            # プロセス内のキャッシュだけを破棄し、Redisから引く（別のプロセスが先にキャッシュした場合）
+            results["redis_hit"] = run_scenario(client, token, args.rounds, counter, clear_local)
+        results["local_hit"] = run_scenario(client, token, args.rounds, counter, lambda: None)
+    else:
+        logging.warning("PRINCIPAL_CACHE_ENABLED=false のため、キャッシュのシナリオは計測しません。")
+
+    logging.info(f"--- 結果 ({args.rounds} リクエスト / シナリオ) ---")
+    for name, summary in results.items():
+        logging.info(f"  {name:<13} {summary}")
+    if cache is not None:
+        logging.info(f"  キャッシュ: {cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
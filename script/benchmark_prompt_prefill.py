@@ -0,0 +1,146 @@
+# script/benchmark_prompt_prefill.py
+
+import os
+import sys
+import json
+import logging
+import argparse
+import statistics
+import urllib.request
+from typing import Any, Dict, List
+
+# --- パス設定 ---
+try:
+    _current_file_path = os.path.abspath(__file__)
+    _script_dir = os.path.dirname(_current_file_path)
+    _project_root = os.path.dirname(os.path.dirname(_script_dir))
+    if _project_root not in sys.path:
+        sys.path.append(_project_root)
+except NameError:
+    if os.getcwd() not in sys.path:
+        sys.path.append(os.getcwd())
+
+from worker.app.graph.prompts import PROMPTS, get_prompt
+from worker.app.resources import CHAT_MODEL, OLLAMA_BASE_URL, OLLAMA_KEEP_ALIVE
+
+# --- ロギング設定 ---
+log_format = '%(asctime)s - %(levelname)s - %(message)s'
+logging.basicConfig(level=logging.INFO, format=log_format)
+
+# --- 定数設定 ---
+SAMPLE_QUESTIONS = [
+    "山口研のメンバーは？",
+    "無料送迎バスの時刻を教えてください",
+    "経営システム工学科ではどんな展示がありますか？",
+    "昼食はどこで食べられますか？",
+    "学生寮について知りたいです",
+    "総合型選抜のプレゼン講座は何時からですか？",
+    "知能メカトロニクス学科の概要を教えて",
+    "奨学金の制度はありますか？",
+]
+ROLE_NAMES = {"system": "system", "human": "user", "ai": "assistant"}
+
+
+def to_ollama_messages(messages: List[Any]) -> List[Dict[str, str]]:
+    return [{"role": ROLE_NAMES[role], "content": content} for role, content in messages]
+
+
+def build_messages(template_name: str, question: str, stable: bool) -> List[Dict[str, str]]:
+    """
+    stable=True: ワーカーと同じく、固定部分を先頭・リクエストごとの部分を末尾に置く。
+    stable=False: リクエストごとの部分を固定部分より前に置き、先頭が毎回変わる従来の並びを再現する。
+    """
+    template = get_prompt(template_name)
+    values = {
+        "user_input": question, "history": "なし", "summary": "", "reference_info": "【参考情報】:\nなし",
+        "turns": f"ユーザー: {question}", "max_chars": 300,
+    }
+    if stable:
+        return to_ollama_messages(template.render(**values))
+    dynamic = template.user_template.format(**values)
+    return to_ollama_messages([("system", f"{dynamic}\n\n{template.system}"), ("human", question)])
+
+
+def chat(messages: List[Dict[str, str]], model: str, base_url: str, keep_alive: str) -> Dict[str, Any]:
+    """Ollamaの /api/chat を呼び、1トークンだけ生成して計測値を返す。"""
+    payload = {
+        "model": model,
+        "messages": messages,
+        "stream": False,
+        "keep_alive": keep_alive,
+        "options": {"temperature": 0.0, "num_predict": 1},
+    }
+    request = urllib.request.Request(
+        f"{base_url}/api/chat",
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request, timeout=600) as response:
+        return json.loads(response.read())
+
+
+def run_scenario(args, stable: bool) -> List[Dict[str, float]]:
+    label = "先頭固定" if stable else "先頭が変化"
+    # 1回目はモデルのロードと固定部分のプリフィルを含むため、計測から除く
+    chat(build_messages(args.template, SAMPLE_QUESTIONS[-1], stable), args.model, args.base_url, args.keep_alive)
+
+    samples = []
+    for i in range(args.rounds):
+        question = SAMPLE_QUESTIONS[i % len(SAMPLE_QUESTIONS)]
+        result = chat(build_messages(args.template, question, stable), args.model, args.base_url, args.keep_alive)
+        sample = {
+            "prompt_eval_count": result.get("prompt_eval_count", 0),
+            "prompt_eval_ms": result.get("prompt_eval_duration", 0) / 1e6,
+            "total_ms": result.get("total_duration", 0) / 1e6,
+        }
+        samples.append(sample)
+        logging.info(
+            f"  [{label}] {i + 1}/{args.rounds}: 評価トークン {sample['prompt_eval_count']}, "
+            f"プリフィル {sample['prompt_eval_ms']:.0f}ms, 合計 {sample['total_ms']:.0f}ms"
+        )
+    return samples
+
+
+def summarize(samples: List[Dict[str, float]]) -> Dict[str, float]:
+    return {
+        "prompt_eval_count_mean": round(statistics.mean(s["prompt_eval_count"] for s in samples), 1),
+        "prefill_ms_p50": round(statistics.median(s["prompt_eval_ms"] for s in samples), 1),
+        "prefill_ms_mean": round(statistics.mean(s["prompt_eval_ms"] for s in samples), 1),
+        "total_ms_p50": round(statistics.median(s["total_ms"] for s in samples), 1),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="プロンプトの先頭部分を固定した場合と、毎回変わる場合で、Ollamaのプリフィル時間を比較します。"
+    )
+    parser.add_argument("--template", choices=sorted(PROMPTS), default="fused_router", help="計測に使うプロンプト")
+    parser.add_argument("--rounds", type=int, default=8, help="シナリオごとのリクエスト数")
+    parser.add_argument("--model", default=CHAT_MODEL)
+    parser.add_argument("--base-url", default=OLLAMA_BASE_URL)
+    parser.add_argument("--keep-alive", default=OLLAMA_KEEP_ALIVE)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    template = get_prompt(args.template)
+    logging.info(
+        f"プロンプト: {args.template} (固定部分 {len(template.system)} 文字, fingerprint {template.fingerprint}), "
+        f"モデル: {args.model}, keep_alive: {args.keep_alive}"
+    )
+    # 2つのシナリオを交互に実行するとキャッシュを奪い合うため、順に実行する
+    results = {
+        "stable_prefix": summarize(run_scenario(args, stable=True)),
+        "varying_prefix": summarize(run_scenario(args, stable=False)),
+    }
+    logging.info("--- 結果 ---")
+    for name, summary in results.items():
+        logging.info(f"  {name:<15} {summary}")
+    stable_ms = results["stable_prefix"]["prefill_ms_p50"]
+    if stable_ms > 0:
+        logging.info(f"  プリフィル時間の比 (p50, 変化 / 固定): {results['varying_prefix']['prefill_ms_p50'] / stable_ms:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+# script/benchmark_vector_search.py
+
+import os
+import sys
+import json
+import logging
+import argparse
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+# --- パス設定 ---
+try:
+    _current_file_path = os.path.abspath(__file__)
+    _script_dir = os.path.dirname(_current_file_path)
+    _project_root = os.path.dirname(os.path.dirname(_script_dir))
+    if _project_root not in sys.path:
+        sys.path.append(_project_root)
+except NameError:
+    if os.getcwd() not in sys.path:
+        sys.path.append(os.getcwd())
+
+from worker.app.rag.snapshot_index import SNAPSHOT_META_FILENAME, SnapshotVectorStore, export_snapshot, snapshot_matrix_path
+
+# --- ロギング設定 ---
+log_format = '%(asctime)s - %(levelname)s - %(message)s'
+logging.basicConfig(level=logging.INFO, format=log_format)
+
+# --- 定数設定 ---
+VECTORSTORE_PATH = "/app/worker/data/vectorstore_knowledge"
+BACKENDS = ("chroma", "snapshot")
+
+
+def memory_usage() -> Dict[str, float]:
+    """
+    現在のプロセスのメモリ使用量（MiB）。
+    RssFile はメモリマップしたファイルのページで、他のプロセスとページキャッシュを共有できる部分。
+    """
+    usage = {}
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "RssAnon", "RssFile"):
+                    usage[key] = round(int(value.split()[0]) / 1024, 1)
+    except OSError:
+        # /proc の無い環境では、最大RSSだけを記録する
+        usage["VmRSS"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return usage
+
+
+def open_store(backend: str, store_path: str):
+    if backend == "snapshot":
+        return SnapshotVectorStore(store_path, embedding_function=None)
+    from langchain_community.vectorstores import Chroma
+
+    return Chroma(persist_directory=store_path, embedding_function=None)
+
+
+def run_child(args) -> None:
+    """1つの検索方式を計測し、結果をJSONで標準出力に書く（親プロセスから別プロセスとして起動される）。"""
+    queries = np.load(args.query_file)
+    before = memory_usage()
+
+    started = time.perf_counter()
+    store = open_store(args.child, args.store)
+    if args.search_type == "mmr":
+        search = lambda v: store.max_marginal_relevance_search_by_vector(v, k=args.k, fetch_k=args.fetch_k)
+    else:
+        search = lambda v: store.similarity_search_by_vector(v, k=args.k)
+    # 初回の検索でスナップショットの読み込み・Chromaのインデックスの読み込みが行われる
+    first_results = search(queries[0].tolist())
+    open_seconds = time.perf_counter() - started
+    opened = memory_usage()
+
+    latencies = []
+    results = [[doc.page_content for doc in first_results]]
+    for vector in queries[1:]:
+        search_started = time.perf_counter()
+        docs = search(vector.tolist())
+        latencies.append((time.perf_counter() - search_started) * 1000)
+        results.append([doc.page_content for doc in docs])
+
+    print(json.dumps({
+        "backend": args.child,
+        "open_seconds": open_seconds,
+        "latencies_ms": latencies,
+        "memory_before": before,
+        "memory_after_open": opened,
+        "memory_after": memory_usage(),
+        "results": results,
+    }, ensure_ascii=False))
+
+
+def build_synthetic_store(directory: str, rows: int, dimension: int, seed: int) -> None:
+    """ランダムなEmbeddingで、Chromaのコレクションとスナップショットを同じ内容で作る。"""
+    from langchain_community.vectorstores import Chroma
+
+    rng = np.random.default_rng(seed)
+    matrix = rng.standard_normal((rows, dimension), dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    ids = [f"chunk-{i}" for i in range(rows)]
+    texts = [f"ダミーのチャンク {i}" for i in range(rows)]
+    metadatas = [{"source": f"synthetic_{i % 50}.md"} for i in range(rows)]
+
+    collection = Chroma(persist_directory=directory, embedding_function=None)._collection
+    batch_size = 1000
+    for start in range(0, rows, batch_size):
+        end = start + batch_size
+        collection.upsert(
+            ids=ids[start:end], embeddings=matrix[start:end].tolist(),
+            documents=texts[start:end], metadatas=metadatas[start:end],
+        )
+    export_snapshot(directory, ids, matrix, texts, metadatas)
+
+
+def make_queries(store_path: str, count: int, noise: float, seed: int) -> np.ndarray:
+    """格納済みのEmbeddingにノイズを加えたものを検索クエリにする（Ollamaを呼ばずに実際の分布に近いクエリを作る）。"""
+    matrix = np.load(snapshot_matrix_path(store_path), mmap_mode="r")
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(matrix), size=count)
+    queries = np.asarray(matrix[rows], dtype=np.float32)
+    queries += rng.standard_normal(queries.shape, dtype=np.float32) * noise / np.sqrt(queries.shape[1])
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def summarize(report: dict) -> Dict[str, float]:
+    latencies = np.asarray(report["latencies_ms"])
+    return {
+        "open_s": round(report["open_seconds"], 3),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "mean_ms": round(float(latencies.mean()), 3),
+        "rss_delta_mib": round(report["memory_after"]["VmRSS"] - report["memory_before"]["VmRSS"], 1),
+        "rss_file_mib": report["memory_after"].get("RssFile"),
+        "rss_anon_mib": report["memory_after"].get("RssAnon"),
+    }
+
+
+def overlap(a: List[List[str]], b: List[List[str]]) -> float:
+    """2つの検索方式で、クエリごとの上位k件が一致する割合の平均。"""
+    ratios = [len(set(x) & set(y)) / max(len(x), 1) for x, y in zip(a, b)]
+    return sum(ratios) / max(len(ratios), 1)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="知識検索のChromaDB経由と、メモリマップしたスナップショット(NumPy)経由を、レイテンシとRSSで比較します。"
+    )
+    parser.add_argument("--store", default=VECTORSTORE_PATH, help="load_knowledge.py で構築したベクトルストアのディレクトリ")
+    parser.add_argument("--queries", type=int, default=200, help="計測する検索回数")
+    parser.add_argument("--search-type", choices=("mmr", "similarity"), default="mmr", help="検索方式（ワーカーの既定は mmr）")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--fetch-k", type=int, default=50)
+    parser.add_argument("--noise", type=float, default=0.5, help="クエリとして格納済みのEmbeddingに加えるノイズの大きさ")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--synthetic", type=int, default=0, metavar="ROWS",
+        help="既存のベクトルストアの代わりに、指定した行数のランダムなEmbeddingで一時的なストアを作って計測する",
+    )
+    parser.add_argument("--dimension", type=int, default=1024, help="--synthetic で作るEmbeddingの次元数")
+    parser.add_argument("--child", choices=BACKENDS, help=argparse.SUPPRESS)
+    parser.add_argument("--query-file", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.child:
+        run_child(args)
+        return
+
+    work_dir = tempfile.mkdtemp(prefix="vector_search_benchmark_")
+    try:
+        store_path = args.store
+        if args.synthetic:
+            store_path = os.path.join(work_dir, "store")
+            os.makedirs(store_path)
+            logging.info(f"{args.synthetic} 行 x {args.dimension} 次元のダミーのストアを作成します...")
+            build_synthetic_store(store_path, args.synthetic, args.dimension, args.seed)
+        elif not os.path.exists(os.path.join(store_path, SNAPSHOT_META_FILENAME)):
+            logging.error(f"スナップショットが見つかりません: {store_path}。先に load_knowledge.py を実行してください。")
+            return
+
+        query_file = os.path.join(work_dir, "queries.npy")
+        np.save(query_file, make_queries(store_path, args.queries + 1, args.noise, args.seed))
+
+        # RSSを公平に比べるため、検索方式ごとに新しいプロセスで計測する
+        reports = {}
+        for backend in BACKENDS:
+            logging.info(f"{backend} を計測しています...")
+            completed = subprocess.run(
+                [
+                    sys.executable, os.path.abspath(__file__), "--child", backend, "--store", store_path,
+                    "--query-file", query_file, "--search-type", args.search_type,
+                    "--k", str(args.k), "--fetch-k", str(args.fetch_k),
+                ],
+                check=True, capture_output=True, text=True,
+            )
+            reports[backend] = json.loads(completed.stdout.strip().splitlines()[-1])
+
+        logging.info(f"--- 検索方式: {args.search_type} (k={args.k}, fetch_k={args.fetch_k}), 検索回数: {args.queries} ---")
+        for backend, report in reports.items():
+            logging.info(f"  {backend:<9} {summarize(report)}")
+        chroma_p50 = summarize(reports["chroma"])["p50_ms"]
+        snapshot_p50 = summarize(reports["snapshot"])["p50_ms"]
+        if snapshot_p50 > 0:
+            logging.info(f"  p50の比 (chroma / snapshot): {chroma_p50 / snapshot_p50:.1f}x")
+        logging.info(
+            f"  上位{args.k}件の一致率: {overlap(reports['chroma']['results'], reports['snapshot']['results']):.1%} "
+            "(Chromaの距離関数がL2のため、Embeddingが正規化されていないと順位が一部異なる)"
+        )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,8 @@ from neo4j import GraphDatabase
 from langchain_community.document_loaders import UnstructuredMarkdownLoader
 from langchain_core.documents import Document # Documentクラスをインポート
 import re
+import time
+from collections import defaultdict
 from typing import Any, List, Dict # List, Dict も追加
 
 # --- ロギング設定 ---
@@ -20,6 +22,24 @@ NEO4J_URI = "bolt://neo4j:7687"
 NEO4J_USERNAME = "neo4j"
 NEO4J_PASSWORD = "password"
 
+# --- グラフのスキーマ ---
+# name が一意となるノードのラベル（一意制約を作成し、MERGE・MATCHでインデックスを使えるようにする）
+NODE_LABELS = ("Lab", "Exhibition", "Person")
+# 関係の種類ごとの始点・終点ラベル。ラベルを指定してMATCHすることで、全ノードの走査を避ける
+RELATION_ENDPOINTS = {
+    "HAS_HEAD_PROFESSOR": ("Lab", "Person"),
+    "HAS_EXHIBITION": ("Lab", "Exhibition"),
+    "HAS_SCHEDULED_EXHIBITION": ("Lab", "Exhibition"),
+    "HAS_PRESENTER": ("Exhibition", "Person"),
+    "SCHEDULED_PRESENTER": ("Exhibition", "Person"),
+}
+# graph_retriever が検索に使う全文検索インデックス（名前を変える場合は両方を揃える）
+FULLTEXT_INDEX_NAME = "knowledge_fulltext"
+# 日本語は空白で区切られないため、CJK文字をbi-gramに分割するアナライザーを使う
+FULLTEXT_ANALYZER = "cjk"
+# 1つの UNWIND 文でまとめて書き込む行数
+GRAPH_WRITE_BATCH_SIZE = int(os.getenv("GRAPH_WRITE_BATCH_SIZE", "500"))
+
 # SpaCy日本語モデルのロード
 try:
     nlp = spacy.load("ja_core_news_sm")
@@ -203,43 +223,121 @@ def extract_entities_and_relations(doc_page_content: Any, source_path: str) -> (
     logging.info(f"  Extraction Result - Entities: {len(entities)}, Relations: {len(relations)}")
     return entities, relations
 
-def create_graph_nodes_and_relations(entities, relations):
-    """Neo4jにノードと関係を作成する"""
+def create_constraints():
+    """ノードのラベルごとに name の一意制約を作成する（作成済みの場合は何もしない）。"""
     with driver.session() as session:
-        logging.info(f"--- Batch processing: Creating/Merging {len(entities)} Nodes and {len(relations)} Relationships ---")
+        for label in NODE_LABELS:
+            session.run(
+                f"CREATE CONSTRAINT {label.lower()}_name_unique IF NOT EXISTS "
+                f"FOR (n:{label}) REQUIRE n.name IS UNIQUE"
+            )
+            logging.info(f"  一意制約を確認しました: (:{label}).name")
 
-        # 1. ノードの作成とプロパティ設定
-        for ent in entities:
-            try:
-                session.run(f"MERGE (n:{ent['label']} {{name: $name}})", name=ent["name"])
 
-                props_to_set = {k: v for k, v in ent.items() if k not in ["name", "label", "source_path"]}
+def create_fulltext_index():
+    """
+    研究室・出展・人物の名前と説明文を対象に、全文検索インデックスを作成する（作成済みの場合は何もしない）。
+    """
+    labels = "|".join(NODE_LABELS)
+    with driver.session() as session:
+        session.run(
+            f"CREATE FULLTEXT INDEX {FULLTEXT_INDEX_NAME} IF NOT EXISTS "
+            f"FOR (n:{labels}) ON EACH [n.name, n.description, n.vision] "
+            f"OPTIONS {{indexConfig: {{`fulltext.analyzer`: '{FULLTEXT_ANALYZER}'}}}}"
+        )
+        logging.info(f"  全文検索インデックスを確認しました: {FULLTEXT_INDEX_NAME} ({labels})")
 
-                if props_to_set:
-                    session.run(f"MATCH (n:{ent['label']} {{name: $name}}) SET n += $props", 
-                                name=ent["name"], props=props_to_set)
-                    logging.info(f"  MERGED Node: (:{ent['label']} {{name: '{ent['name']}'}}), SET Props: {list(props_to_set.keys())}, Values: {props_to_set}")
-                else:
-                    logging.info(f"  MERGED Node: (:{ent['label']} {{name: '{ent['name']}'}}), No additional props to set.")
-            except Exception as e:
-                logging.error(f"  Error creating/setting node {ent.get('name', 'N/A')}: {e}")
 
-        # 2. 関係性の作成とプロパティ設定
-        for rel in relations:
-            try:
-                rel_properties = rel.get('properties', {}) 
-                logging.info(f"  Processing Relation: Start='{rel['start']}', End='{rel['end']}', Type='{rel['type']}', Props: {list(rel_properties.keys())}")
+def group_nodes(entities: List[Dict]) -> Dict[str, List[Dict]]:
+    """
+    エンティティをラベルごとの書き込み行にまとめる。
+    同じノードが複数回現れた場合は、出現順にプロパティを上書きした結果を1行にする。
+    """
+    merged: Dict[tuple, Dict] = {}
+    for ent in entities:
+        if ent["label"] not in NODE_LABELS:
+            logging.warning(f"  未知のラベルのためスキップします: {ent['label']} ({ent.get('name')})")
+            continue
+        props = {k: v for k, v in ent.items() if k not in ["name", "label", "source_path"]}
+        merged.setdefault((ent["label"], ent["name"]), {}).update(props)
+
+    rows_by_label: Dict[str, List[Dict]] = defaultdict(list)
+    for (label, name), props in merged.items():
+        rows_by_label[label].append({"name": name, "props": props})
+    return rows_by_label
+
 
-                session.run(f"""
-                    MATCH (a {{name: $start_node_name}}), (b {{name: $end_node_name}})
-                    MERGE (a)-[r:{rel['type']}]->(b)
-                    SET r += $properties
-                """, start_node_name=rel['start'], end_node_name=rel['end'], properties=rel_properties)
-                logging.info(f"  MERGED Relation: ('{rel['start']}')-[:{rel['type']}]->('{rel['end']}')")
-            except Exception as e:
-                logging.error(f"  Error creating/setting relationship {rel.get('start', 'N/A')}-{rel.get('type', 'N/A')}-{rel.get('end', 'N/A')}: {e}")
+def group_relations(relations: List[Dict]) -> Dict[str, List[Dict]]:
+    """関係を種類ごとの書き込み行にまとめる。"""
+    merged: Dict[tuple, Dict] = {}
+    for rel in relations:
+        if rel["type"] not in RELATION_ENDPOINTS:
+            logging.warning(f"  未知の関係のためスキップします: {rel['type']} ({rel.get('start')} -> {rel.get('end')})")
+            continue
+        merged.setdefault((rel["type"], rel["start"], rel["end"]), {}).update(rel.get("properties", {}))
+
+    rows_by_type: Dict[str, List[Dict]] = defaultdict(list)
+    for (rel_type, start_name, end_name), props in merged.items():
+        rows_by_type[rel_type].append({"start": start_name, "end": end_name, "props": props})
+    return rows_by_type
+
+
+def _write_batches(session, cypher: str, rows: List[Dict]) -> int:
+    """行を GRAPH_WRITE_BATCH_SIZE 件ずつ、明示的な書き込みトランザクションで UNWIND する。"""
+    statements = 0
+    for i in range(0, len(rows), GRAPH_WRITE_BATCH_SIZE):
+        batch = rows[i:i + GRAPH_WRITE_BATCH_SIZE]
+        session.execute_write(lambda tx: tx.run(cypher, rows=batch).consume())
+        statements += 1
+    return statements
 
-        logging.info(f"Batch processing completed.")
+
+def create_graph_nodes_and_relations(entities, relations):
+    """
+    Neo4jにノードと関係を作成する。
+    ラベル・関係の種類ごとにパラメータ化した UNWIND 文をバッチで実行し、書き込みのスループットを表示する。
+    """
+    nodes_by_label = group_nodes(entities)
+    relations_by_type = group_relations(relations)
+    node_count = sum(len(rows) for rows in nodes_by_label.values())
+    relation_count = sum(len(rows) for rows in relations_by_type.values())
+    logging.info(f"--- Batch processing: Creating/Merging {node_count} Nodes and {relation_count} Relationships ---")
+
+    statements = 0
+    with driver.session() as session:
+        # 1. ノードの作成とプロパティ設定
+        node_started = time.perf_counter()
+        for label, rows in nodes_by_label.items():
+            cypher = f"""
+                UNWIND $rows AS row
+                MERGE (n:{label} {{name: row.name}})
+                SET n += row.props
+            """
+            statements += _write_batches(session, cypher, rows)
+            logging.info(f"  MERGED Nodes: (:{label}) x {len(rows)}")
+        node_seconds = time.perf_counter() - node_started
+
+        # 2. 関係性の作成とプロパティ設定（始点・終点はラベルと一意制約のインデックスで引く）
+        relation_started = time.perf_counter()
+        for rel_type, rows in relations_by_type.items():
+            start_label, end_label = RELATION_ENDPOINTS[rel_type]
+            cypher = f"""
+                UNWIND $rows AS row
+                MATCH (a:{start_label} {{name: row.start}})
+                MATCH (b:{end_label} {{name: row.end}})
+                MERGE (a)-[r:{rel_type}]->(b)
+                SET r += row.props
+            """
+            statements += _write_batches(session, cypher, rows)
+            logging.info(f"  MERGED Relations: (:{start_label})-[:{rel_type}]->(:{end_label}) x {len(rows)}")
+        relation_seconds = time.perf_counter() - relation_started
+
+    total_seconds = node_seconds + relation_seconds
+    logging.info("--- 書き込みのスループット ---")
+    logging.info(f"  ノード: {node_count} 件 / {node_seconds:.3f}s ({node_count / node_seconds if node_seconds else 0.0:.1f} 件/秒)")
+    logging.info(f"  関係: {relation_count} 件 / {relation_seconds:.3f}s ({relation_count / relation_seconds if relation_seconds else 0.0:.1f} 件/秒)")
+    logging.info(f"  合計: {statements} 文 (バッチサイズ {GRAPH_WRITE_BATCH_SIZE}) / {total_seconds:.3f}s")
+    logging.info(f"Batch processing completed.")
 
 
 def main():
@@ -255,16 +353,26 @@ def main():
         session.run("MATCH (n) DETACH DELETE n")
         logging.info("既存のグラフデータをクリアしました。")
 
+    # 一意制約（とそれに伴うインデックス）と全文検索インデックスは、書き込みより前に用意する
+    create_constraints()
+    create_fulltext_index()
+
+    # 全ドキュメントから抽出した結果をまとめて、ラベル・関係の種類ごとに一括で書き込む
+    all_entities = []
+    all_relations = []
     for doc in all_documents:
         source_path = doc.metadata.get("source", "unknown_source")
         logging.info(f"処理中ドキュメント: {source_path}")
         entities, relations = extract_entities_and_relations(doc.page_content, source_path)
 
-        if entities or relations: 
-            create_graph_nodes_and_relations(entities, relations)
+        if entities or relations:
+            all_entities.extend(entities)
+            all_relations.extend(relations)
         else:
             logging.info(f"  ドキュメント {source_path} からエンティティや関係性が見つかりませんでした。")
 
+    create_graph_nodes_and_relations(all_entities, all_relations)
+
     logging.info("--- 知識グラフ構築完了！ ---")
     driver.close()
 
@@ -8,10 +8,12 @@ import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from shared.db.models import Base
+from migrate_db import run_migrations
 
 def init_database():
     """
     データベースに接続し、テーブルが存在しない場合のみ作成する。
+    既存のDBには、create_all では反映されないスキーマの変更（列・一意制約の追加など）を migrate_db で適用する。
     DBが起動するまで最大10回リトライする。
     """
     db_url = os.getenv("DATABASE_URL")
@@ -48,5 +50,10 @@ def init_database():
         print(f"An error occurred during table creation: {e}")
         sys.exit(1)
 
+    print("Applying migrations...")
+    if not run_migrations(engine):
+        sys.exit(1)
+    print("Migrations applied successfully.")
+
 if __name__ == "__main__":
     init_database()
\ No newline at end of file
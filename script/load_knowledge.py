@@ -4,7 +4,21 @@ import os
 import sys
 import logging
 import json
-from typing import List, Dict, Any
+import argparse
+import hashlib
+import queue
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+
+import numpy as np
 
 # --- パス設定 ---
 try:
@@ -21,6 +35,11 @@ from langchain_community.vectorstores import Chroma
 from langchain_community.embeddings import OllamaEmbeddings
 from langchain_text_splitters import MarkdownHeaderTextSplitter, RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from worker.app.rag.embedding_cache import CachedEmbeddings
+from worker.app.rag.lexical import LEXICAL_INDEX_FILENAME, BM25Index
+from worker.app.rag.snapshot_index import SNAPSHOT_META_FILENAME, export_snapshot
 
 # --- ロギング設定 ---
 log_format = '%(asctime)s - %(levelname)s - %(message)s'
@@ -29,10 +48,31 @@ logging.basicConfig(level=logging.INFO, format=log_format)
 # --- 定数設定 ---
 KNOWLEDGE_BASE_DIR = "backend/worker/data/knowledge"
 VECTORSTORE_PATH = "/app/worker/data/vectorstore_knowledge"
-EMBEDDINGS = OllamaEmbeddings(model="mxbai-embed-large", base_url="http://ollama:11434")
+# 変更のないチャンクは再構築時にOllamaへ問い合わせず、ワーカーと共有するキャッシュから読む
+EMBEDDINGS = CachedEmbeddings(
+    OllamaEmbeddings(model="mxbai-embed-large", base_url="http://ollama:11434"),
+    model_name="mxbai-embed-large",
+)
 CHUNK_SIZE = 800
 CHUNK_OVERLAP = 100
 SHORT_DOC_THRESHOLD = 500
+# ワーカーの応答キャッシュは、このファイルの内容が変わると古いエントリを無効にする
+KNOWLEDGE_VERSION_FILENAME = "knowledge_version.txt"
+# 差分取り込み用のマニフェスト（ファイルごとの内容ハッシュと、登録したチャンクID）
+MANIFEST_FILENAME = "ingest_manifest.json"
+# 前処理・分割の方法を変えたときは値を上げ、次回の取り込みを全件再構築にする
+INGEST_SCHEMA_VERSION = 2
+
+# --- 取り込みパイプラインの設定 ---
+# 1回のEmbedding・Chromaへの書き込みでまとめて扱うチャンク数
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+# Embeddingを並行に計算するスレッド数
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "4"))
+# 書き込みが終わっていないバッチの上限。これを超えると読み込み・分割を待たせる（背圧）
+EMBED_MAX_INFLIGHT = int(os.getenv("EMBED_MAX_INFLIGHT", str(EMBED_WORKERS * 2)))
+# Embeddingに失敗したバッチの再試行回数と、指数バックオフの初期待ち時間（秒）
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "3"))
+EMBED_RETRY_BACKOFF_SECONDS = float(os.getenv("EMBED_RETRY_BACKOFF_SECONDS", "1.0"))
 
 
 def parse_metadata_from_path(file_path: str) -> Dict[str, Any]:
@@ -42,7 +82,8 @@ def parse_metadata_from_path(file_path: str) -> Dict[str, Any]:
     relative_path = os.path.relpath(file_path, KNOWLEDGE_BASE_DIR)
     parts = relative_path.split(os.sep)
     
-    metadata = {"source": os.path.basename(file_path)}
+    # ファイル名は研究室・学科ごとに重複する（01_研究室概要.md など）ため、引用の区別には相対パスを使う
+    metadata = {"source": os.path.basename(file_path), "source_path": relative_path.replace(os.sep, "/")}
     
     if len(parts) > 1:
         metadata["category_l1"] = parts[0][3:] if parts[0][:2].isdigit() and parts[0][2] == '_' else parts[0]
@@ -100,31 +141,49 @@ def convert_json_to_text(data: Any, metadata: Dict[str, Any]) -> str:
     return "\n\n".join(texts)
 # ★★★ ここまで修正 ★★★
 
-def load_and_prepare_documents(directory: str) -> List[Document]:
+def load_document(file_path: str) -> Optional[Document]:
     """
-    ディレクトリを走査し、各ファイルをDocumentオブジェクトとして読み込む。
+    1つのファイルをDocumentオブジェクトとして読み込む。
+    対象外の形式や、変換後の内容が空の場合はNoneを返す。
     """
-    prepared_docs = []
+    metadata = parse_metadata_from_path(file_path)
+    if file_path.endswith(".md"):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        return Document(page_content=content, metadata=metadata)
+
+    if file_path.endswith(".json"):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        content = convert_json_to_text(data, metadata)
+        if content:
+            return Document(page_content=content, metadata=metadata)
+    return None
+
+def list_knowledge_files(directory: str) -> List[str]:
+    """
+    ディレクトリを走査し、取り込み対象のファイルパスを一覧にする。
+    """
+    file_paths = []
     for root, _, files in os.walk(directory):
         for file in files:
             if file.startswith('.'): continue
-            file_path = os.path.join(root, file)
-            metadata = parse_metadata_from_path(file_path)
-            
-            try:
-                if file.endswith(".md"):
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                    prepared_docs.append(Document(page_content=content, metadata=metadata))
-                
-                elif file.endswith(".json"):
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                    content = convert_json_to_text(data, metadata)
-                    if content:
-                        prepared_docs.append(Document(page_content=content, metadata=metadata))
-            except Exception as e:
-                logging.error(f"ファイルの読み込み中にエラー: {file_path}, 詳細: {e}")
+            if file.endswith((".md", ".json")):
+                file_paths.append(os.path.join(root, file))
+    return sorted(file_paths)
+
+def load_and_prepare_documents(directory: str) -> List[Document]:
+    """
+    ディレクトリを走査し、各ファイルをDocumentオブジェクトとして読み込む。
+    """
+    prepared_docs = []
+    for file_path in list_knowledge_files(directory):
+        try:
+            doc = load_document(file_path)
+            if doc is not None:
+                prepared_docs.append(doc)
+        except Exception as e:
+            logging.error(f"ファイルの読み込み中にエラー: {file_path}, 詳細: {e}")
     return prepared_docs
 
 def split_documents(documents: List[Document]) -> List[Document]:
@@ -162,49 +221,443 @@ def split_documents(documents: List[Document]) -> List[Document]:
     return all_chunks
 
 
+def write_knowledge_version(vectorstore_path: str) -> str:
+    """
+    知識ベースのバージョン（構築日時）を書き出す。
+    ワーカーはこの値をもとに、再構築前の知識で生成した応答キャッシュを破棄する。
+    """
+    version = datetime.now().strftime("%Y%m%d%H%M%S%f")
+    with open(os.path.join(vectorstore_path, KNOWLEDGE_VERSION_FILENAME), "w", encoding="utf-8") as f:
+        f.write(version)
+    return version
+
+
+def write_lexical_index(collection, vectorstore_path: str) -> BM25Index:
+    """
+    ChromaDBに登録済みの全チャンクからBM25索引を作り、ベクトルストアと同じディレクトリに保存する。
+    差分更新でも常にコレクション全体から作り直すため、ベクトル検索と同じチャンク集合を検索対象にできる。
+    """
+    index = BM25Index.from_collection(collection)
+    index.save(os.path.join(vectorstore_path, LEXICAL_INDEX_FILENAME))
+    return index
+
+
+def write_vector_snapshot(collection, vectorstore_path: str) -> int:
+    """
+    ChromaDBに登録済みの全チャンクのEmbeddingを、ワーカーがメモリマップして検索するスナップショットとして書き出す。
+    戻り値は書き出したチャンク数。
+    """
+    data = collection.get(include=["embeddings", "documents", "metadatas"])
+    return export_snapshot(
+        vectorstore_path,
+        ids=data["ids"],
+        embeddings=data["embeddings"],
+        texts=data["documents"],
+        metadatas=[m or {} for m in data["metadatas"]],
+    )
+
+
+def write_search_indexes(collection, vectorstore_path: str) -> None:
+    """ベクトルストアから派生する検索用ファイル（BM25索引・ベクトルスナップショット）をまとめて書き出す。"""
+    started = time.perf_counter()
+    index = write_lexical_index(collection, vectorstore_path)
+    logging.info(
+        f"BM25索引を保存しました ({len(index)} チャンク, 語彙数 {len(index.postings)}, "
+        f"{time.perf_counter() - started:.2f}s)"
+    )
+    started = time.perf_counter()
+    rows = write_vector_snapshot(collection, vectorstore_path)
+    logging.info(f"ベクトル検索用スナップショットを保存しました ({rows} チャンク, {time.perf_counter() - started:.2f}s)")
+
+
+def file_content_hash(file_path: str) -> str:
+    """ファイル内容のSHA-256ハッシュ。"""
+    with open(file_path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def chunk_id(relative_path: str, index: int, content: str) -> str:
+    """
+    ファイルの相対パス・ファイル内での順番・内容から決まるチャンクID。
+    同じ入力からは常に同じIDになるため、再実行してもチャンクが重複しない。
+    """
+    raw = f"{relative_path}\0{index}\0{content}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def ingest_settings() -> Dict[str, Any]:
+    """この値が変わった場合、既存のチャンクは使い回せないため全件を再構築する。"""
+    return {
+        "schema_version": INGEST_SCHEMA_VERSION,
+        "embedding_model": EMBEDDINGS.model_name,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "short_doc_threshold": SHORT_DOC_THRESHOLD,
+    }
+
+
+def load_manifest(vectorstore_path: str) -> Optional[Dict[str, Any]]:
+    manifest_path = os.path.join(vectorstore_path, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logging.warning(f"マニフェストを読み込めないため、全件を再構築します: {e}")
+        return None
+
+
+def save_manifest(vectorstore_path: str, manifest: Dict[str, Any]) -> None:
+    """途中で中断しても壊れたマニフェストが残らないよう、一時ファイル経由で置き換える。"""
+    manifest_path = os.path.join(vectorstore_path, MANIFEST_FILENAME)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+class StageTimer:
+    """
+    パイプラインの各ステージの累積所要時間と処理件数を、スレッドをまたいで集計する。
+    """
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.items = defaultdict(int)
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, stage: str, items: int = 0):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.seconds[stage] += elapsed
+                self.calls[stage] += 1
+                self.items[stage] += items
+
+    def add_retry(self):
+        with self._lock:
+            self.retries += 1
+
+
+class StubEmbeddings(Embeddings):
+    """
+    Ollamaを使わずにパイプラインの性能を測るための、決定的なダミーのEmbedding。
+    テキストのハッシュから乱数ベクトルを作り、1回の呼び出しごとに指定の待ち時間を入れる。
+    """
+
+    def __init__(self, dimension: int = 1024, latency_seconds: float = 0.0):
+        self.dimension = dimension
+        self.latency_seconds = latency_seconds
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def embed_with_retry(embeddings: Embeddings, texts: List[str], timer: StageTimer) -> List[List[float]]:
+    """
+    バッチをベクトル化する。失敗した場合は指数バックオフ（ジッター付き）で再試行する。
+    """
+    for attempt in range(EMBED_MAX_RETRIES + 1):
+        try:
+            return embeddings.embed_documents(texts)
+        except Exception as e:
+            if attempt == EMBED_MAX_RETRIES:
+                raise
+            wait = EMBED_RETRY_BACKOFF_SECONDS * (2 ** attempt) * (1 + random.random() * 0.1)
+            timer.add_retry()
+            logging.warning(f"Embeddingに失敗したため {wait:.1f}s 後に再試行します ({attempt + 1}/{EMBED_MAX_RETRIES}): {e}")
+            time.sleep(wait)
+
+
+def prepare_file_chunks(file_path: str, timer: Optional[StageTimer] = None) -> tuple:
+    """
+    1ファイル分のチャンクと、その決定的なIDを作る。
+    """
+    timer = timer or StageTimer()
+    relative_path = os.path.relpath(file_path, KNOWLEDGE_BASE_DIR)
+    with timer.measure("load"):
+        doc = load_document(file_path)
+    if doc is None:
+        return [], []
+    with timer.measure("split"):
+        chunks = split_documents([doc])
+    ids = [chunk_id(relative_path, i, chunk.page_content) for i, chunk in enumerate(chunks)]
+    return chunks, ids
+
+
+def run_ingest_pipeline(
+    relative_paths: List[str],
+    collection,
+    embeddings: Embeddings,
+    timer: StageTimer,
+    batch_size: int = EMBED_BATCH_SIZE,
+    workers: int = EMBED_WORKERS,
+    max_inflight: int = EMBED_MAX_INFLIGHT,
+) -> Dict[str, List[str]]:
+    """
+    読み込み → 分割 → バッチ単位のEmbedding（スレッドプール） → Chromaへのバッチupsert を
+    ストリーミングで実行する。
+
+    - 読み込み・分割はメインスレッドで行い、チャンクが batch_size 件たまるごとにEmbeddingへ渡す。
+    - 書き込みが終わっていないバッチが max_inflight 件に達すると、次のバッチの投入を待たせる。
+    - Chromaへの書き込みは専用の1スレッドで行う。IDが決定的なため、upsertは何度実行しても重複しない。
+    いずれかのバッチが再試行後も失敗した場合は、残りを打ち切って例外を送出する。
+    戻り値は、取り込めたファイルの相対パスとチャンクIDの対応。
+    """
+    file_chunk_ids: Dict[str, List[str]] = {}
+    errors: List[Exception] = []
+    stop = threading.Event()
+    inflight = threading.BoundedSemaphore(max_inflight)
+    upsert_queue: "queue.Queue" = queue.Queue(maxsize=max_inflight)
+
+    def writer():
+        while True:
+            item = upsert_queue.get()
+            if item is None:
+                return
+            ids, chunks, vectors = item
+            try:
+                if not stop.is_set():
+                    with timer.measure("upsert", items=len(ids)):
+                        collection.upsert(
+                            ids=ids,
+                            embeddings=vectors,
+                            documents=[chunk.page_content for chunk in chunks],
+                            metadatas=[chunk.metadata for chunk in chunks],
+                        )
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+            finally:
+                inflight.release()
+
+    def embed_batch(ids: List[str], chunks: List[Document]):
+        try:
+            with timer.measure("embed", items=len(chunks)):
+                vectors = embed_with_retry(embeddings, [chunk.page_content for chunk in chunks], timer)
+            upsert_queue.put((ids, chunks, vectors))
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+            inflight.release()
+
+    writer_thread = threading.Thread(target=writer, daemon=True)
+    writer_thread.start()
+    pending_ids: List[str] = []
+    pending_chunks: List[Document] = []
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        def submit(ids, chunks):
+            inflight.acquire()
+            pool.submit(embed_batch, ids, chunks)
+
+        for path in relative_paths:
+            if stop.is_set():
+                break
+            try:
+                chunks, ids = prepare_file_chunks(os.path.join(KNOWLEDGE_BASE_DIR, path), timer)
+            except Exception as e:
+                # マニフェストに記録しないことで、次回の実行で再度取り込みを試みる
+                logging.error(f"ファイルの読み込み中にエラー: {path}, 詳細: {e}")
+                continue
+            file_chunk_ids[path] = ids
+            pending_ids.extend(ids)
+            pending_chunks.extend(chunks)
+            while len(pending_ids) >= batch_size:
+                submit(pending_ids[:batch_size], pending_chunks[:batch_size])
+                pending_ids, pending_chunks = pending_ids[batch_size:], pending_chunks[batch_size:]
+
+        if pending_ids and not stop.is_set():
+            submit(pending_ids, pending_chunks)
+
+    upsert_queue.put(None)
+    writer_thread.join()
+    if errors:
+        raise errors[0]
+    return file_chunk_ids
+
+
+def report_pipeline(timer: StageTimer, wall_seconds: float, file_count: int, batch_size: int, workers: int) -> None:
+    """チャンク/秒と、ステージごとの所要時間を表示する。"""
+    chunks = timer.items["upsert"]
+    logging.info("--- 取り込みパイプラインの計測結果 ---")
+    logging.info(f"  ファイル数: {file_count} / チャンク数: {chunks} / バッチサイズ: {batch_size} / Embeddingスレッド数: {workers}")
+    logging.info(f"  全体: {wall_seconds:.2f}s ({chunks / wall_seconds if wall_seconds else 0.0:.1f} チャンク/秒)")
+    for stage in ("load", "split", "embed", "upsert"):
+        calls = timer.calls[stage]
+        if not calls:
+            continue
+        # embed は複数スレッドの累積時間のため、全体の所要時間を上回ることがある
+        logging.info(
+            f"  {stage:<7} 累積 {timer.seconds[stage]:.2f}s / {calls} 回 "
+            f"(平均 {timer.seconds[stage] / calls * 1000:.1f}ms/回)"
+        )
+    logging.info(f"  Embeddingの再試行: {timer.retries} 回")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="知識ベース（ChromaDB）を構築・更新します。")
+    parser.add_argument(
+        "--full", action="store_true",
+        help="マニフェストを無視して、コレクションを作り直す（全件再構築）",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true",
+        help="変更内容の集計だけを行い、ベクトルストアは更新しない",
+    )
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE, help="Embedding・書き込みのバッチサイズ")
+    parser.add_argument("--workers", type=int, default=EMBED_WORKERS, help="Embeddingを並行に計算するスレッド数")
+    parser.add_argument(
+        "--benchmark", action="store_true",
+        help="全ファイルを一時ディレクトリのChromaへ取り込み、チャンク/秒とステージごとの所要時間を表示する",
+    )
+    parser.add_argument(
+        "--stub-embeddings", action="store_true",
+        help="Ollamaの代わりにダミーのEmbeddingを使う（--benchmark 用）",
+    )
+    parser.add_argument(
+        "--stub-latency-ms", type=float, default=50.0,
+        help="ダミーのEmbeddingで、1バッチごとに入れる待ち時間（ミリ秒）",
+    )
+    return parser.parse_args()
+
+
+def run_benchmark(args) -> None:
+    """
+    マニフェスト・本番のベクトルストアには触れずに、全ファイルの取り込みを計測する。
+    Ollamaを使う場合も、キャッシュで結果が歪まないようEmbeddingキャッシュを通さない。
+    """
+    if args.stub_embeddings:
+        embeddings = StubEmbeddings(latency_seconds=args.stub_latency_ms / 1000)
+        logging.info(f"ダミーのEmbeddingで計測します (待ち時間 {args.stub_latency_ms:.0f}ms/バッチ)")
+    else:
+        embeddings = EMBEDDINGS.underlying
+        logging.info(f"{EMBEDDINGS.model_name} (Ollama経由, キャッシュなし) で計測します")
+
+    relative_paths = [os.path.relpath(path, KNOWLEDGE_BASE_DIR) for path in list_knowledge_files(KNOWLEDGE_BASE_DIR)]
+    benchmark_dir = tempfile.mkdtemp(prefix="knowledge_benchmark_")
+    try:
+        vectorstore = Chroma(persist_directory=benchmark_dir, embedding_function=embeddings)
+        timer = StageTimer()
+        started = time.perf_counter()
+        run_ingest_pipeline(
+            relative_paths, vectorstore._collection, embeddings, timer,
+            batch_size=args.batch_size, workers=args.workers, max_inflight=max(args.workers * 2, 1),
+        )
+        report_pipeline(timer, time.perf_counter() - started, len(relative_paths), args.batch_size, args.workers)
+    finally:
+        shutil.rmtree(benchmark_dir, ignore_errors=True)
+
+
 def main():
+    args = parse_args()
+    if args.benchmark:
+        run_benchmark(args)
+        return
+
+    started = time.perf_counter()
     logging.info("--- 知識ベースの構築を開始します ---")
 
-    logging.info("\nステップ1: ドキュメントの読み込みと前処理...")
-    prepared_documents = load_and_prepare_documents(KNOWLEDGE_BASE_DIR)
-    if not prepared_documents:
+    logging.info("\nステップ1: 取り込み対象ファイルの走査と差分の検出...")
+    file_paths = list_knowledge_files(KNOWLEDGE_BASE_DIR)
+    if not file_paths:
         logging.error(f"エラー: {KNOWLEDGE_BASE_DIR} からドキュメントを読み込めませんでした。")
         return
-    logging.info(f"合計 {len(prepared_documents)} ファイルを処理対象として読み込みました。")
+    current_hashes = {os.path.relpath(path, KNOWLEDGE_BASE_DIR): file_content_hash(path) for path in file_paths}
 
-    logging.info("\nステップ2: ドキュメントの分割 (ハイブリッド・チャンキング)...")
-    split_chunks = split_documents(prepared_documents)
-    logging.info(f"ドキュメントの分割完了。合計 {len(split_chunks)} 個のチャンクを作成しました。")
-    
-    if split_chunks:
-        logging.info("--- 生成されたチャンクの例 ---")
-        for i, chunk in enumerate(split_chunks[:2] + split_chunks[-2:]):
-            content_preview = chunk.page_content[:150].strip().replace('\n', ' ')
-            logging.info(f"  [チャンク {i}] メタデータ: {chunk.metadata}")
-            logging.info(f"  内容抜粋: {content_preview}...")
-        logging.info("--------------------------")
-
-    logging.info("\nステップ3: Embeddingモデルの確認...")
-    logging.info(f"モデル名: {EMBEDDINGS.model} (Ollama経由)")
-
-    logging.info("\nステップ4: ドキュメントをベクトル化し、ChromaDBに保存...")
-    logging.info(f"保存先: {VECTORSTORE_PATH}")
-    
-    if not split_chunks:
-        logging.warning("!!! 警告: 保存対象のチャンクがありません。処理を終了します。")
+    manifest = load_manifest(VECTORSTORE_PATH)
+    settings = ingest_settings()
+    full_rebuild = args.full or manifest is None or manifest.get("settings") != settings
+    if full_rebuild and not args.full:
+        logging.info("マニフェストが無い、または取り込み設定が変わったため、全件を再構築します。")
+    previous_files = {} if full_rebuild else manifest.get("files", {})
+
+    added = [path for path in current_hashes if path not in previous_files]
+    changed = [path for path in current_hashes if path in previous_files and previous_files[path]["hash"] != current_hashes[path]]
+    removed = [path for path in previous_files if path not in current_hashes]
+    unchanged = [path for path in current_hashes if path in previous_files and previous_files[path]["hash"] == current_hashes[path]]
+
+    logging.info(f"  - 追加: {len(added)} / 変更: {len(changed)} / 削除: {len(removed)} / 変更なし: {len(unchanged)}")
+    for label, paths in (("追加", added), ("変更", changed), ("削除", removed)):
+        for path in paths:
+            logging.info(f"    [{label}] {path}")
+
+    if args.dry_run:
+        logging.info("--dry-run のため、ベクトルストアは更新せずに終了します。")
         return
+    if not full_rebuild and not (added or changed or removed):
+        derived_files = (LEXICAL_INDEX_FILENAME, SNAPSHOT_META_FILENAME)
+        if not all(os.path.exists(os.path.join(VECTORSTORE_PATH, name)) for name in derived_files):
+            # 検索用ファイルの導入前に構築されたベクトルストアには、それらだけを追加で作る
+            vectorstore = Chroma(persist_directory=VECTORSTORE_PATH, embedding_function=EMBEDDINGS)
+            write_search_indexes(vectorstore._collection, VECTORSTORE_PATH)
+        logging.info("\n--- 変更がないため、知識ベースは最新です ---")
+        return
+
+    logging.info("\nステップ2: Embeddingモデルの確認...")
+    logging.info(f"モデル名: {EMBEDDINGS.model_name} (Ollama経由)")
+
+    logging.info("\nステップ3: 変更のあったファイルを読み込み・分割・ベクトル化し、ChromaDBに保存...")
+    logging.info(f"保存先: {VECTORSTORE_PATH}")
+    logging.info(f"バッチサイズ: {args.batch_size} / Embeddingスレッド数: {args.workers}")
 
     try:
-        vectorstore = Chroma.from_documents(
-            documents=split_chunks,
-            embedding=EMBEDDINGS,
-            persist_directory=VECTORSTORE_PATH
+        vectorstore = Chroma(persist_directory=VECTORSTORE_PATH, embedding_function=EMBEDDINGS)
+        if full_rebuild:
+            # IDを指定せずに登録された過去のチャンクも含めて、コレクションを作り直す
+            vectorstore.delete_collection()
+            vectorstore = Chroma(persist_directory=VECTORSTORE_PATH, embedding_function=EMBEDDINGS)
+            deleted_ids = []
+        else:
+            deleted_ids = [cid for path in changed + removed for cid in previous_files[path].get("chunk_ids", [])]
+            if deleted_ids:
+                vectorstore.delete(ids=deleted_ids)
+
+        timer = StageTimer()
+        pipeline_started = time.perf_counter()
+        file_chunk_ids = run_ingest_pipeline(
+            added + changed, vectorstore._collection, EMBEDDINGS, timer,
+            batch_size=args.batch_size, workers=args.workers,
         )
-        
+        report_pipeline(timer, time.perf_counter() - pipeline_started, len(added + changed), args.batch_size, args.workers)
+
+        files_manifest = {path: previous_files[path] for path in unchanged}
+        for path, ids in file_chunk_ids.items():
+            files_manifest[path] = {"hash": current_hashes[path], "chunk_ids": ids}
+        save_manifest(VECTORSTORE_PATH, {"settings": settings, "files": files_manifest})
+        added_count = sum(len(ids) for ids in file_chunk_ids.values())
+
         collection_count = vectorstore._collection.count()
         logging.info(f"ベクトルストアへの保存が完了。DB内のドキュメント総数: {collection_count}")
-        
+        logging.info(f"Embeddingキャッシュ: {EMBEDDINGS.stats()}")
+        logging.info(
+            f"変更の概要: {'全件再構築' if full_rebuild else '差分更新'}, "
+            f"チャンク追加 {added_count} 件, チャンク削除 {len(deleted_ids)} 件, "
+            f"所要時間 {time.perf_counter() - started:.1f}s"
+        )
+
+        write_search_indexes(vectorstore._collection, VECTORSTORE_PATH)
+
         if collection_count > 0:
+             version = write_knowledge_version(VECTORSTORE_PATH)
+             logging.info(f"知識ベースのバージョンを更新しました: {version}")
              logging.info("\n--- 知識ベースの構築が正常に完了しました！ ---")
         else:
              logging.warning("!!! 警告: データベースへの保存処理は成功しましたが、ドキュメント数が0です。")
@@ -214,4 +667,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
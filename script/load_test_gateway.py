@@ -0,0 +1,145 @@
+# script/load_test_gateway.py
+
+import json
+import uuid
+import logging
+import argparse
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+# --- ロギング設定 ---
+log_format = '%(asctime)s - %(levelname)s - %(message)s'
+logging.basicConfig(level=logging.INFO, format=log_format)
+
+# --- 定数設定 ---
+# イベント当日に最も多いリクエスト（結果のポーリング）を中心に、画面の再読み込みで発生するリクエストを混ぜる
+SCENARIOS = {
+    "poll": ["results"],
+    "reload": ["latest", "history"],
+    "mixed": ["results", "results", "results", "latest", "history", "health"],
+}
+
+
+def login(base_url: str, username: str, password: str) -> str:
+    data = urllib.parse.urlencode({"username": username, "password": password}).encode("utf-8")
+    request = urllib.request.Request(f"{base_url}/auth/login", data=data)
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.loads(response.read())["access_token"]
+
+
+def build_path(kind: str, session_id: Optional[str]) -> str:
+    if kind == "results":
+        # 存在しないタスクIDは PENDING になり、認証と結果バックエンドの参照だけを計測できる
+        return f"/chat/results/{uuid.uuid4()}"
+    if kind == "latest":
+        return "/chat/sessions/latest"
+    if kind == "history":
+        return f"/chat/history/{session_id}" if session_id else "/chat/sessions/latest"
+    return "/health/ready"
+
+
+def run_load(base_url: str, token: str, args) -> Dict[str, float]:
+    """duration 秒の間、concurrency 個のスレッドからリクエストを送り続け、スループットとレイテンシを集計する。"""
+    kinds = SCENARIOS[args.scenario]
+    headers = {"Authorization": f"Bearer {token}"}
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+
+    def worker(index: int) -> None:
+        nonlocal errors
+        count = index
+        local_latencies = []
+        local_errors = 0
+        while time.perf_counter() < deadline:
+            kind = kinds[count % len(kinds)]
+            count += 1
+            request = urllib.request.Request(base_url + build_path(kind, args.session_id), headers=headers)
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=args.timeout) as response:
+                    response.read()
+            except urllib.error.HTTPError as e:
+                # 503（ワーカー準備中）や 404（履歴なし）はゲートウェイが応答できているため、エラーに数えない
+                if e.code >= 500 and e.code != 503:
+                    local_errors += 1
+            except Exception:
+                local_errors += 1
+                continue
+            local_latencies.append((time.perf_counter() - started) * 1000)
+        with lock:
+            latencies.extend(local_latencies)
+            errors += local_errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(worker, range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    if not latencies:
+        return {"requests": 0, "errors": errors}
+
+    def percentile(p: float) -> float:
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 1)
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="API Gatewayに同時リクエストを送り、スループット（req/s）とレイテンシ（p50/p99）を計測します。"
+                    "--base-url を複数指定すると（例: 同期版と非同期版のゲートウェイ）、結果を比較します。"
+    )
+    parser.add_argument("--base-url", action="append", required=True, help="計測するゲートウェイのURL（複数指定可）")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="poll")
+    parser.add_argument("--session-id", default=None, help="history のリクエストで読むセッションID")
+    parser.add_argument("--concurrency", type=int, default=64, help="同時に送るリクエスト数")
+    parser.add_argument("--duration", type=float, default=30.0, help="ゲートウェイごとの計測時間（秒）")
+    parser.add_argument("--warmup", type=float, default=3.0, help="計測前のウォームアップ時間（秒）")
+    parser.add_argument("--timeout", type=float, default=30.0, help="1リクエストのタイムアウト（秒）")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    results = {}
+    for base_url in args.base_url:
+        base_url = base_url.rstrip("/")
+        token = login(base_url, args.username, args.password)
+        logging.info(f"{base_url}: ウォームアップ中 ({args.warmup}s)")
+        run_load(base_url, token, argparse.Namespace(**{**vars(args), "duration": args.warmup}))
+        logging.info(f"{base_url}: 計測中 (シナリオ {args.scenario}, 同時 {args.concurrency}, {args.duration}s)")
+        results[base_url] = run_load(base_url, token, args)
+        logging.info(f"  {results[base_url]}")
+
+    logging.info("--- 結果 ---")
+    for base_url, summary in results.items():
+        logging.info(f"  {base_url:<30} {summary}")
+    if len(results) >= 2:
+        baseline_url, baseline = next(iter(results.items()))
+        for base_url, summary in list(results.items())[1:]:
+            if baseline.get("rps") and summary.get("rps"):
+                logging.info(
+                    f"  {base_url} / {baseline_url}: req/s {summary['rps'] / baseline['rps']:.2f}x, "
+                    f"p99 {summary['p99_ms'] / baseline['p99_ms']:.2f}x"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import os
+import sys
+import argparse
+
+from sqlalchemy import create_engine, inspect, text
+
+# backend.shared... からインポートするためにパスを追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from shared.db.models import Base
+
+# init_db.py の create_all は既存のテーブルを変更しないため、既存のDBに対するスキーマの変更はここで適用する。
+# 各マイグレーションは「適用が必要か」を確認してから実行するので、何度実行しても結果は変わらない。
+# init_db.py（entrypoint.sh・db-init から実行される）が create_all の後に run_migrations を呼ぶため、
+# コンテナの起動時に自動で適用される。このスクリプトは --dry-run での確認や、手動での適用に使う。
+
+
+def _unique_constraint_names(inspector, table: str) -> set:
+    names = {c["name"] for c in inspector.get_unique_constraints(table)}
+    # MySQLでは一意制約が一意インデックスとして返されることがある
+    names |= {i["name"] for i in inspector.get_indexes(table) if i.get("unique")}
+    return names
+
+
+def create_missing_tables(engine, dry_run: bool) -> None:
+    """モデルにあってDBに無いテーブルを作成する。"""
+    existing = set(inspect(engine).get_table_names())
+    missing = [table.name for table in Base.metadata.sorted_tables if table.name not in existing]
+    if not missing:
+        print("  - 作成が必要なテーブルはありません。")
+        return
+    print(f"  - 作成するテーブル: {', '.join(missing)}")
+    if not dry_run:
+        Base.metadata.create_all(bind=engine)
+
+
+def renumber_duplicate_turns(connection, dry_run: bool) -> None:
+    """
+    同じ (user_id, session_id) で turn が重複している行を、(turn, id) の順に 1, 2, ... と振り直す。
+    一意制約を追加する前に、過去の同時実行で生じた重複を解消しておく。
+    """
+    duplicated = connection.execute(text(
+        "SELECT user_id, session_id FROM conversation_history "
+        "GROUP BY user_id, session_id, turn HAVING COUNT(*) > 1"
+    )).fetchall()
+    sessions = sorted({(row.user_id, row.session_id) for row in duplicated})
+    if not sessions:
+        print("  - 重複したターンはありません。")
+        return
+    print(f"  - ターンが重複しているセッション: {len(sessions)} 件（ターン数を振り直します）")
+    if dry_run:
+        return
+
+    for user_id, session_id in sessions:
+        rows = connection.execute(
+            text(
+                "SELECT id FROM conversation_history WHERE user_id = :user_id AND session_id = :session_id "
+                "ORDER BY turn, id"
+            ),
+            {"user_id": user_id, "session_id": session_id},
+        ).fetchall()
+        # 振り直しの途中で一時的に重複しないよう、いったん負の値に退避してから正の値にする
+        for turn, row in enumerate(rows, start=1):
+            connection.execute(text("UPDATE conversation_history SET turn = :turn WHERE id = :id"), {"turn": -turn, "id": row.id})
+        connection.execute(
+            text("UPDATE conversation_history SET turn = -turn WHERE user_id = :user_id AND session_id = :session_id"),
+            {"user_id": user_id, "session_id": session_id},
+        )
+
+
+def add_history_turn_unique_constraint(engine, dry_run: bool) -> None:
+    """conversation_history に (user_id, session_id, turn) の一意制約を追加する（書き込みの冪等性のため）。"""
+    name = "uq_history_user_id_session_id_turn"
+    if name in _unique_constraint_names(inspect(engine), "conversation_history"):
+        print(f"  - 一意制約 {name} は作成済みです。")
+        return
+    with engine.begin() as connection:
+        renumber_duplicate_turns(connection, dry_run)
+        print(f"  - 一意制約 {name} を追加します。")
+        if not dry_run:
+            connection.execute(text(
+                f"CREATE UNIQUE INDEX {name} ON conversation_history (user_id, session_id, turn)"
+            ))
+
+
+def drop_redundant_history_index(engine, dry_run: bool) -> None:
+    """
+    (user_id, session_id) のインデックスは、一意制約 (user_id, session_id, turn) の先頭部分と重複するため削除する。
+    一意制約が無いDBでは、検索に使うため残す。
+    """
+    name = "ix_user_id_session_id"
+    inspector = inspect(engine)
+    if name not in {i["name"] for i in inspector.get_indexes("conversation_history")}:
+        print(f"  - インデックス {name} はありません。")
+        return
+    if "uq_history_user_id_session_id_turn" not in _unique_constraint_names(inspector, "conversation_history"):
+        print(f"  - 一意制約が無いため、インデックス {name} を残します。")
+        return
+    print(f"  - 重複するインデックス {name} を削除します。")
+    if not dry_run:
+        with engine.begin() as connection:
+            if engine.dialect.name == "mysql":
+                connection.execute(text(f"DROP INDEX {name} ON conversation_history"))
+            else:
+                connection.execute(text(f"DROP INDEX {name}"))
+
+
+def backfill_chat_sessions(engine, dry_run: bool) -> None:
+    """会話履歴はあるが chat_sessions に行が無いセッションについて、最後のターン数と最終更新日時を登録する。"""
+    missing_sessions = (
+        "FROM conversation_history h "
+        "WHERE NOT EXISTS (SELECT 1 FROM chat_sessions s WHERE s.user_id = h.user_id AND s.session_id = h.session_id) "
+        "GROUP BY h.user_id, h.session_id"
+    )
+    if "chat_sessions" not in inspect(engine).get_table_names():
+        # --dry-run でテーブルがまだ作成されていない場合は、全てのセッションが登録の対象になる
+        missing_sessions = "FROM conversation_history h GROUP BY h.user_id, h.session_id"
+    with engine.begin() as connection:
+        count = connection.execute(text(f"SELECT COUNT(*) FROM (SELECT h.user_id {missing_sessions}) AS missing")).scalar()
+        if not count:
+            print("  - 登録が必要なセッションはありません。")
+            return
+        print(f"  - chat_sessions に登録するセッション: {count} 件")
+        if not dry_run:
+            connection.execute(text(
+                "INSERT INTO chat_sessions (user_id, session_id, last_turn, last_activity, created_at) "
+                f"SELECT h.user_id, h.session_id, MAX(h.turn), MAX(h.created_at), MIN(h.created_at) {missing_sessions}"
+            ))
+
+
+def add_user_token_version(engine, dry_run: bool) -> None:
+    """users にトークンの世代 (token_version) の列を追加する。既存のユーザーは 0 から始める。"""
+    if "token_version" in {c["name"] for c in inspect(engine).get_columns("users")}:
+        print("  - 列 users.token_version は作成済みです。")
+        return
+    print("  - 列 users.token_version を追加します。")
+    if not dry_run:
+        with engine.begin() as connection:
+            connection.execute(text("ALTER TABLE users ADD COLUMN token_version INTEGER NOT NULL DEFAULT 0"))
+
+
+MIGRATIONS = [
+    ("テーブルの作成", create_missing_tables),
+    ("会話履歴のターンの一意制約", add_history_turn_unique_constraint),
+    ("会話履歴の重複インデックスの削除", drop_redundant_history_index),
+    ("chat_sessions の初期データ", backfill_chat_sessions),
+    ("ユーザーのトークンの世代", add_user_token_version),
+]
+
+
+def run_migrations(engine, dry_run: bool = False) -> bool:
+    """MIGRATIONS を順に適用する。失敗した場合はそこで止めて False を返す。"""
+    for label, migration in MIGRATIONS:
+        print(f"[{label}]")
+        try:
+            migration(engine, dry_run)
+        except Exception as e:
+            print(f"Error: マイグレーション「{label}」に失敗しました: {e}")
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="既存のデータベースに、スキーマの変更を適用します。")
+    parser.add_argument("--dry-run", action="store_true", help="適用が必要な変更を表示するだけで、DBは変更しない")
+    args = parser.parse_args()
+
+    db_url = os.getenv("DATABASE_URL")
+    if not db_url:
+        print("Error: DATABASE_URL is not set.")
+        sys.exit(1)
+
+    engine = create_engine(db_url)
+    if not run_migrations(engine, args.dry_run):
+        sys.exit(1)
+    print("Migration finished." if not args.dry_run else "Dry run finished (no changes were made).")
+
+
+if __name__ == "__main__":
+    main()